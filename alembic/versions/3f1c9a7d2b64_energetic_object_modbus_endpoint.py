@@ -0,0 +1,28 @@
+"""energetic_object_modbus_endpoint
+
+Revision ID: 3f1c9a7d2b64
+Revises: aa98c4b27ae4
+Create Date: 2026-10-18 10:12:31.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, None] = 'aa98c4b27ae4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('energetic_objects', sa.Column('modbus_host', sa.String(), nullable=True, comment='Адрес Modbus TCP шлюза объекта'))
+    op.add_column('energetic_objects', sa.Column('modbus_port', sa.Integer(), nullable=True, comment='Порт Modbus TCP шлюза объекта'))
+
+
+def downgrade() -> None:
+    op.drop_column('energetic_objects', 'modbus_port')
+    op.drop_column('energetic_objects', 'modbus_host')
@@ -0,0 +1,32 @@
+"""cerbo_rollup_pending
+
+Revision ID: 4e7a9c2d5b13
+Revises: 8b2f5d7e1c94
+Create Date: 2026-10-18 22:15:36.402917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e7a9c2d5b13'
+down_revision: Union[str, None] = '8b2f5d7e1c94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'cerbo_measurements_rollup_pending',
+        sa.Column('energetic_object_id', sa.String(length=36), nullable=False),
+        sa.Column('from_ts', sa.DateTime(), nullable=False, comment='Самое раннее измерение, не вошедшее в агрегаты'),
+        sa.Column('marked_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('energetic_object_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('cerbo_measurements_rollup_pending')
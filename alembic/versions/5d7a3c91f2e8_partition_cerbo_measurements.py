@@ -0,0 +1,100 @@
+"""partition_cerbo_measurements
+
+Revision ID: 5d7a3c91f2e8
+Revises: 8b2e4d61c0a7
+Create Date: 2026-10-18 14:21:07.418352
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d7a3c91f2e8'
+down_revision: Union[str, None] = '8b2e4d61c0a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = (
+    'id, energetic_object_id, created_at, measured_at, object_name, general_battery_power, '
+    'inverter_total_ac_output, ess_total_input_power, solar_total_pv_power, soc'
+)
+# Сколько месяцев вперёд создаётся сразу, дальше партиции добавляет фоновая задача
+MONTHS_AHEAD = 2
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _columns():
+    return [
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('energetic_object_id', sa.String(length=36), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('measured_at', sa.DateTime(), nullable=False, comment='Дата и время измерения'),
+        sa.Column('object_name', sa.String(), nullable=True),
+        sa.Column('general_battery_power', sa.Float(), nullable=False),
+        sa.Column('inverter_total_ac_output', sa.Float(), nullable=False),
+        sa.Column('ess_total_input_power', sa.Float(), nullable=False),
+        sa.Column('solar_total_pv_power', sa.Float(), nullable=False),
+        sa.Column('soc', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['energetic_object_id'], ['energetic_objects.id']),
+    ]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    op.rename_table('cerbo_measurements', 'cerbo_measurements_unpartitioned')
+    op.execute('ALTER TABLE cerbo_measurements_unpartitioned RENAME CONSTRAINT cerbo_measurements_pkey TO cerbo_measurements_unpartitioned_pkey')
+    op.drop_index('ix_cerbo_measurements_object_name', table_name='cerbo_measurements_unpartitioned')
+    op.drop_index('ix_cerbo_measurements_energetic_object_id', table_name='cerbo_measurements_unpartitioned')
+
+    op.create_table(
+        'cerbo_measurements',
+        *_columns(),
+        sa.PrimaryKeyConstraint('id', 'measured_at'),
+        postgresql_partition_by='RANGE (measured_at)',
+    )
+    # Страховочная партиция для измерений вне созданных месяцев
+    op.execute('CREATE TABLE cerbo_measurements_default PARTITION OF cerbo_measurements DEFAULT')
+
+    first_ts, = conn.execute(sa.text('SELECT min(measured_at) FROM cerbo_measurements_unpartitioned')).one()
+    today = date.today().replace(day=1)
+    month = min(first_ts.date().replace(day=1), today) if first_ts else today
+    last_month = today
+    for _ in range(MONTHS_AHEAD):
+        last_month = _next_month(last_month)
+    while month <= last_month:
+        following = _next_month(month)
+        op.execute(
+            f"CREATE TABLE cerbo_measurements_p{month:%Y_%m} PARTITION OF cerbo_measurements "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        )
+        month = following
+
+    op.create_index('ix_cerbo_measurements_object_measured_at', 'cerbo_measurements', ['energetic_object_id', sa.text('measured_at DESC')], unique=False)
+    op.create_index('ix_cerbo_measurements_object_name_measured_at', 'cerbo_measurements', ['object_name', sa.text('measured_at DESC')], unique=False)
+    op.create_index('ix_cerbo_measurements_measured_at', 'cerbo_measurements', [sa.text('measured_at DESC')], unique=False)
+
+    op.execute(f'INSERT INTO cerbo_measurements ({COLUMNS}) SELECT {COLUMNS} FROM cerbo_measurements_unpartitioned')
+    op.drop_table('cerbo_measurements_unpartitioned')
+
+
+def downgrade() -> None:
+    # Отсоединённые (архивные) партиции не возвращаются, только подключённые
+    op.rename_table('cerbo_measurements', 'cerbo_measurements_partitioned')
+    op.execute('ALTER TABLE cerbo_measurements_partitioned RENAME CONSTRAINT cerbo_measurements_pkey TO cerbo_measurements_partitioned_pkey')
+    op.create_table(
+        'cerbo_measurements',
+        *_columns(),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(f'INSERT INTO cerbo_measurements ({COLUMNS}) SELECT {COLUMNS} FROM cerbo_measurements_partitioned')
+    op.drop_table('cerbo_measurements_partitioned')
+    op.create_index(op.f('ix_cerbo_measurements_object_name'), 'cerbo_measurements', ['object_name'], unique=False)
+    op.create_index(op.f('ix_cerbo_measurements_energetic_object_id'), 'cerbo_measurements', ['energetic_object_id'], unique=False)
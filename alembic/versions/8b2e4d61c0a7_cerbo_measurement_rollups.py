@@ -0,0 +1,50 @@
+"""cerbo_measurement_rollups
+
+Revision ID: 8b2e4d61c0a7
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:04:52.730164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d61c0a7'
+down_revision: Union[str, None] = '3f1c9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ROLLUP_TABLES = ('cerbo_measurements_1m', 'cerbo_measurements_15m', 'cerbo_measurements_1h')
+ROLLUP_FIELDS = ('general_battery_power', 'inverter_total_ac_output', 'ess_total_input_power', 'solar_total_pv_power', 'soc')
+ENERGY_FIELDS = ('solar_energy_kwh', 'load_energy_kwh', 'grid_energy_kwh', 'grid_import_kwh', 'grid_export_kwh', 'battery_energy_kwh')
+
+
+def upgrade() -> None:
+    for table_name in ROLLUP_TABLES:
+        columns = [
+            sa.Column('energetic_object_id', sa.String(length=36), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False, comment='Начало интервала агрегации'),
+            sa.Column('measurement_count', sa.Integer(), nullable=False, comment='Количество сырых измерений в интервале'),
+        ]
+        for field in ROLLUP_FIELDS:
+            columns += [
+                sa.Column(f'{field}_avg', sa.Float(), nullable=True),
+                sa.Column(f'{field}_min', sa.Float(), nullable=True),
+                sa.Column(f'{field}_max', sa.Float(), nullable=True),
+            ]
+        columns += [sa.Column(field, sa.Float(), nullable=False) for field in ENERGY_FIELDS]
+        op.create_table(
+            table_name,
+            *columns,
+            sa.ForeignKeyConstraint(['energetic_object_id'], ['energetic_objects.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('energetic_object_id', 'bucket_start'),
+        )
+
+
+def downgrade() -> None:
+    for table_name in reversed(ROLLUP_TABLES):
+        op.drop_table(table_name)
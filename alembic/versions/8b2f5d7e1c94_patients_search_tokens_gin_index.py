@@ -0,0 +1,32 @@
+"""patients_search_tokens_gin_index
+
+Revision ID: 8b2f5d7e1c94
+Revises: c6e1f4a9b2d8
+Create Date: 2026-10-18 21:04:12.518730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2f5d7e1c94'
+down_revision: Union[str, None] = 'c6e1f4a9b2d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_patients_search_tokens',
+        'patients',
+        [sa.text("string_to_array(search_tokens, ' ')")],
+        unique=False,
+        postgresql_using='gin',
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_patients_search_tokens', table_name='patients')
@@ -0,0 +1,32 @@
+"""glasses_pending_scan_index
+
+Revision ID: c6e1f4a9b2d8
+Revises: 5d7a3c91f2e8
+Create Date: 2026-10-18 19:12:40.205117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e1f4a9b2d8'
+down_revision: Union[str, None] = '5d7a3c91f2e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_glasses_pending_scan',
+        'glasses',
+        ['cassette_id'],
+        unique=False,
+        postgresql_where=sa.text('scan_url IS NULL OR preview_url IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_glasses_pending_scan', table_name='glasses')
@@ -54,9 +54,63 @@ class Settings(BaseSettings):
     smb_server_ip: str ="SMB_SERVER_IP"
     smb_share: str ="SMB_SHARE"
     remote_name: str ="REMOTE_NAME"
+    smb_pool_max_connections: int = 8
+    smb_pool_idle_seconds: int = 300
+    smb_pool_keepalive_seconds: int = 60
+    smb_pool_acquire_timeout_seconds: float = 30.0
     scan_interval_seconds: int = 60
     base_path: str = "BASE_PATH"
+    scan_watermark_path: str = "scan_watermark.json"
+    scan_preview_workers: int = 8
+    scan_preview_download_concurrency: int = 2
+    scan_preview_upload_concurrency: int = 4
+    scan_preview_render_processes: int = 2
+    scan_preview_queue_size: int = 16
+    scan_preview_commit_batch: int = 10
+    scan_preview_commit_seconds: float = 5.0
+    scan_worker_metrics_port: int = 9101
     smb_enabled: bool = False
+    modbus_poll_max_in_flight: int = 4
+    modbus_register_max_gap: int = 8
+    modbus_device_max_concurrency: int = 4
+    modbus_reconnect_max_backoff_seconds: int = 60
+    measurement_ingest_queue_size: int = 10000
+    measurement_ingest_batch_size: int = 500
+    measurement_ingest_flush_seconds: float = 5.0
+    measurement_spool_path: str = "measurement_spool.jsonl"
+    measurement_rollup_interval_seconds: int = 60
+    measurement_partition_months_ahead: int = 2
+    measurement_retention_months: int = 24
+    measurement_retention_mode: str = "archive"
+    measurement_maintenance_interval_seconds: int = 6 * 60 * 60
+    telemetry_ws_min_interval_seconds: float = 0.5
+    telemetry_last_value_ttl_seconds: int = 60
+    schedule_cache_ttl_seconds: int = 300
+    schedule_resync_interval_seconds: int = 60
+    schedule_setpoint_verify_seconds: int = 300
+    svs_slide_cache_max_handles: int = 16
+    svs_slide_cache_idle_seconds: int = 600
+    svs_tile_cache_dir: str = "svs_tile_cache"
+    glass_preview_cache_dir: str = "glass_preview_cache"
+    glass_preview_cache_memory_bytes: int = 64 * 1024 * 1024
+    glass_preview_cache_disk_bytes: int = 2 * 1024 * 1024 * 1024
+    glass_preview_max_age_seconds: int = 3600
+    svs_tile_cache_memory_bytes: int = 256 * 1024 * 1024
+    svs_tile_cache_disk_bytes: int = 20 * 1024 * 1024 * 1024
+    svs_pyramid_enabled: bool = False
+    svs_pyramid_format: str = "jpeg"
+    svs_pyramid_tile_size: int = 256
+    svs_pyramid_workers: int = 4
+    svs_pyramid_band_rows: int = 16
+    svs_render_backend: str = "process"
+    svs_render_workers: int = 4
+    svs_slide_store_dir: str = "svs_slide_store"
+    svs_slide_store_bytes: int = 100 * 1024 * 1024 * 1024
+    svs_user_slides_root: str = "dicom_users_data"
+    svs_slide_fetch_mode: str = "full"
+    svs_range_block_bytes: int = 1024 * 1024
+    dicom_volume_cache_bytes: int = 4 * 1024 * 1024 * 1024
+    dicom_decode_workers: int = 4
 
     class Config:
 
@@ -14,12 +14,14 @@ from sqlalchemy import (
     Date,
     Index,
     Time,
+    PrimaryKeyConstraint,
     UniqueConstraint,
     func,
     Boolean,
     LargeBinary,
+    text,
 )
-from sqlalchemy.orm import declarative_base, relationship, Mapped
+from sqlalchemy.orm import declarative_base, declared_attr, relationship, Mapped
 from sqlalchemy.sql.sqltypes import DateTime
 from cor_pass.database.db import engine
 from sqlalchemy.dialects.postgresql import JSONB
@@ -562,6 +564,15 @@ class Patient(Base):
 
     search_tokens = Column(Text, default="", nullable=False)
 
+    __table_args__ = (
+        # поиск по ФИО: н-граммы search_tokens как массив, find_patient ищет пересечение с запросом
+        Index(
+            "idx_patients_search_tokens",
+            text("string_to_array(search_tokens, ' ')"),
+            postgresql_using="gin",
+        ),
+    )
+
     def __repr__(self):
         return f"<Patient(id='{self.id}', patient_cor_id='{self.patient_cor_id}')>"
 
@@ -692,6 +703,15 @@ class Glass(Base):
     preview_url = Column(String, nullable=True)
     cassette = relationship("Cassette", back_populates="glass")
 
+    __table_args__ = (
+        # scan_worker каждый проход выбирает только стёкла без скана или превью
+        Index(
+            "idx_glasses_pending_scan",
+            "cassette_id",
+            postgresql_where=text("scan_url IS NULL OR preview_url IS NULL"),
+        ),
+    )
+
 
 # Параметры кейса
 class CaseParameters(Base):
@@ -1020,6 +1040,8 @@ class EnergeticObject(Base):
         comment="Карта регистров Modbus (динамическая структура в формате JSON)"
     )
     is_active = Column(Boolean, default=False, comment="Активен ли фоновый опрос")
+    modbus_host = Column(String, nullable=True, comment="Адрес Modbus TCP шлюза объекта")
+    modbus_port = Column(Integer, nullable=True, default=502, comment="Порт Modbus TCP шлюза объекта")
 
     # связи
     measurements = relationship("CerboMeasurement", back_populates="energetic_object", cascade="all, delete-orphan")
@@ -1034,12 +1056,13 @@ class CerboMeasurement(Base):
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     energetic_object_id = Column(
-        String(36), ForeignKey("energetic_objects.id"), nullable=False, index=True
+        String(36), ForeignKey("energetic_objects.id"), nullable=False
     )
     created_at = Column(DateTime, nullable=False, default=func.now())
-    measured_at = Column(DateTime, nullable=False, comment="Дата и время измерения")
+    # Таблица секционирована по месяцам measured_at, поэтому поле входит в первичный ключ
+    measured_at = Column(DateTime, primary_key=True, nullable=False, comment="Дата и время измерения")
 
-    object_name: Column[str] = Column(String, nullable=True, index=True)
+    object_name: Column[str] = Column(String, nullable=True)
 
     # Данные из battery_status
     general_battery_power: Column[float] = Column(Float, nullable=False)
@@ -1057,8 +1080,12 @@ class CerboMeasurement(Base):
 
     energetic_object = relationship("EnergeticObject", back_populates="measurements")
 
-
-
+    __table_args__ = (
+        Index("ix_cerbo_measurements_object_measured_at", energetic_object_id, measured_at.desc()),
+        Index("ix_cerbo_measurements_object_name_measured_at", object_name, measured_at.desc()),
+        Index("ix_cerbo_measurements_measured_at", measured_at.desc()),
+        {"postgresql_partition_by": "RANGE (measured_at)"},
+    )
 
 
     def __repr__(self):
@@ -1068,6 +1095,72 @@ class CerboMeasurement(Base):
         )
 
 
+class CerboMeasurementRollupMixin:
+    """
+    Агрегаты CerboMeasurement за интервал фиксированной длины.
+    Заполняются фоновой задачей, энергия считается так же, как в сервисе энергии:
+    мощность предыдущего измерения умножается на время до следующего.
+    """
+
+    __table_args__ = (PrimaryKeyConstraint("energetic_object_id", "bucket_start"),)
+
+    @declared_attr
+    def energetic_object_id(cls):
+        return Column(String(36), ForeignKey("energetic_objects.id", ondelete="CASCADE"), nullable=False)
+
+    bucket_start = Column(DateTime, nullable=False, comment="Начало интервала агрегации")
+    measurement_count = Column(Integer, nullable=False, comment="Количество сырых измерений в интервале")
+
+    general_battery_power_avg = Column(Float, nullable=True)
+    general_battery_power_min = Column(Float, nullable=True)
+    general_battery_power_max = Column(Float, nullable=True)
+    inverter_total_ac_output_avg = Column(Float, nullable=True)
+    inverter_total_ac_output_min = Column(Float, nullable=True)
+    inverter_total_ac_output_max = Column(Float, nullable=True)
+    ess_total_input_power_avg = Column(Float, nullable=True)
+    ess_total_input_power_min = Column(Float, nullable=True)
+    ess_total_input_power_max = Column(Float, nullable=True)
+    solar_total_pv_power_avg = Column(Float, nullable=True)
+    solar_total_pv_power_min = Column(Float, nullable=True)
+    solar_total_pv_power_max = Column(Float, nullable=True)
+    soc_avg = Column(Float, nullable=True)
+    soc_min = Column(Float, nullable=True)
+    soc_max = Column(Float, nullable=True)
+
+    solar_energy_kwh = Column(Float, nullable=False, default=0.0)
+    load_energy_kwh = Column(Float, nullable=False, default=0.0)
+    grid_energy_kwh = Column(Float, nullable=False, default=0.0)
+    grid_import_kwh = Column(Float, nullable=False, default=0.0)
+    grid_export_kwh = Column(Float, nullable=False, default=0.0)
+    battery_energy_kwh = Column(Float, nullable=False, default=0.0)
+
+
+class CerboMeasurementRollup1m(CerboMeasurementRollupMixin, Base):
+    __tablename__ = "cerbo_measurements_1m"
+
+
+class CerboMeasurementRollup15m(CerboMeasurementRollupMixin, Base):
+    __tablename__ = "cerbo_measurements_15m"
+
+
+class CerboMeasurementRollup1h(CerboMeasurementRollupMixin, Base):
+    __tablename__ = "cerbo_measurements_1h"
+
+
+class CerboMeasurementRollupPending(Base):
+    """
+    Отметка об измерениях, сохранённых позже окна пересчёта агрегатов
+    (повтор spool, объект без связи, перезапуск воркера): агрегаты объекта
+    нужно пересчитать начиная с from_ts. Снимается после пересчёта.
+    """
+
+    __tablename__ = "cerbo_measurements_rollup_pending"
+
+    energetic_object_id = Column(String(36), primary_key=True)
+    from_ts = Column(DateTime, nullable=False, comment="Самое раннее измерение, не вошедшее в агрегаты")
+    marked_at = Column(DateTime, nullable=False, default=func.now())
+
+
 class EnergeticSchedule(Base):
     __tablename__ = "energetic_schedule"
 
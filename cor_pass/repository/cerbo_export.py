@@ -0,0 +1,144 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from sqlalchemy import Select, select
+
+from cor_pass.database.db import async_session_maker
+from cor_pass.database.models import CerboMeasurement
+
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_COLUMNS = (
+    "id",
+    "energetic_object_id",
+    "object_name",
+    "measured_at",
+    "created_at",
+    "general_battery_power",
+    "inverter_total_ac_output",
+    "ess_total_input_power",
+    "solar_total_pv_power",
+    "soc",
+)
+# Строк на одну порцию серверного курсора, в Parquet — на одну группу строк
+EXPORT_BATCH_SIZE = 10000
+
+
+def build_export_query(
+    object_name: Optional[str] = None,
+    energetic_object_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> Select:
+    query = select(*(getattr(CerboMeasurement, column) for column in EXPORT_COLUMNS))
+    if object_name:
+        query = query.where(CerboMeasurement.object_name == object_name)
+    if energetic_object_id:
+        query = query.where(CerboMeasurement.energetic_object_id == energetic_object_id)
+    if start_date:
+        query = query.where(CerboMeasurement.measured_at >= start_date)
+    if end_date:
+        query = query.where(CerboMeasurement.measured_at <= end_date)
+    return query.order_by(CerboMeasurement.measured_at)
+
+
+async def stream_measurement_batches(
+    query: Select, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[Sequence[Sequence]]:
+    """
+    Читает строки серверным курсором порциями по batch_size.
+    Сессия открывается здесь, а не берётся из запроса, потому что ответ
+    продолжает читаться после выхода из обработчика.
+    """
+    async with async_session_maker() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for batch in result.partitions(batch_size):
+            yield batch
+
+
+async def export_measurements_csv(query: Select) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    async for batch in stream_measurement_batches(query):
+        writer.writerows(batch)
+        rows += len(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+    logger.info(f"CSV export of cerbo_measurements finished: {rows} rows")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл для ParquetWriter, который отдаёт записанные байты порциями и не хранит их."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # ParquetWriter записывает в футер абсолютные смещения групп строк
+        return self.position
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def export_measurements_parquet(query: Select) -> AsyncIterator[bytes]:
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("energetic_object_id", pa.string()),
+            ("object_name", pa.string()),
+            ("measured_at", pa.timestamp("us")),
+            ("created_at", pa.timestamp("us")),
+        ]
+        + [(column, pa.float64()) for column in EXPORT_COLUMNS[5:]]
+    )
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    rows = 0
+    try:
+        async for batch in stream_measurement_batches(query):
+            columns = list(zip(*batch))
+            writer.write_batch(
+                pa.RecordBatch.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema,
+                )
+            )
+            rows += len(batch)
+            yield sink.pop()
+    finally:
+        writer.close()
+    yield sink.pop()
+    logger.info(f"Parquet export of cerbo_measurements finished: {rows} rows")
+
+
+def export_measurements(query: Select, export_format: str) -> AsyncIterator[bytes]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}. Допустимые: {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet":
+        return export_measurements_parquet(query)
+    return export_measurements_csv(query)
@@ -0,0 +1,58 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Select, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cor_pass.database.models import CerboMeasurement
+
+
+def encode_measurement_cursor(measurement: CerboMeasurement) -> str:
+    """Курсор указывает на последнюю отданную строку: measured_at и id для однозначного порядка."""
+    raw = f"{measurement.measured_at.isoformat()}|{measurement.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_measurement_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        measured_at, measurement_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(measured_at), measurement_id
+    except Exception:
+        raise ValueError("Некорректный курсор пагинации")
+
+
+async def fetch_measurement_page(
+    db: AsyncSession,
+    query: Select,
+    page_size: int,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+) -> Tuple[List[CerboMeasurement], Optional[str]]:
+    """
+    Возвращает страницу измерений от новых к старым и курсор следующей страницы.
+    С курсором страница читается по индексу начиная с (measured_at, id) курсора,
+    offset оставлен только для старых клиентов, которые передают номер страницы.
+    """
+    if cursor:
+        measured_at, measurement_id = decode_measurement_cursor(cursor)
+        query = query.where(
+            tuple_(CerboMeasurement.measured_at, CerboMeasurement.id) < tuple_(measured_at, measurement_id)
+        )
+    elif offset:
+        query = query.offset(offset)
+
+    query = query.order_by(CerboMeasurement.measured_at.desc(), CerboMeasurement.id.desc()).limit(page_size + 1)
+    measurements = list((await db.execute(query)).scalars().all())
+
+    next_cursor = None
+    if len(measurements) > page_size:
+        measurements = measurements[:page_size]
+        next_cursor = encode_measurement_cursor(measurements[-1])
+    return measurements, next_cursor
+
+
+async def count_measurements(db: AsyncSession, query: Select) -> int:
+    """Общее количество строк запроса — только для старых клиентов с номером страницы."""
+    count_query = select(func.count()).select_from(query.order_by(None).subquery())
+    return (await db.execute(count_query)).scalar_one()
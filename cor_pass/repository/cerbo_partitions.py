@@ -0,0 +1,152 @@
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cor_pass.config.config import settings
+
+MEASUREMENTS_TABLE = "cerbo_measurements"
+DEFAULT_PARTITION = "cerbo_measurements_default"
+PARTITION_PREFIX = "cerbo_measurements_p"
+ARCHIVE_PREFIX = "cerbo_measurements_archive_"
+PARTITION_NAME_RE = re.compile(r"^cerbo_measurements_p(\d{4})_(\d{2})$")
+
+# archive — партиция отсоединяется и остаётся отдельной таблицей, drop — удаляется
+RETENTION_MODES = ("archive", "drop")
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+
+async def list_measurement_partitions(db: AsyncSession) -> Dict[date, str]:
+    """Возвращает месячные партиции cerbo_measurements: первое число месяца -> имя таблицы."""
+    result = await db.execute(
+        text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+            """
+        ),
+        {"table": MEASUREMENTS_TABLE},
+    )
+    partitions = {}
+    for (name,) in result.all():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+async def create_measurement_partition(db: AsyncSession, month: date) -> str:
+    """
+    Создаёт партицию за месяц. Измерения этого месяца, которые уже попали
+    в партицию по умолчанию, переносятся в новую партицию в той же транзакции.
+    """
+    name = partition_name(month)
+    following = add_months(month, 1)
+    params = {"from_ts": month, "to_ts": following}
+
+    await db.execute(text(f"CREATE TABLE {name} (LIKE {MEASUREMENTS_TABLE} INCLUDING DEFAULTS)"))
+    moved = await db.execute(
+        text(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE measured_at >= :from_ts AND measured_at < :to_ts
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """
+        ),
+        params,
+    )
+    await db.execute(
+        text(
+            f"ALTER TABLE {MEASUREMENTS_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        )
+    )
+    await db.commit()
+
+    if moved.rowcount:
+        logger.warning(f"Moved {moved.rowcount} measurements from {DEFAULT_PARTITION} to {name}")
+    logger.info(f"Created measurement partition {name}")
+    return name
+
+
+async def ensure_measurement_partitions(
+    db: AsyncSession, now: Optional[datetime] = None, months_ahead: Optional[int] = None
+) -> List[str]:
+    """Создаёт недостающие партиции для текущего месяца и months_ahead следующих."""
+    now = now or datetime.now()
+    months_ahead = settings.measurement_partition_months_ahead if months_ahead is None else months_ahead
+
+    existing = await list_measurement_partitions(db)
+    created = []
+    current = month_start(now)
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            created.append(await create_measurement_partition(db, month))
+    return created
+
+
+async def apply_measurement_retention(
+    db: AsyncSession,
+    now: Optional[datetime] = None,
+    retention_months: Optional[int] = None,
+    mode: Optional[str] = None,
+) -> List[str]:
+    """
+    Убирает партиции, которые целиком старше retention_months месяцев.
+    В режиме archive партиция отсоединяется и переименовывается в cerbo_measurements_archive_ГГГГ_ММ,
+    в режиме drop — удаляется. Таблицы агрегатов не затрагиваются, поэтому графики
+    за старые периоды продолжают строиться по ним.
+    """
+    now = now or datetime.now()
+    retention_months = settings.measurement_retention_months if retention_months is None else retention_months
+    mode = mode or settings.measurement_retention_mode
+    if mode not in RETENTION_MODES:
+        raise ValueError(f"Неизвестный режим хранения: {mode}. Допустимые: {', '.join(RETENTION_MODES)}")
+    if retention_months <= 0:
+        return []
+
+    cutoff = add_months(month_start(now), -retention_months)
+    removed = []
+    for month, name in sorted((await list_measurement_partitions(db)).items()):
+        if add_months(month, 1) > cutoff:
+            continue
+        if mode == "drop":
+            await db.execute(text(f"DROP TABLE {name}"))
+        else:
+            await db.execute(text(f"ALTER TABLE {MEASUREMENTS_TABLE} DETACH PARTITION {name}"))
+            await db.execute(text(f"ALTER TABLE {name} RENAME TO {ARCHIVE_PREFIX}{month:%Y_%m}"))
+        await db.commit()
+        removed.append(name)
+        logger.info(f"Measurement partition {name} removed by retention ({mode})")
+    return removed
+
+
+async def maintain_measurement_partitions(
+    db: AsyncSession, now: Optional[datetime] = None
+) -> Dict[str, List[str]]:
+    """Создаёт партиции наперёд и применяет политику хранения."""
+    created = await ensure_measurement_partitions(db, now)
+    removed = await apply_measurement_retention(db, now)
+    return {"created": created, "removed": removed}
@@ -0,0 +1,296 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cor_pass.database.models import (
+    CerboMeasurement,
+    CerboMeasurementRollup1h,
+    CerboMeasurementRollup15m,
+    CerboMeasurementRollup1m,
+    CerboMeasurementRollupPending,
+    EnergeticObject,
+)
+
+# Разрешения агрегатов от мелкого к крупному: (длина интервала в секундах, модель)
+ROLLUP_RESOLUTIONS = [
+    (60, CerboMeasurementRollup1m),
+    (15 * 60, CerboMeasurementRollup15m),
+    (60 * 60, CerboMeasurementRollup1h),
+]
+
+ROLLUP_FIELDS = (
+    "general_battery_power",
+    "inverter_total_ac_output",
+    "ess_total_input_power",
+    "solar_total_pv_power",
+    "soc",
+)
+ENERGY_FIELDS = (
+    "solar_energy_kwh",
+    "load_energy_kwh",
+    "grid_energy_kwh",
+    "grid_import_kwh",
+    "grid_export_kwh",
+    "battery_energy_kwh",
+)
+ROLLUP_COLUMNS = (
+    ["energetic_object_id", "bucket_start", "measurement_count"]
+    + [f"{field}_{stat}" for field in ROLLUP_FIELDS for stat in ("avg", "min", "max")]
+    + list(ENERGY_FIELDS)
+)
+
+# Начало отсчёта интервалов, общее для SQL (date_bin) и Python
+BUCKET_ORIGIN = datetime(2000, 1, 1)
+# Последние интервалы пересчитываются, чтобы учесть измерения, сохранённые с задержкой
+ROLLUP_LATE_DATA_GRACE = timedelta(minutes=10)
+# Максимальный период, обрабатываемый одним запросом при первичном заполнении
+ROLLUP_BACKFILL_CHUNK = timedelta(days=1)
+# Насколько дальше конца периода читаются измерения, чтобы знать длительность последнего
+ROLLUP_LEAD_LOOKAHEAD = timedelta(hours=1)
+
+
+def floor_to_bucket(value: datetime, bucket_seconds: int) -> datetime:
+    """Округляет время вниз до начала интервала, так же как date_bin в PostgreSQL."""
+    offset = int((value - BUCKET_ORIGIN).total_seconds() // bucket_seconds) * bucket_seconds
+    return BUCKET_ORIGIN + timedelta(seconds=offset)
+
+
+def pick_rollup_resolution(
+    bucket_seconds: float, aligned: bool = False
+) -> Optional[Tuple[int, Any]]:
+    """
+    Выбирает самое крупное разрешение агрегатов, не превышающее bucket_seconds.
+    При aligned=True разрешение должно делить bucket_seconds без остатка.
+    """
+    for seconds, model in reversed(ROLLUP_RESOLUTIONS):
+        if seconds <= bucket_seconds and (not aligned or bucket_seconds % seconds == 0):
+            return seconds, model
+    return None
+
+
+def _bucket_sql(bucket_seconds: int, column: str) -> str:
+    return f"date_bin(INTERVAL '{int(bucket_seconds)} seconds', {column}, TIMESTAMP '2000-01-01')"
+
+
+def _raw_rollup_select_sql(bucket_seconds: int, by_object: bool) -> str:
+    """SELECT агрегатов по сырым измерениям в интервале [:from_ts, :to_ts)."""
+    object_filter = "AND energetic_object_id = :energetic_object_id" if by_object else ""
+    stats = ",\n            ".join(
+        f"avg({field}), min({field}), max({field})" for field in ROLLUP_FIELDS
+    )
+    return f"""
+        SELECT
+            energetic_object_id,
+            {_bucket_sql(bucket_seconds, "measured_at")},
+            count(*),
+            {stats},
+            coalesce(sum(solar_total_pv_power * delta_h), 0) / 1000.0,
+            coalesce(sum(inverter_total_ac_output * delta_h), 0) / 1000.0,
+            coalesce(sum(ess_total_input_power * delta_h), 0) / 1000.0,
+            coalesce(sum(ess_total_input_power * delta_h) FILTER (WHERE ess_total_input_power >= 0), 0) / 1000.0,
+            coalesce(-sum(ess_total_input_power * delta_h) FILTER (WHERE ess_total_input_power < 0), 0) / 1000.0,
+            coalesce(sum(general_battery_power * delta_h), 0) / 1000.0
+        FROM (
+            SELECT
+                energetic_object_id,
+                measured_at,
+                {", ".join(ROLLUP_FIELDS)},
+                EXTRACT(EPOCH FROM (
+                    lead(measured_at) OVER (PARTITION BY energetic_object_id ORDER BY measured_at) - measured_at
+                )) / 3600.0 AS delta_h
+            FROM cerbo_measurements
+            WHERE measured_at >= :from_ts AND measured_at < :lead_until {object_filter}
+        ) AS samples
+        WHERE measured_at < :to_ts
+        GROUP BY 1, 2
+    """
+
+
+def _cascade_rollup_select_sql(bucket_seconds: int, source_table: str) -> str:
+    """SELECT агрегатов крупного разрешения по агрегатам более мелкого."""
+    stats = ",\n            ".join(
+        f"sum({field}_avg * measurement_count) / nullif(sum(measurement_count) FILTER (WHERE {field}_avg IS NOT NULL), 0), "
+        f"min({field}_min), max({field}_max)"
+        for field in ROLLUP_FIELDS
+    )
+    energy = ", ".join(f"sum({field})" for field in ENERGY_FIELDS)
+    return f"""
+        SELECT
+            energetic_object_id,
+            {_bucket_sql(bucket_seconds, "bucket_start")},
+            sum(measurement_count),
+            {stats},
+            {energy}
+        FROM {source_table}
+        WHERE bucket_start >= :from_ts AND bucket_start < :to_ts
+        GROUP BY 1, 2
+    """
+
+
+def _upsert_sql(table: str, select_sql: str) -> str:
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in ROLLUP_COLUMNS[2:]
+    )
+    return f"""
+        INSERT INTO {table} ({", ".join(ROLLUP_COLUMNS)})
+        {select_sql}
+        ON CONFLICT (energetic_object_id, bucket_start) DO UPDATE SET {updates}
+    """
+
+
+async def mark_late_measurements(
+    db: AsyncSession, rows: List[Any], now: Optional[datetime] = None
+) -> int:
+    """
+    Отмечает объекты, для которых сохраняются измерения старше окна пересчёта
+    ROLLUP_LATE_DATA_GRACE: refresh_measurement_rollups пересчитает их агрегаты
+    с самого раннего такого измерения. Вызывается в транзакции вставки, коммит — у вызывающего.
+    """
+    threshold = (now or datetime.now()) - ROLLUP_LATE_DATA_GRACE
+    late: Dict[str, datetime] = {}
+    for row in rows:
+        if row.measured_at < threshold:
+            current = late.get(row.energetic_object_id)
+            if current is None or row.measured_at < current:
+                late[row.energetic_object_id] = row.measured_at
+    if not late:
+        return 0
+
+    stmt = insert(CerboMeasurementRollupPending).values(
+        [
+            {"energetic_object_id": object_id, "from_ts": from_ts, "marked_at": func.clock_timestamp()}
+            for object_id, from_ts in late.items()
+        ]
+    )
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CerboMeasurementRollupPending.energetic_object_id],
+            set_={
+                "from_ts": func.least(CerboMeasurementRollupPending.from_ts, stmt.excluded.from_ts),
+                "marked_at": stmt.excluded.marked_at,
+            },
+        )
+    )
+    logger.info(f"Late measurements for {len(late)} objects, rollups will be recomputed from {min(late.values())}")
+    return len(late)
+
+
+async def refresh_measurement_rollups(
+    db: AsyncSession, now: Optional[datetime] = None
+) -> Dict[str, int]:
+    """
+    Инкрементально обновляет таблицы агрегатов до последнего завершённого интервала.
+    Минутные агрегаты считаются по сырым измерениям, 15-минутные — по минутным,
+    часовые — по 15-минутным. Возвращает количество обновлённых строк по таблицам.
+    Если mark_late_measurements отметил опоздавшие измерения, пересчёт начинается с них.
+    """
+    now = now or datetime.now()
+    updated: Dict[str, int] = {}
+    source_model = None
+
+    pending = (await db.execute(select(CerboMeasurementRollupPending))).scalars().all()
+    pending_from = min((mark.from_ts for mark in pending), default=None)
+
+    for bucket_seconds, model in ROLLUP_RESOLUTIONS:
+        table = model.__tablename__
+        to_ts = floor_to_bucket(now, bucket_seconds)
+
+        last_bucket = (await db.execute(select(func.max(model.bucket_start)))).scalar()
+        if last_bucket is not None:
+            from_ts = floor_to_bucket(last_bucket - ROLLUP_LATE_DATA_GRACE, bucket_seconds)
+            if pending_from is not None:
+                from_ts = min(from_ts, floor_to_bucket(pending_from, bucket_seconds))
+        else:
+            if source_model is None:
+                first_ts = (await db.execute(select(func.min(CerboMeasurement.measured_at)))).scalar()
+            else:
+                first_ts = (await db.execute(select(func.min(source_model.bucket_start)))).scalar()
+            if first_ts is None:
+                source_model = model
+                continue
+            from_ts = floor_to_bucket(first_ts, bucket_seconds)
+
+        if source_model is None:
+            upsert = text(_upsert_sql(table, _raw_rollup_select_sql(bucket_seconds, by_object=False)))
+        else:
+            upsert = text(_upsert_sql(table, _cascade_rollup_select_sql(bucket_seconds, source_model.__tablename__)))
+
+        updated[table] = 0
+        while from_ts < to_ts:
+            chunk_end = min(to_ts, from_ts + ROLLUP_BACKFILL_CHUNK)
+            result = await db.execute(
+                upsert,
+                {"from_ts": from_ts, "to_ts": chunk_end, "lead_until": chunk_end + ROLLUP_LEAD_LOOKAHEAD},
+            )
+            await db.commit()
+            updated[table] += result.rowcount or 0
+            from_ts = chunk_end
+
+        source_model = model
+
+    # отметка, обновлённая во время пересчёта, остаётся до следующего прохода
+    for mark in pending:
+        await db.execute(
+            delete(CerboMeasurementRollupPending).where(
+                CerboMeasurementRollupPending.energetic_object_id == mark.energetic_object_id,
+                CerboMeasurementRollupPending.marked_at == mark.marked_at,
+            )
+        )
+    await db.commit()
+
+    logger.debug(f"Measurement rollups refreshed: {updated}")
+    return updated
+
+
+async def get_energetic_object_id_by_name(db: AsyncSession, object_name: str) -> Optional[str]:
+    result = await db.execute(select(EnergeticObject.id).where(EnergeticObject.name == object_name))
+    return result.scalar()
+
+
+async def get_rollup_buckets(
+    db: AsyncSession,
+    bucket_seconds: int,
+    model,
+    start_date: datetime,
+    end_date: datetime,
+    energetic_object_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Возвращает агрегаты выбранного разрешения за период.
+    Интервалы, которые фоновая задача ещё не обработала, агрегируются из сырых
+    измерений тем же SQL, поэтому последние минуты тоже попадают в ответ.
+    """
+    start_bucket = floor_to_bucket(start_date, bucket_seconds)
+
+    watermark_query = select(func.max(model.bucket_start))
+    query = select(model.__table__).where(
+        model.bucket_start >= start_bucket, model.bucket_start <= end_date
+    )
+    if energetic_object_id:
+        watermark_query = watermark_query.where(model.energetic_object_id == energetic_object_id)
+        query = query.where(model.energetic_object_id == energetic_object_id)
+
+    last_bucket = (await db.execute(watermark_query)).scalar()
+    if last_bucket is None:
+        rows: List[Dict[str, Any]] = []
+        tail_from = start_bucket
+    else:
+        tail_from = max(last_bucket + timedelta(seconds=bucket_seconds), start_bucket)
+        query = query.where(model.bucket_start < tail_from).order_by(model.bucket_start)
+        rows = [dict(row) for row in (await db.execute(query)).mappings().all()]
+
+    if tail_from <= end_date:
+        tail_to = end_date + timedelta(microseconds=1)
+        params = {"from_ts": tail_from, "to_ts": tail_to, "lead_until": tail_to + ROLLUP_LEAD_LOOKAHEAD}
+        if energetic_object_id:
+            params["energetic_object_id"] = energetic_object_id
+        tail_sql = _raw_rollup_select_sql(bucket_seconds, by_object=bool(energetic_object_id))
+        tail = await db.execute(text(tail_sql), params)
+        rows += [dict(zip(ROLLUP_COLUMNS, row)) for row in tail.all()]
+
+    rows.sort(key=lambda row: row["bucket_start"])
+    return rows
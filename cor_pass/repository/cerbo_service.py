@@ -2,10 +2,12 @@ import asyncio
 from datetime import datetime, timedelta
 from uuid import uuid4
 from fastapi import FastAPI, HTTPException
-from sqlalchemy import UUID, delete, func, select, update
+from sqlalchemy import UUID, delete, select, text, update
 from typing import Any, Dict, List, Optional, Tuple
 from math import ceil
 
+import numpy as np
+
 from cor_pass.database.models import CerboMeasurement, EnergeticObject, EnergeticSchedule
 from sqlalchemy.ext.asyncio import AsyncSession
 from cor_pass.schemas import (
@@ -21,11 +23,22 @@ from cor_pass.schemas import (
 from loguru import logger
 from pymodbus.client import AsyncModbusTcpClient
 from cor_pass.database.db import async_session_maker
+from cor_pass.repository.cerbo_pagination import count_measurements, fetch_measurement_page
+from cor_pass.services.cerbo_schedule_events import notify_schedule_changed
+from cor_pass.repository.cerbo_rollup import (
+    ENERGY_FIELDS,
+    get_energetic_object_id_by_name,
+    get_rollup_buckets,
+    pick_rollup_resolution,
+)
 
 error_count = 0
 
 COLLECTION_INTERVAL_SECONDS = 2
 
+ENERGY_CALCULATION_METHODS = ("auto", "rollup", "sql", "python")
+AVERAGING_METHODS = ("auto", "rollup", "numpy", "python")
+
 # Конфигурация Modbus
 MODBUS_IP = "91.203.25.12"
 MODBUS_PORT = 502
@@ -187,113 +200,99 @@ def decode_signed_32(high: int, low: int) -> int:
     return combined - 0x100000000 if combined >= 0x80000000 else combined
 
 
+async def _fetch_measurements(
+    db: AsyncSession,
+    query,
+    page_size: int,
+    cursor: Optional[str],
+    page: Optional[int],
+) -> Tuple[List[CerboMeasurement], Optional[str], Optional[int]]:
+    # count(*) по партициям считаем только для старого постраничного интерфейса
+    if cursor or page is None:
+        measurements, next_cursor = await fetch_measurement_page(db, query, page_size, cursor)
+        return measurements, next_cursor, None
+    measurements, next_cursor = await fetch_measurement_page(db, query, page_size, offset=(page - 1) * page_size)
+    return measurements, next_cursor, await count_measurements(db, query)
+
 
 async def get_device_measurements_paginated(
     db: AsyncSession,
-    page: int = 1,
     page_size: int = 10,
+    cursor: Optional[str] = None,
     object_name: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-) -> Tuple[List[CerboMeasurement], int]:
+    page: Optional[int] = None,
+) -> Tuple[List[CerboMeasurement], Optional[str], Optional[int]]:
     """
-    Получает записи CerboMeasurement с пагинацией и необязательными фильтрами.
+    Получает записи CerboMeasurement с keyset-пагинацией и необязательными фильтрами.
 
     Args:
         db: Асинхронная сессия базы данных.
-        page: Номер текущей страницы (начиная с 1).
         page_size: Количество записей на странице.
+        cursor: Курсор из предыдущего ответа (next_cursor).
         object_name: Необязательный фильтр по имени объекта.
         start_date: Необязательный фильтр по начальной дате measured_at.
         end_date: Необязательный фильтр по конечной дате measured_at.
+        page: Номер страницы для старых клиентов без курсора (начиная с 1).
 
     Returns:
-        Кортеж, содержащий список объектов CerboMeasurement и общее количество записей.
+        Кортеж из списка объектов CerboMeasurement, курсора следующей страницы (None, если это последняя)
+        и общего количества записей (только при запросе по номеру страницы, иначе None).
     """
 
     query = select(CerboMeasurement)
-    count_query = select(func.count()).select_from(CerboMeasurement)
 
     if object_name:
         query = query.where(CerboMeasurement.object_name == object_name)
-        count_query = count_query.where(CerboMeasurement.object_name == object_name)
 
     if start_date:
         query = query.where(CerboMeasurement.measured_at >= start_date)
-        count_query = count_query.where(CerboMeasurement.measured_at >= start_date)
 
     if end_date:
         query = query.where(CerboMeasurement.measured_at <= end_date)
-        count_query = count_query.where(CerboMeasurement.measured_at <= end_date)
-
-    offset = (page - 1) * page_size
-    query = (
-        query.offset(offset)
-        .limit(page_size)
-        .order_by(CerboMeasurement.measured_at.desc())
-    )
-
-    result = await db.execute(query)
-    measurements = result.scalars().all()
-
-    total_count_result = await db.execute(count_query)
-    total_count = total_count_result.scalar_one()
 
-    return measurements, total_count
+    return await _fetch_measurements(db, query, page_size, cursor, page)
 
 
 async def get_device_measurements_by_object_paginated(
     db: AsyncSession,
-    page: int = 1,
     page_size: int = 10,
+    cursor: Optional[str] = None,
     energetic_object_id: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-) -> Tuple[List[CerboMeasurement], int]:
+    page: Optional[int] = None,
+) -> Tuple[List[CerboMeasurement], Optional[str], Optional[int]]:
     """
-    Получает записи измерений инвертора с пагинацией и необязательными фильтрами по ID энергетического обьекта .
+    Получает записи измерений с keyset-пагинацией и необязательными фильтрами по ID энергетического обьекта.
 
     Args:
         db: Асинхронная сессия базы данных.
-        page: Номер текущей страницы (начиная с 1).
         page_size: Количество записей на странице.
+        cursor: Курсор из предыдущего ответа (next_cursor).
         energetic_object_id: Фильтр по ID энергетического объекта.
         start_date: Необязательный фильтр по начальной дате measured_at.
         end_date: Необязательный фильтр по конечной дате measured_at.
+        page: Номер страницы для старых клиентов без курсора (начиная с 1).
 
     Returns:
-        Кортеж, содержащий список объектов CerboMeasurement и общее количество записей.
+        Кортеж из списка объектов CerboMeasurement, курсора следующей страницы (None, если это последняя)
+        и общего количества записей (только при запросе по номеру страницы, иначе None).
     """
 
     query = select(CerboMeasurement)
-    count_query = select(func.count()).select_from(CerboMeasurement)
 
     if energetic_object_id:
         query = query.where(CerboMeasurement.energetic_object_id == energetic_object_id)
-        count_query = count_query.where(CerboMeasurement.energetic_object_id == energetic_object_id)
 
     if start_date:
         query = query.where(CerboMeasurement.measured_at >= start_date)
-        count_query = count_query.where(CerboMeasurement.measured_at >= start_date)
 
     if end_date:
         query = query.where(CerboMeasurement.measured_at <= end_date)
-        count_query = count_query.where(CerboMeasurement.measured_at <= end_date)
 
-    offset = (page - 1) * page_size
-    query = (
-        query.offset(offset)
-        .limit(page_size)
-        .order_by(CerboMeasurement.measured_at.desc())
-    )
-
-    result = await db.execute(query)
-    measurements = result.scalars().all()
-
-    total_count_result = await db.execute(count_query)
-    total_count = total_count_result.scalar_one()
-
-    return measurements, total_count
+    return await _fetch_measurements(db, query, page_size, cursor, page)
 
 async def create_schedule(
     db: AsyncSession, schedule_data: EnergeticScheduleCreate
@@ -322,6 +321,7 @@ async def create_schedule(
     db.add(db_schedule)
     await db.commit()
     await db.refresh(db_schedule)
+    await notify_schedule_changed(db_schedule.energetic_object_id)
     return db_schedule
 
 
@@ -353,6 +353,7 @@ async def create_schedule_with_energetic_object_id(
     db.add(db_schedule)
     await db.commit()
     await db.refresh(db_schedule)
+    await notify_schedule_changed(db_schedule.energetic_object_id)
     return db_schedule
 
 
@@ -417,6 +418,7 @@ async def update_schedule(
 
     await db.commit()
     await db.refresh(db_schedule)
+    await notify_schedule_changed(db_schedule.energetic_object_id)
     return db_schedule
 
 
@@ -425,10 +427,15 @@ async def delete_schedule(db: AsyncSession, schedule_id: str) -> bool:
     Удаляет расписание по ID.
     """
     result = await db.execute(
-        delete(EnergeticSchedule).where(EnergeticSchedule.id == schedule_id)
+        delete(EnergeticSchedule)
+        .where(EnergeticSchedule.id == schedule_id)
+        .returning(EnergeticSchedule.energetic_object_id)
     )
+    deleted_object_ids = result.scalars().all()
     await db.commit()
-    return result.rowcount > 0
+    for energetic_object_id in deleted_object_ids:
+        await notify_schedule_changed(energetic_object_id)
+    return len(deleted_object_ids) > 0
 
 
 async def update_schedule_is_active_status(
@@ -626,11 +633,184 @@ async def get_averaged_measurements_service(
     object_name: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    intervals: int = 60
+    intervals: int = 60,
+    method: str = "auto",
 ) -> List[CerboMeasurementResponse]:
+    """
+    Усредняет измерения по intervals равным интервалам периода.
+    method: "rollup" — по таблицам агрегатов, "numpy" — векторно по сырым измерениям,
+    "python" — эталонный расчёт в Python по сырым измерениям,
+    "auto" — агрегаты, если подходят, иначе NumPy.
+    """
     if not start_date or not end_date:
         raise ValueError("Необходимо указать start_date и end_date")
+    if method not in AVERAGING_METHODS:
+        raise ValueError(f"Неизвестный метод расчёта: {method}. Допустимые: {', '.join(AVERAGING_METHODS)}")
+
+    if method == "python":
+        return await _get_averaged_measurements_raw(db, object_name, start_date, end_date, intervals)
+    if method == "numpy":
+        return await _get_averaged_measurements_numpy(db, object_name, start_date, end_date, intervals)
+
+    # Берём самые крупные агрегаты, которые не больше одного интервала графика
+    interval_size = (end_date - start_date) / intervals
+    resolution = pick_rollup_resolution(interval_size.total_seconds())
+    if resolution:
+        energetic_object_id = None
+        if object_name:
+            energetic_object_id = await get_energetic_object_id_by_name(db, object_name)
+        if energetic_object_id or not object_name:
+            return await _get_averaged_measurements_from_rollups(
+                db, resolution, object_name, energetic_object_id, start_date, end_date, intervals
+            )
+    if method == "rollup":
+        raise ValueError("Для указанного объекта и интервала нет подходящих агрегатов")
+
+    return await _get_averaged_measurements_numpy(db, object_name, start_date, end_date, intervals)
+
+
+async def _get_averaged_measurements_from_rollups(
+    db: AsyncSession,
+    resolution: Tuple[int, Any],
+    object_name: Optional[str],
+    energetic_object_id: Optional[str],
+    start_date: datetime,
+    end_date: datetime,
+    intervals: int,
+) -> List[CerboMeasurementResponse]:
+    bucket_seconds, model = resolution
+    buckets = await get_rollup_buckets(
+        db, bucket_seconds, model, start_date, end_date, energetic_object_id
+    )
+    if not buckets:
+        return []
+
+    interval_size = (end_date - start_date) / intervals
+    # Агрегат относится к интервалу графика, в который попадает его середина
+    half_bucket = timedelta(seconds=bucket_seconds / 2)
+    grouped_buckets = [[] for _ in range(intervals)]
+    for bucket in buckets:
+        interval_idx = min(
+            max(int((bucket["bucket_start"] + half_bucket - start_date) / interval_size), 0),
+            intervals - 1
+        )
+        grouped_buckets[interval_idx].append(bucket)
+
+    averaged_results = []
+    for i, rows in enumerate(grouped_buckets):
+        if not rows:
+            continue
+
+        interval_start = start_date + i * interval_size
+
+        # Среднее по интервалу взвешивается количеством сырых измерений в каждом агрегате
+        def avg(field):
+            weighted = [(r[f"{field}_avg"], r["measurement_count"]) for r in rows if r[f"{field}_avg"] is not None]
+            count = sum(c for _, c in weighted)
+            return sum(v * c for v, c in weighted) / count if count else None
+
+        averaged_results.append(CerboMeasurementResponse(
+            id=rows[0]["energetic_object_id"],
+            created_at=interval_start,
+            measured_at=interval_start,
+            object_name=object_name,
+            general_battery_power=avg("general_battery_power"),
+            inverter_total_ac_output=avg("inverter_total_ac_output"),
+            ess_total_input_power=avg("ess_total_input_power"),
+            solar_total_pv_power=avg("solar_total_pv_power"),
+            soc=avg("soc")
+        ))
+
+    return averaged_results
+
+
+AVERAGED_FIELDS = (
+    "general_battery_power",
+    "inverter_total_ac_output",
+    "ess_total_input_power",
+    "solar_total_pv_power",
+    "soc",
+)
+
+
+async def _get_averaged_measurements_numpy(
+    db: AsyncSession,
+    object_name: Optional[str],
+    start_date: datetime,
+    end_date: datetime,
+    intervals: int,
+) -> List[CerboMeasurementResponse]:
+    """
+    Тот же расчёт, что и _get_averaged_measurements_raw, но без ORM-объектов:
+    читаются только нужные столбцы, интервалы и средние считаются в NumPy.
+    Пустые (NULL) значения не участвуют в среднем своего поля.
+    """
+    query = select(
+        CerboMeasurement.id,
+        CerboMeasurement.created_at,
+        CerboMeasurement.object_name,
+        CerboMeasurement.measured_at,
+        *(getattr(CerboMeasurement, field) for field in AVERAGED_FIELDS),
+    ).where(
+        CerboMeasurement.measured_at >= start_date,
+        CerboMeasurement.measured_at <= end_date
+    )
+    if object_name:
+        query = query.where(CerboMeasurement.object_name == object_name)
+
+    rows = (await db.execute(query)).all()
+    if not rows:
+        return []
 
+    ids, created, names, measured_at, *values = zip(*rows)
+
+    # Номер интервала — целая часть (measured_at - start_date) / interval_size, в микросекундах
+    interval_size = (end_date - start_date) / intervals
+    offsets = (
+        np.array(measured_at, dtype="datetime64[us]") - np.datetime64(start_date, "us")
+    ).astype(np.int64)
+    interval_us = interval_size / timedelta(microseconds=1)
+    bucket_idx = np.minimum(
+        np.floor_divide(offsets, interval_us).astype(np.int64), intervals - 1
+    )
+
+    # NULL превращается в NaN и исключается из суммы и количества своего поля
+    averages = {}
+    for field, column in zip(AVERAGED_FIELDS, values):
+        data = np.array(column, dtype=np.float64)
+        valid = ~np.isnan(data)
+        sums = np.bincount(bucket_idx[valid], weights=data[valid], minlength=intervals)
+        counts = np.bincount(bucket_idx[valid], minlength=intervals)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages[field] = np.where(counts > 0, sums / counts, np.nan)
+
+    # Первая строка интервала даёт id, created_at и object_name, как в эталонном расчёте
+    filled, first_rows = np.unique(bucket_idx, return_index=True)
+
+    averaged_results = []
+    for i, row_idx in zip(filled.tolist(), first_rows.tolist()):
+        point = {}
+        for field in AVERAGED_FIELDS:
+            value = averages[field][i]
+            point[field] = None if np.isnan(value) else float(value)
+        averaged_results.append(CerboMeasurementResponse(
+            id=ids[row_idx],
+            created_at=created[row_idx],
+            measured_at=start_date + i * interval_size,
+            object_name=names[row_idx],
+            **point
+        ))
+
+    return averaged_results
+
+
+async def _get_averaged_measurements_raw(
+    db: AsyncSession,
+    object_name: Optional[str],
+    start_date: datetime,
+    end_date: datetime,
+    intervals: int,
+) -> List[CerboMeasurementResponse]:
     # Получаем все данные за период одним запросом
     query = select(CerboMeasurement).where(
         CerboMeasurement.measured_at >= start_date,
@@ -823,10 +1003,19 @@ async def get_energy_measurements_service(
     object_name: Optional[str],
     start_date: datetime,
     end_date: datetime,
-    interval_minutes: int = 30
+    interval_minutes: int = 30,
+    method: str = "auto",
 ) -> dict:
+    """
+    Считает энергию по интервалам и итоговые значения за период.
+    method: "rollup" — по таблицам агрегатов, "sql" — одним запросом по сырым измерениям,
+    "python" — эталонный расчёт в Python по сырым измерениям,
+    "auto" — агрегаты, если подходят, иначе SQL.
+    """
     if not start_date or not end_date:
         raise ValueError("Необходимо указать start_date и end_date")
+    if method not in ENERGY_CALCULATION_METHODS:
+        raise ValueError(f"Неизвестный метод расчёта: {method}. Допустимые: {', '.join(ENERGY_CALCULATION_METHODS)}")
 
   
  #   rounded_start = start_date.replace(minute=0, second=0, microsecond=0)
@@ -840,7 +1029,210 @@ async def get_energy_measurements_service(
         rounded_end = (end_date.replace(minute=0, second=0, microsecond=0)
                        + timedelta(hours=1))
 
-    
+    if method == "python":
+        return await _get_energy_measurements_raw(db, object_name, rounded_start, rounded_end, interval_minutes)
+    if method == "sql":
+        return await _get_energy_measurements_sql(db, object_name, rounded_start, rounded_end, interval_minutes)
+
+    # Интервалы выровнены по часу, поэтому подходит любой агрегат, который делит интервал нацело
+    resolution = pick_rollup_resolution(interval_minutes * 60, aligned=True)
+    if resolution:
+        energetic_object_id = None
+        if object_name:
+            energetic_object_id = await get_energetic_object_id_by_name(db, object_name)
+        if energetic_object_id or not object_name:
+            return await _get_energy_measurements_from_rollups(
+                db, resolution, energetic_object_id, rounded_start, rounded_end, interval_minutes
+            )
+    if method == "rollup":
+        raise ValueError("Для указанного объекта и интервала нет подходящих агрегатов")
+
+    return await _get_energy_measurements_sql(db, object_name, rounded_start, rounded_end, interval_minutes)
+
+
+# Повторяет расчёт _get_energy_measurements_raw целиком в PostgreSQL:
+# интервал измерения — целая часть (measured_at - начало) / длина интервала,
+# энергия интервала — сумма мощности на время до следующего измерения того же интервала,
+# итоги — то же по всей последовательности измерений без учёта границ интервалов.
+ENERGY_INTERVALS_SQL = """
+    SELECT
+        interval_idx,
+        count(*),
+        sum(solar_total_pv_power * interval_delta_h) / 1000.0,
+        sum(inverter_total_ac_output * interval_delta_h) / 1000.0,
+        sum(ess_total_input_power * interval_delta_h) / 1000.0,
+        sum(general_battery_power * interval_delta_h) / 1000.0,
+        sum(solar_total_pv_power * delta_h) FILTER (WHERE delta_h > 0) / 1000.0,
+        sum(inverter_total_ac_output * delta_h) FILTER (WHERE delta_h > 0) / 1000.0,
+        sum(ess_total_input_power * delta_h) FILTER (WHERE delta_h > 0 AND ess_total_input_power >= 0) / 1000.0,
+        -sum(ess_total_input_power * delta_h) FILTER (WHERE delta_h > 0 AND ess_total_input_power < 0) / 1000.0,
+        sum(general_battery_power * delta_h) FILTER (WHERE delta_h > 0) / 1000.0
+    FROM (
+        SELECT
+            interval_idx,
+            solar_total_pv_power,
+            inverter_total_ac_output,
+            ess_total_input_power,
+            general_battery_power,
+            EXTRACT(EPOCH FROM (
+                lead(measured_at) OVER (PARTITION BY interval_idx ORDER BY measured_at) - measured_at
+            )) / 3600.0 AS interval_delta_h,
+            EXTRACT(EPOCH FROM (
+                lead(measured_at) OVER (ORDER BY measured_at) - measured_at
+            )) / 3600.0 AS delta_h
+        FROM (
+            SELECT
+                measured_at,
+                solar_total_pv_power,
+                inverter_total_ac_output,
+                ess_total_input_power,
+                general_battery_power,
+                floor(EXTRACT(EPOCH FROM (measured_at - CAST(:start_ts AS timestamp))) / CAST(:interval_seconds AS integer))::int AS interval_idx
+            FROM cerbo_measurements
+            WHERE measured_at >= CAST(:start_ts AS timestamp)
+              AND measured_at <= CAST(:end_ts AS timestamp)
+              {object_filter}
+        ) AS samples
+    ) AS deltas
+    GROUP BY interval_idx
+"""
+
+
+async def _get_energy_measurements_sql(
+    db: AsyncSession,
+    object_name: Optional[str],
+    rounded_start: datetime,
+    rounded_end: datetime,
+    interval_minutes: int,
+) -> dict:
+    interval_delta = timedelta(minutes=interval_minutes)
+    params = {
+        "start_ts": rounded_start,
+        "end_ts": rounded_end,
+        "interval_seconds": interval_minutes * 60,
+    }
+    object_filter = ""
+    if object_name:
+        object_filter = "AND object_name = :object_name"
+        params["object_name"] = object_name
+
+    result = await db.execute(text(ENERGY_INTERVALS_SQL.format(object_filter=object_filter)), params)
+
+    intervals = []
+    current_interval_start = rounded_start
+    while current_interval_start < rounded_end:
+        intervals.append({
+            "start": current_interval_start,
+            "end": current_interval_start + interval_delta,
+            "measurement_count": 0,
+            "energy": {},
+        })
+        current_interval_start += interval_delta
+
+    totals = {field: 0.0 for field in ENERGY_FIELDS}
+    for (
+        interval_idx, count, solar, load, grid, battery,
+        total_solar, total_load, total_import, total_export, total_battery,
+    ) in result.all():
+        # Итоги учитывают и измерения за пределами последнего интервала (ровно в rounded_end)
+        totals["solar_energy_kwh"] += total_solar or 0.0
+        totals["load_energy_kwh"] += total_load or 0.0
+        totals["grid_import_kwh"] += total_import or 0.0
+        totals["grid_export_kwh"] += total_export or 0.0
+        totals["battery_energy_kwh"] += total_battery or 0.0
+
+        if not 0 <= interval_idx < len(intervals):
+            continue
+        intervals[interval_idx]["measurement_count"] = count
+        intervals[interval_idx]["energy"] = {
+            "solar_energy_kwh": solar or 0.0,
+            "load_energy_kwh": load or 0.0,
+            "grid_energy_kwh": grid or 0.0,
+            "battery_energy_kwh": battery or 0.0,
+        }
+
+    return {
+        "intervals": [_build_energy_interval_result(interval, interval["energy"]) for interval in intervals],
+        "totals": {
+            "solar_energy_total": round(totals["solar_energy_kwh"], 0),
+            "load_energy_total": round(totals["load_energy_kwh"], 0),
+            "grid_import_total": round(totals["grid_import_kwh"], 0),
+            "grid_export_total": round(totals["grid_export_kwh"], 0),
+            "battery_energy_total": round(totals["battery_energy_kwh"], 0),
+        }
+    }
+
+
+def _build_energy_interval_result(interval: dict, energy: Dict[str, float]) -> dict:
+    if interval["measurement_count"] < 2:
+        energy = {}
+    return {
+        "interval_start": interval["start"],
+        "interval_end": interval["end"],
+        "solar_energy_kwh": round(energy.get("solar_energy_kwh", 0.0), 3),
+        "load_energy_kwh": round(energy.get("load_energy_kwh", 0.0), 3),
+        "grid_energy_kwh": round(energy.get("grid_energy_kwh", 0.0), 3),
+        "battery_energy_kwh": round(energy.get("battery_energy_kwh", 0.0), 3),
+        "measurement_count": interval["measurement_count"],
+        "has_sufficient_data": interval["measurement_count"] >= 3
+    }
+
+
+async def _get_energy_measurements_from_rollups(
+    db: AsyncSession,
+    resolution: Tuple[int, Any],
+    energetic_object_id: Optional[str],
+    rounded_start: datetime,
+    rounded_end: datetime,
+    interval_minutes: int,
+) -> dict:
+    bucket_seconds, model = resolution
+    interval_delta = timedelta(minutes=interval_minutes)
+    buckets = await get_rollup_buckets(
+        db, bucket_seconds, model, rounded_start, rounded_end, energetic_object_id
+    )
+
+    intervals = []
+    current_interval_start = rounded_start
+    while current_interval_start < rounded_end:
+        intervals.append({
+            "start": current_interval_start,
+            "end": current_interval_start + interval_delta,
+            "measurement_count": 0,
+            "energy": {field: 0.0 for field in ENERGY_FIELDS},
+        })
+        current_interval_start += interval_delta
+
+    totals = {field: 0.0 for field in ENERGY_FIELDS}
+    for bucket in buckets:
+        interval_idx = int((bucket["bucket_start"] - rounded_start) / interval_delta)
+        if not 0 <= interval_idx < len(intervals):
+            continue
+        interval = intervals[interval_idx]
+        interval["measurement_count"] += bucket["measurement_count"]
+        for field in ENERGY_FIELDS:
+            interval["energy"][field] += bucket[field]
+            totals[field] += bucket[field]
+
+    return {
+        "intervals": [_build_energy_interval_result(interval, interval["energy"]) for interval in intervals],
+        "totals": {
+            "solar_energy_total": round(totals["solar_energy_kwh"], 0),
+            "load_energy_total": round(totals["load_energy_kwh"], 0),
+            "grid_import_total": round(totals["grid_import_kwh"], 0),
+            "grid_export_total": round(totals["grid_export_kwh"], 0),
+            "battery_energy_total": round(totals["battery_energy_kwh"], 0),
+        }
+    }
+
+
+async def _get_energy_measurements_raw(
+    db: AsyncSession,
+    object_name: Optional[str],
+    rounded_start: datetime,
+    rounded_end: datetime,
+    interval_minutes: int,
+) -> dict:
     # Создаем интервалы
     current_interval_start = rounded_start
     intervals = []
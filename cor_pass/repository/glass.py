@@ -3,7 +3,6 @@ from datetime import datetime, time
 import time as t
 from io import BytesIO
 import os
-import socket
 import tempfile
 from threading import Timer
 from fastapi import HTTPException, Request
@@ -11,14 +10,14 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from cor_pass.repository.printing_device import get_printing_device_by_device_class, get_printing_device_by_device_identifier
 from cor_pass.schemas import ChangeGlassStaining, Glass as GlassModelScheema, GlassPrinting, GlassResponseForPrinting, PrintLabel
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy.orm import selectinload, joinedload
 from cor_pass.database import models as db_models
 from cor_pass.repository import case as repository_cases
 from cor_pass.services.glass_and_cassette_printing import print_labels
 from loguru import logger
 from cor_pass.config.config import settings
-from smb.SMBConnection import SMBConnection
+from cor_pass.services.smb_client import smb_pool, smb_relative_path
 
 async def get_glass(db: AsyncSession, glass_id: int) -> GlassModelScheema | None:
     """Асинхронно получает конкретное стекло, связанное с кассетой по её ID и номеру."""
@@ -31,151 +30,93 @@ async def get_glass(db: AsyncSession, glass_id: int) -> GlassModelScheema | None
 
     return None
 
-async def get_glass_preview_png(db: AsyncSession, glass_id: str):
+async def get_glass_preview_urls(db: AsyncSession, glass_ids: List[str]) -> Dict[str, Optional[str]]:
     """
-    Получает запись Glass по ID с проверкой наличия preview_url.
+    preview_url стёкол одним запросом по колонкам, без загрузки связанных кассет и кейсов.
+    Стёкол, которых нет в базе, нет и в ответе.
     """
     result = await db.execute(
-        select(db_models.Glass)
-        .options(
-            joinedload(db_models.Glass.cassette)
-            .joinedload(db_models.Cassette.sample)
-            .joinedload(db_models.Sample.case)
-        )
-        .where(db_models.Glass.id == glass_id)
+        select(db_models.Glass.id, db_models.Glass.preview_url).where(db_models.Glass.id.in_(glass_ids))
     )
-    glass = result.scalars().first()
-    if glass is None:
-        return None
-    # if not glass.preview_url:
-    #     logger.error(f"preview_url не задан для стекла с ID {glass_id}")
-    #     return None
-    logger.debug(f"Найдено стекло с ID {glass_id}, preview_url: {glass.preview_url}")
-    return glass
+    return {glass_id: preview_url for glass_id, preview_url in result.all()}
 
-async def fetch_file_from_smb(path: str) -> str:
+async def get_smb_file_attributes(path: str) -> Tuple[int, float]:
     """
-    Загружает файл с SMB-сервера во временный файл и возвращает путь к нему.
+    Возвращает размер и время последнего изменения файла на SMB-сервере без его загрузки.
     """
     loop = asyncio.get_running_loop()
 
-    def _read_file():
-        conn = SMBConnection(
-            settings.smb_user,
-            settings.smb_pass,
-            my_name=socket.gethostname(),
-            remote_name=settings.remote_name,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        if not conn.connect(settings.smb_server_ip, 445):
-            logger.error(f"Не удалось подключиться к SMB-серверу {settings.smb_server_ip}")
-            raise RuntimeError("Failed to connect to SMB server")
+    def _get_attributes():
+        with smb_pool.connection() as conn:
+            file_info = conn.getAttributes(settings.smb_share, smb_relative_path(path))
+            return file_info.file_size, file_info.last_write_time
 
-        prefix = f"\\\\{settings.smb_server_ip}\\{settings.smb_share}\\"
-        if path.startswith(prefix):
-            relative_path = path[len(prefix):].strip("/\\")
-        else:
-            relative_path = path.strip("/\\")
+    return await loop.run_in_executor(None, _get_attributes)
 
-        logger.debug(f"Загрузка файла с SMB: {relative_path}")
 
-        try:
-            file_info = conn.getAttributes(settings.smb_share, relative_path)
-            filesize = getattr(file_info, "file_size", None)
-            if filesize is None:
-                logger.error(f"Не удалось получить размер файла для {relative_path}")
-                raise ValueError("Cannot get filesize from SMB file_info")
+def _retrieve_smb_file(path: str, target_dir: Optional[str] = None) -> str:
+    """Скачивает файл с SMB через сессию из smb_pool во временный файл и проверяет размер."""
+    relative_path = smb_relative_path(path)
+    logger.debug(f"Загрузка файла с SMB: {relative_path}")
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                start_time = datetime.now()
-                conn.retrieveFile(settings.smb_share, relative_path, temp_file)
-                temp_file.flush()
-                logger.debug(f"Время загрузки файла: {datetime.now() - start_time} секунд")
+    with smb_pool.connection() as conn:
+        file_info = conn.getAttributes(settings.smb_share, relative_path)
+        filesize = getattr(file_info, "file_size", None)
+        if filesize is None:
+            logger.error(f"Не удалось получить размер файла для {relative_path}")
+            raise ValueError("Cannot get filesize from SMB file_info")
 
-                temp_file.seek(0, os.SEEK_END)
-                file_size = temp_file.tell()
-                if file_size != filesize:
-                    logger.error(f"Ожидалось {filesize} байт, но записано {file_size} байт")
-                    raise RuntimeError(f"Expected {filesize} bytes, but wrote {file_size} bytes")
-                
-                return temp_file.name
-        finally:
-            conn.close()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".png", dir=target_dir) as temp_file:
+            start_time = datetime.now()
+            conn.retrieveFile(settings.smb_share, relative_path, temp_file)
+            temp_file.flush()
+            logger.debug(f"Время загрузки файла: {datetime.now() - start_time} секунд")
 
-    return await loop.run_in_executor(None, _read_file)
+            temp_file.seek(0, os.SEEK_END)
+            file_size = temp_file.tell()
+    if file_size != filesize:
+        os.unlink(temp_file.name)
+        logger.error(f"Ожидалось {filesize} байт, но записано {file_size} байт")
+        raise RuntimeError(f"Expected {filesize} bytes, but wrote {file_size} bytes")
 
+    return temp_file.name
 
-async def fetch_file_from_smb_with_timeout(path: str) -> str:
+
+async def fetch_file_from_smb(path: str, target_dir: Optional[str] = None) -> str:
     """
     Загружает файл с SMB-сервера во временный файл и возвращает путь к нему.
+    target_dir — каталог для временного файла, чтобы затем переименовать его без копирования.
     """
     loop = asyncio.get_running_loop()
-
-    def _read_file():
-        conn = SMBConnection(
-            settings.smb_user,
-            settings.smb_pass,
-            my_name=socket.gethostname(),
-            remote_name=settings.remote_name,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        if not conn.connect(settings.smb_server_ip, 445):
-            logger.error(f"Не удалось подключиться к SMB-серверу {settings.smb_server_ip}")
-            raise RuntimeError("Failed to connect to SMB server")
-
-
-        prefix = f"\\\\{settings.smb_server_ip}\\{settings.smb_share}\\"
-        if path.startswith(prefix):
-            relative_path = path[len(prefix):].strip("/\\")
-        else:
-            relative_path = path.strip("/\\")
-
-        logger.debug(f"Загрузка файла с SMB: {relative_path}")
-
-        try:
-            file_info = conn.getAttributes(settings.smb_share, relative_path)
-            filesize = getattr(file_info, "file_size", None)
-            if filesize is None:
-                logger.error(f"Не удалось получить размер файла для {relative_path}")
-                raise ValueError("Cannot get filesize from SMB file_info")
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                start_time = datetime.now()
-                conn.retrieveFile(settings.smb_share, relative_path, temp_file)
-                temp_file.flush()
-                logger.debug(f"Время загрузки файла: {datetime.now() - start_time} секунд")
-
-                temp_file.seek(0, os.SEEK_END)
-                file_size = temp_file.tell()
-                if file_size != filesize:
-                    logger.error(f"Ожидалось {filesize} байт, но записано {file_size} байт")
-                    raise RuntimeError(f"Expected {filesize} bytes, but wrote {file_size} bytes")
-                
-                return temp_file.name
-        finally:
-            conn.close()
+    return await loop.run_in_executor(None, _retrieve_smb_file, path, target_dir)
 
 
-    return await loop.run_in_executor(None, _read_file)
+async def fetch_file_from_smb_with_timeout(path: str) -> str:
+    """
+    Загружает файл с SMB-сервера во временный файл и возвращает путь к нему.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _retrieve_smb_file, path)
 
 
 async def fetch_png_from_smb(path: str) -> BytesIO:
     """
     Загружает PNG-файл с SMB-сервера и возвращает его содержимое в BytesIO.
+    Превью небольшие, поэтому читаются сразу в память, без временного файла.
     """
+    loop = asyncio.get_running_loop()
+
+    def _read_file():
+        relative_path = smb_relative_path(path)
+        buf = BytesIO()
+        with smb_pool.connection() as conn:
+            conn.retrieveFile(settings.smb_share, relative_path, buf)
+        buf.seek(0)
+        logger.debug(f"PNG-файл успешно загружен в память: {path}")
+        return buf
+
     try:
-        temp_file_path = await fetch_file_from_smb_with_timeout(path)
-        try:
-            with open(temp_file_path, "rb") as f:
-                buf = BytesIO(f.read())
-                logger.debug(f"PNG-файл успешно загружен в память: {path}")
-                return buf
-        finally:
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                logger.debug(f"Временный файл {temp_file_path} удалён")
+        return await loop.run_in_executor(None, _read_file)
     except Exception as e:
         logger.error(f"Ошибка при загрузке PNG-файла {path}: {str(e)}")
         raise
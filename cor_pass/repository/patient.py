@@ -1,10 +1,11 @@
 import base64
 from datetime import date
 import re
-from typing import Optional
+from typing import List, Optional, Tuple
 import uuid
 from fastapi import HTTPException, status
-from sqlalchemy import or_, select
+from sqlalchemy import Text, any_, bindparam, func, literal_column, select, type_coerce
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import selectinload, joinedload
 from cor_pass.database.models import (
     Case,
@@ -39,6 +40,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from cor_pass.services.search_token_generator import get_patient_search_tokens
 
+# Сколько кандидатов возвращает поиск пациента по ФИО
+PATIENT_SEARCH_LIMIT = 10
+
 
 async def register_new_patient(
     db: AsyncSession, body: NewPatientRegistration, doctor: Doctor
@@ -394,53 +398,52 @@ async def create_standalone_patient(
         send_email=False,
     )
 
-async def find_patient(
-    db: AsyncSession, search_ngrams_joined: str,
-) -> Patient | None: 
-    
-    search_ngrams = search_ngrams_joined.split(' ') 
-    
-    if not search_ngrams:
-        return None 
+def _search_token_array():
+    # то же выражение, что в индексе idx_patients_search_tokens, иначе планировщик индекс не возьмёт
+    return type_coerce(func.string_to_array(Patient.search_tokens, literal_column("' '")), ARRAY(Text))
 
-    conditions = []
-    for ngram in search_ngrams:
-        conditions.append(Patient.search_tokens.ilike(f"%{ngram}%"))
 
+async def search_patients(
+    db: AsyncSession, search_ngrams: List[str], limit: int = PATIENT_SEARCH_LIMIT
+) -> List[Tuple[Patient, int]]:
+    """
+    Пациенты с наибольшим числом совпавших н-грамм ФИО и это число, лучшие первыми.
+    Кандидаты отбираются по GIN-индексу idx_patients_search_tokens по триграммам запроса
+    (биграммы есть почти у всех пациентов), только для запроса без триграмм — по биграммам.
+    Счёт — по всем н-граммам запроса, считается и сортируется в SQL.
+    """
+    search_ngrams = [ngram for ngram in dict.fromkeys(search_ngrams) if ngram]
+    if not search_ngrams:
+        return []
+    trigrams = [ngram for ngram in search_ngrams if len(ngram) >= 3]
+
+    token_array = _search_token_array()
+    query_ngrams = func.unnest(bindparam("search_ngrams", search_ngrams, type_=ARRAY(Text))).table_valued("ngram").render_derived()
+    score = (
+        select(func.count())
+        .select_from(query_ngrams)
+        .where(query_ngrams.c.ngram == any_(token_array))
+        .scalar_subquery()
+        .label("score")
+    )
     patient_query = (
-        select(Patient)
-        .where(or_(*conditions))
+        select(Patient, score)
+        .where(token_array.overlap(bindparam("candidate_ngrams", trigrams or search_ngrams, type_=ARRAY(Text))))
+        .order_by(score.desc(), Patient.id)
+        .limit(limit)
     )
-    
-    logger.debug(f"Generated Candidate SQL Query: {patient_query.compile(compile_kwargs={'literal_binds': True})}")
-    pat_exec = await db.execute(patient_query)
-    candidate_patients = pat_exec.scalars().all() 
-    
-    if not candidate_patients:
-        return None 
-
-    patient_scores = []
-    for patient in candidate_patients:
-        score = 0
-        patient_tokens = patient.search_tokens.split(' ') if patient.search_tokens else []
-        
-        for search_ngram in search_ngrams:
-
-
-            if search_ngram in patient.search_tokens: 
-                score += 1
-            
-        patient_scores.append((patient, score))
-
-    patient_scores.sort(key=lambda x: x[1], reverse=True)
+    result = await db.execute(patient_query)
+    return [(patient, patient_score) for patient, patient_score in result.all()]
 
 
-    most_relevant_patient = patient_scores[0][0] 
-    
-    if patient_scores[0][1] == 0:
+async def find_patient(
+    db: AsyncSession, search_ngrams_joined: str,
+) -> Patient | None: 
+    """Самый подходящий пациент для н-грамм запроса через пробел, см. search_patients."""
+    matches = await search_patients(db, search_ngrams_joined.split(' '), limit=1)
+    if not matches:
         return None
-        
-    return most_relevant_patient
+    return matches[0][0]
 
 
 async def get_single_patient_by_corid(db: AsyncSession, cor_id: str)-> Patient | None:
@@ -1,9 +1,11 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
 from typing import List, Optional
+from fastapi.responses import StreamingResponse
 from cor_pass.database.models import User
+from cor_pass.repository.cerbo_export import EXPORT_MEDIA_TYPES, build_export_query, export_measurements
 from cor_pass.repository.cerbo_service import BATTERY_ID, ESS_UNIT_ID, INVERTER_ID, REGISTERS, create_energetic_object, create_schedule, create_schedule_with_energetic_object_id, decode_signed_16, decode_signed_32, delete_energetic_object, delete_schedule, get_all_energetic_objects, get_all_schedules, get_all_schedules_by_object_id, get_device_measurements_by_object_paginated, get_device_measurements_paginated,get_averaged_measurements_service, get_energetic_object,get_energy_measurements_service, get_modbus_client, get_schedule_by_id, register_modbus_error, update_energetic_object, update_schedule
-from cor_pass.schemas import CerboMeasurementResponse, DVCCMaxChargeCurrentRequest, EnergeticObjectCreate, EnergeticObjectResponse, EnergeticObjectUpdate, EnergeticScheduleBase, EnergeticScheduleCreate, EnergeticScheduleCreateForObject, EnergeticScheduleResponse, EssAdvancedControl, GridLimitUpdate, InverterPowerPayload, PaginatedResponse, RegisterWriteRequest, VebusSOCControl, WSMessageBase
+from cor_pass.schemas import CerboMeasurementResponse, CursorPaginatedResponse, DVCCMaxChargeCurrentRequest, EnergeticObjectCreate, EnergeticObjectResponse, EnergeticObjectUpdate, EnergeticScheduleBase, EnergeticScheduleCreate, EnergeticScheduleCreateForObject, EnergeticScheduleResponse, EssAdvancedControl, GridLimitUpdate, InverterPowerPayload, RegisterWriteRequest, VebusSOCControl, WSMessageBase
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from cor_pass.database.db import get_db
@@ -13,6 +15,7 @@ from cor_pass.repository import person as repository_person
 from cor_pass.services.auth import auth_service
 from cor_pass.services.websocket_events_manager import websocket_events_manager
 from cor_pass.database.redis_db import redis_client
+from cor_pass.config.config import settings
 
 ERROR_THRESHOLD = 9
 error_count = 0
@@ -738,72 +741,107 @@ async def write_register(request_data: RegisterWriteRequest, request: Request):
 
 # Добавить energetic object id - done
 
+def _measurements_response(measurements, page_size: int, next_cursor: Optional[str], page: Optional[int], total_count: Optional[int]):
+    response = CursorPaginatedResponse(
+        items=[CerboMeasurementResponse.model_validate(m) for m in measurements],
+        page_size=page_size,
+        next_cursor=next_cursor
+    )
+    if total_count is not None:
+        # старый постраничный интерфейс ждёт те же поля, что отдавал PaginatedResponse
+        response.total_count = total_count
+        response.page = page
+        response.total_pages = ceil(total_count / page_size) if total_count > 0 else 0
+    return response
+
+
 @router.get(
     "/measurements/",
-    response_model=PaginatedResponse[CerboMeasurementResponse], 
+    response_model=CursorPaginatedResponse[CerboMeasurementResponse],
     summary="Получить все измерения CerboMeasurement с пагинацией и фильтрацией",
     description="Получает список всех измерений с поддержкой пагинации, фильтрации по имени объекта и диапазону дат.",
     tags=["Measurements"]
 )
 async def read_measurements(
-    page: int = Query(1, ge=1, description="Номер страницы (начиная с 1)"),
     page_size: int = Query(10, ge=1, le=1000, description="Количество элементов на странице (от 1 до 1000)"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из поля next_cursor предыдущего ответа"),
+    page: Optional[int] = Query(None, ge=1, deprecated=True, description="Номер страницы без курсора (начиная с 1), оставлен для совместимости; в ответе будут total_count и total_pages"),
     object_name: Optional[str] = Query(None, description="Фильтр по имени объекта"),
     start_date: Optional[datetime] = Query(None, description="Начальная дата измерения (ISO 8601, например '2023-01-01T00:00:00')"),
     end_date: Optional[datetime] = Query(None, description="Конечная дата измерения (ISO 8601, например '2023-12-31T23:59:59')"),
     db: AsyncSession = Depends(get_db)
 ):
-    measurements, total_count = await get_device_measurements_paginated(
-        db=db,
-        page=page,
-        page_size=page_size,
-        object_name=object_name,
-        start_date=start_date,
-        end_date=end_date
-    )
-
-    total_pages = ceil(total_count / page_size) if total_count > 0 else 0
+    try:
+        measurements, next_cursor, total_count = await get_device_measurements_paginated(
+            db=db,
+            page_size=page_size,
+            cursor=cursor,
+            object_name=object_name,
+            start_date=start_date,
+            end_date=end_date,
+            page=page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return PaginatedResponse(
-        items=[CerboMeasurementResponse.model_validate(m) for m in measurements],
-        total_count=total_count,
-        page=page,
-        page_size=page_size,
-        total_pages=total_pages
-    )
+    return _measurements_response(measurements, page_size, next_cursor, page, total_count)
 
 @router.get(
     "/v1/measurements/",
-    response_model=PaginatedResponse[CerboMeasurementResponse], 
+    response_model=CursorPaginatedResponse[CerboMeasurementResponse],
     summary="Получить все измерения CerboMeasurement с пагинацией и фильтрацией по энергетическому обьекту",
     description="Получает список всех измерений с поддержкой пагинации",
     tags=["Measurements"]
 )
 async def read_measurements(
-    page: int = Query(1, ge=1, description="Номер страницы (начиная с 1)"),
     page_size: int = Query(10, ge=1, le=1000, description="Количество элементов на странице (от 1 до 1000)"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из поля next_cursor предыдущего ответа"),
+    page: Optional[int] = Query(None, ge=1, deprecated=True, description="Номер страницы без курсора (начиная с 1), оставлен для совместимости; в ответе будут total_count и total_pages"),
     energetic_object_id: str = Query(..., description="Фильтр по ID объекта"),
     start_date: Optional[datetime] = Query(None, description="Начальная дата измерения (ISO 8601, например '2023-01-01T00:00:00')"),
     end_date: Optional[datetime] = Query(None, description="Конечная дата измерения (ISO 8601, например '2023-12-31T23:59:59')"),
     db: AsyncSession = Depends(get_db)
 ):
-    measurements, total_count = await get_device_measurements_by_object_paginated(
-        db=db,
-        page=page,
-        page_size=page_size,
-        energetic_object_id=energetic_object_id,
-        start_date=start_date,
-        end_date=end_date
-    )
+    try:
+        measurements, next_cursor, total_count = await get_device_measurements_by_object_paginated(
+            db=db,
+            page_size=page_size,
+            cursor=cursor,
+            energetic_object_id=energetic_object_id,
+            start_date=start_date,
+            end_date=end_date,
+            page=page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    total_pages = ceil(total_count / page_size) if total_count > 0 else 0
+    return _measurements_response(measurements, page_size, next_cursor, page, total_count)
 
-    return PaginatedResponse(
-        items=[CerboMeasurementResponse.model_validate(m) for m in measurements],
-        total_count=total_count,
-        page=page,
-        page_size=page_size,
-        total_pages=total_pages
+
+@router.get(
+    "/measurements/export/",
+    summary="Экспорт измерений CerboMeasurement в CSV или Parquet",
+    description="Потоково выгружает измерения за период без пагинации.",
+    tags=["Measurements"]
+)
+async def export_measurements_route(
+    format: str = Query("csv", pattern="^(csv|parquet)$", description="Формат файла: csv или parquet"),
+    object_name: Optional[str] = Query(None, description="Фильтр по имени объекта"),
+    energetic_object_id: Optional[str] = Query(None, description="Фильтр по ID объекта"),
+    start_date: Optional[datetime] = Query(None, description="Начальная дата измерения (ISO 8601)"),
+    end_date: Optional[datetime] = Query(None, description="Конечная дата измерения (ISO 8601)"),
+):
+    query = build_export_query(object_name, energetic_object_id, start_date, end_date)
+    try:
+        content = export_measurements(query, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = f"cerbo_measurements_{datetime.now():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
@@ -821,6 +859,11 @@ async def get_averaged_measurements(
     start_date: datetime = Query(..., description="Начальная дата периода (ISO 8601)"),
     end_date: datetime = Query(..., description="Конечная дата периода (ISO 8601)"),
     intervals: int = Query(60, gt=0, description="Количество интервалов для усреднения"),
+    method: str = Query(
+        "auto",
+        pattern="^(auto|rollup|numpy|python)$",
+        description="Метод расчёта: auto, rollup (агрегаты), numpy (векторный расчёт по сырым данным), python (эталонный расчёт)",
+    ),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -835,7 +878,8 @@ async def get_averaged_measurements(
             object_name=object_name,
             start_date=start_date,
             end_date=end_date,
-            intervals=intervals
+            intervals=intervals,
+            method=method
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -858,10 +902,15 @@ async def get_energy_measurements(
     start_date: datetime = Query(..., description="Начальная дата периода (ISO 8601)"),
     end_date: datetime = Query(..., description="Конечная дата периода (ISO 8601)"),
     interval_minutes: int = Query(30, gt=0, le=60*24*30, description="Длина интервала в минутах (например 30 → 30-минутные интервалы)"),
+    method: str = Query(
+        "auto",
+        pattern="^(auto|rollup|sql|python)$",
+        description="Метод расчёта: auto, rollup (агрегаты), sql (оконные функции по сырым данным), python (эталонный расчёт)",
+    ),
     db: AsyncSession = Depends(get_db)
 ):
     try:
-        data = await get_energy_measurements_service(db, object_name, start_date, end_date, interval_minutes)
+        data = await get_energy_measurements_service(db, object_name, start_date, end_date, interval_minutes, method=method)
         return data
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1059,6 +1108,48 @@ async def websocket_device_endpoint(websocket: WebSocket, session_id: str, db: A
         await websocket_events_manager.disconnect(connection_id)
 
 
+@router.websocket("/ws/telemetry")
+async def websocket_telemetry_endpoint(
+    websocket: WebSocket,
+    object_ids: Optional[str] = None,
+    min_interval: Optional[float] = None,
+):
+    """
+    Живые показания энергетических объектов из Modbus воркера.
+    object_ids — ID объектов через запятую, дальше клиент может присылать
+    {"action": "subscribe" | "unsubscribe", "object_ids": [...]}.
+    Сначала приходит последнее известное состояние объекта, затем только изменившиеся поля,
+    не чаще чем раз в min_interval секунд (но не чаще серверного ограничения).
+    """
+    connection_id = await websocket_events_manager.connect(websocket)
+    interval = max(min_interval or 0, settings.telemetry_ws_min_interval_seconds)
+    subscription = await websocket_events_manager.subscribe_telemetry(connection_id, interval)
+
+    try:
+        if object_ids:
+            await subscription.subscribe(i.strip() for i in object_ids.split(",") if i.strip())
+        await subscription.send({"type": "subscriptions", "object_ids": sorted(subscription.object_ids)})
+
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("action")
+            requested_ids = message.get("object_ids") or []
+            if action == "subscribe":
+                await subscription.subscribe(requested_ids)
+            elif action == "unsubscribe":
+                subscription.unsubscribe(requested_ids)
+            else:
+                await subscription.send({"type": "error", "detail": f"Неизвестное действие: {action}"})
+                continue
+            await subscription.send({"type": "subscriptions", "object_ids": sorted(subscription.object_ids)})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning(f"Telemetry WebSocket {connection_id} error: {e}")
+    finally:
+        await websocket_events_manager.disconnect(connection_id)
+
+
 @router.post(
     "/send_some_message",
     tags=["Websocket Energetic"],
@@ -1,24 +1,23 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, UploadFile, File, status
+from fastapi import APIRouter, Depends, Query, HTTPException, Response, UploadFile, File, status
 from fastapi.responses import StreamingResponse, HTMLResponse
 import os
 import numpy as np
 import pydicom
 import pydicom.config
 from openslide import OpenSlide, OpenSlideUnsupportedFormatError
-from skimage.transform import resize
 from PIL import Image
 from PIL import ImageOps
 from io import BytesIO
-from functools import lru_cache
 from pathlib import Path
-import zipfile
 import shutil
+import uuid
+import asyncio
 from typing import List
-from collections import Counter
-from skimage.transform import resize
-from collections import Counter
 from cor_pass.services.auth import auth_service
 from cor_pass.database.models import User
+from cor_pass.services.dicom_ingest import DicomIngest
+from cor_pass.services.dicom_volume import dicom_decoder
+from cor_pass.services.volume_cache import DicomVolume, volume_cache
 from pydicom import config
 from loguru import logger
 
@@ -59,185 +58,103 @@ def check_dicom_support():
         logger.debug(f"{name} ({uid}): {'✓' if handler else '✗'}")
 
 
-@lru_cache(maxsize=16)
-def load_volume(user_cor_id: str):
-    logger.debug("[INFO] Загружаем том из DICOM-файлов...")
-
-    # Чтение всех файлов
+def load_volume(user_cor_id: str) -> DicomVolume:
+    """
+    Том пользователя (только чтение) и заголовок DICOM-образца без пикселей.
+    Декодируется один раз, дальше отображается из файла, см. volume_cache.
+    """
     user_dicom_dir = os.path.join(DICOM_ROOT_DIR, user_cor_id)
     if not os.path.exists(user_dicom_dir):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="DICOM данные для этого пользователя не найдены.",
         )
+    return volume_cache.get(user_dicom_dir, dicom_decoder.decode)
 
-    dicom_paths = [
-        os.path.join(user_dicom_dir, f)
-        for f in os.listdir(user_dicom_dir)
-        if not f.startswith(".") and os.path.isfile(os.path.join(user_dicom_dir, f))
-    ]
 
-    datasets = []
-    for path in dicom_paths:
-        try:
-            # Пробуем разные методы чтения файла
-            ds = None
-            read_attempts = [
-                lambda: pydicom.dcmread(path),  # Стандартное чтение
-                lambda: pydicom.dcmread(path, force=True),  # Принудительное чтение
-                lambda: pydicom.dcmread(
-                    path, force=True, defer_size=1024
-                ),  # Чтение с ограничением
-            ]
-
-            for attempt in read_attempts:
-                try:
-                    ds = attempt()
-                    break
-                except:
-                    continue
-
-            if ds is None:
-                logger.debug(f"[WARN] Не удалось прочитать файл {path}")
-                continue
-
-            # Попытка декомпрессии если файл сжат
-            if hasattr(ds, "file_meta") and hasattr(ds.file_meta, "TransferSyntaxUID"):
-                if ds.file_meta.TransferSyntaxUID.is_compressed:
-                    try:
-                        ds.decompress()  # Автоматический выбор декомпрессора
-                    except Exception as decompress_error:
-                        print(
-                            f"[WARN] Не удалось декомпрессировать {path}: {decompress_error}"
-                        )
-                        continue
-
-            # Проверка необходимых атрибутов
-            required_attrs = [
-                "ImagePositionPatient",
-                "ImageOrientationPatient",
-                "pixel_array",
-            ]
-            if all(hasattr(ds, attr) for attr in required_attrs):
-                datasets.append((ds, path))
-            else:
-                logger.debug(
-                    f"[WARN] Файл {path} не содержит необходимых DICOM-тегов. Пропущен."
-                )
-                logger.debug(
-                    f"       Найдены теги: {[attr for attr in required_attrs if hasattr(ds, attr)]}"
-                )
+@router.get("/viewer", response_class=HTMLResponse)
+def get_viewer(current_user: User = Depends(auth_service.get_current_user)):
+    return HTMLResponse(HTML_FILE.read_text(encoding="utf-8"))
 
-        except Exception as e:
-            logger.debug(f"[WARN] Пропущен файл {path} из-за ошибки чтения: {str(e)}")
-            continue
 
-    if not datasets:
-        raise RuntimeError("Нет подходящих DICOM-файлов с ImagePositionPatient.")
+# Форматы ответа reconstruct: raw — байты uint8 построчно, размер в заголовках X-Image-Width/Height
+SLICE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "raw": (None, "application/octet-stream"),
+}
+# Больше срезов за один batch-запрос не отдаём
+MAX_BATCH_SLICES = 64
 
-    # Определение нормали к срезу из ориентации
-    orientation = datasets[0][0].ImageOrientationPatient
-    normal = np.cross(orientation[:3], orientation[3:])
 
-    # Сортировка по проекции позиции на нормаль
-    datasets.sort(key=lambda item: np.dot(item[0].ImagePositionPatient, normal))
+def _first_float(value) -> float:
+    return (
+        float(value[0])
+        if isinstance(value, pydicom.multival.MultiValue)
+        else float(value)
+    )
 
-    slices = []
-    shapes = []
-    example_ds = None
 
-    for ds, path in datasets:
-        try:
-            # Получаем pixel_array с обработкой возможных ошибок
-            if not hasattr(ds, "pixel_array"):
-                logger.debug(
-                    f"[WARN] Файл {path} не содержит pixel_array после декомпрессии"
-                )
-                continue
+def window_bounds(ds, window_center: float = None, window_width: float = None):
+    """Границы окна: из параметров запроса или из WindowCenter/WindowWidth заголовка."""
+    wc = window_center if window_center is not None else _first_float(ds.WindowCenter)
+    ww = window_width if window_width is not None else _first_float(ds.WindowWidth)
+    return wc - ww / 2, wc + ww / 2
 
-            arr = ds.pixel_array.astype(np.float32)
-
-            # Применяем Rescale Slope/Intercept если они есть
-            if hasattr(ds, "RescaleSlope") and hasattr(ds, "RescaleIntercept"):
-                try:
-                    slope = (
-                        float(ds.RescaleSlope)
-                        if isinstance(
-                            ds.RescaleSlope, (str, pydicom.multival.MultiValue)
-                        )
-                        else ds.RescaleSlope
-                    )
-                    intercept = (
-                        float(ds.RescaleIntercept)
-                        if isinstance(
-                            ds.RescaleIntercept, (str, pydicom.multival.MultiValue)
-                        )
-                        else ds.RescaleIntercept
-                    )
-                    arr = arr * slope + intercept
-                except Exception as e:
-                    print(
-                        f"[WARN] Ошибка применения RescaleSlope/Intercept в {path}: {e}"
-                    )
-
-            slices.append(arr)
-            shapes.append(arr.shape)
-
-            if example_ds is None:
-                example_ds = ds
 
+def apply_window(dicom: DicomVolume, img, mode: str, window_center: float = None, window_width: float = None):
+    """Срез тома -> uint8 по режиму окна reconstruct."""
+    if mode == "auto":
+        try:
+            low, high = window_bounds(dicom.ds)
         except Exception as e:
-            logger.debug(f"[ERROR] Ошибка обработки {os.path.basename(path)}: {e}")
-            continue
-
-    if not slices:
-        raise RuntimeError("Не удалось загрузить ни одного среза.")
-
-    # Приведение всех к одной форме
-    shape_counter = Counter(shapes)
-    target_shape = shape_counter.most_common(1)[0][0]
-    logger.debug(f"[INFO] Приведение всех срезов к форме {target_shape}")
-
-    resized_slices = [
-        (
-            resize(slice_, target_shape, preserve_range=True).astype(np.float32)
-            if slice_.shape != target_shape
-            else slice_
-        )
-        for slice_ in slices
-    ]
-
-    volume = np.stack(resized_slices)
-    logger.debug(f"[INFO] Загружено срезов: {len(volume)}")
-
-    return volume, example_ds
-
-
-@router.get("/viewer", response_class=HTMLResponse)
-def get_viewer(current_user: User = Depends(auth_service.get_current_user)):
-    return HTMLResponse(HTML_FILE.read_text(encoding="utf-8"))
-
+            logger.debug(f"[WARN] Ошибка применения Window Center/Width: {e}")
+            return dicom.values(img).astype(np.uint8)
+        return dicom.window(img, low, high)
+    if mode == "window":
+        try:
+            low, high = window_bounds(dicom.ds, window_center, window_width)
+            return dicom.window(img, low, high)
+        except Exception as e:
+            logger.warning(f"Window level error, fallback to raw: {e}")
+    return dicom.window_full_range(img)
+
+
+def plane_depth(volume, plane: str) -> int:
+    axes = {"axial": 0, "coronal": 1, "sagittal": 2}
+    if plane not in axes:
+        raise HTTPException(status_code=400, detail="Invalid plane")
+    return volume.shape[axes[plane]]
+
+
+def plane_slice(volume, plane: str, index: int):
+    index = int(np.clip(index, 0, plane_depth(volume, plane) - 1))
+    if plane == "axial":
+        return volume[index, :, :]
+    if plane == "sagittal":
+        return np.flip(volume[:, :, index], axis=(0, 1))
+    return np.flip(volume[:, index, :], axis=0)
+
+
+def render_slice(img, image_format: str):
+    """Срез uint8 на канве 512x512 -> (байты, тип содержимого, ширина, высота)."""
+    # Преобразуем в изображение и добавляем паддинг (512x512 канва)
+    img_pil = Image.fromarray(np.ascontiguousarray(img)).convert("L")
+    img_pil = ImageOps.pad(
+        img_pil,
+        (512, 512),
+        method=Image.Resampling.BICUBIC,
+        color=0,
+        centering=(0.5, 0.5),
+    )
 
-def apply_window(img, ds):
-    try:
-        wc = (
-            float(ds.WindowCenter[0])
-            if isinstance(ds.WindowCenter, pydicom.multival.MultiValue)
-            else float(ds.WindowCenter)
-        )
-        ww = (
-            float(ds.WindowWidth[0])
-            if isinstance(ds.WindowWidth, pydicom.multival.MultiValue)
-            else float(ds.WindowWidth)
-        )
-        img_min = wc - ww / 2
-        img_max = wc + ww / 2
-        img = np.clip(img, img_min, img_max)
-        img = ((img - img_min) / (img_max - img_min + 1e-5)) * 255
-        return img.astype(np.uint8)
-    except Exception as e:
-        logger.debug(f"[WARN] Ошибка применения Window Center/Width: {e}")
-        return img.astype(np.uint8)
+    pil_format, media_type = SLICE_FORMATS[image_format]
+    if pil_format is None:
+        return img_pil.tobytes(), media_type, img_pil.width, img_pil.height
+    buf = BytesIO()
+    img_pil.save(buf, format=pil_format)
+    return buf.getvalue(), media_type, img_pil.width, img_pil.height
 
 
 @router.get("/reconstruct/{plane}")
@@ -248,80 +165,20 @@ def reconstruct(
     mode: str = Query("auto", enum=["auto", "window", "raw"]),
     window_center: float = Query(None),
     window_width: float = Query(None),
+    format: str = Query("png", pattern="^(png|jpeg|webp|raw)$", description="Slice image format, raw is uint8 bytes"),
     current_user: User = Depends(auth_service.get_current_user),
 ):
     try:
-        volume, ds = load_volume(str(current_user.cor_id))
-
-        # Получаем spacing
-        ps = ds.PixelSpacing if hasattr(ds, "PixelSpacing") else [1, 1]
-        st = float(ds.SliceThickness) if hasattr(ds, "SliceThickness") else 1.0
-
-        if plane == "axial":
-            img = volume[np.clip(index, 0, volume.shape[0] - 1), :, :]
-            spacing_x, spacing_y = ps
-        elif plane == "sagittal":
-            img = np.flip(
-                volume[:, :, np.clip(index, 0, volume.shape[2] - 1)], axis=(0, 1)
-            )
-            spacing_x, spacing_y = st, ps[0]
-        elif plane == "coronal":
-            img = np.flip(volume[:, np.clip(index, 0, volume.shape[1] - 1), :], axis=0)
-            spacing_x, spacing_y = st, ps[1]
-        else:
-            raise HTTPException(status_code=400, detail="Invalid plane")
+        dicom = load_volume(str(current_user.cor_id))
+        img = plane_slice(dicom.volume, plane, index)
+        img = apply_window(dicom, img, mode, window_center, window_width)
 
-        # Windowing
-        if mode == "auto":
-            img = apply_window(img, ds)
-        elif mode == "window":
-            try:
-                wc = (
-                    window_center
-                    if window_center is not None
-                    else (
-                        float(ds.WindowCenter[0])
-                        if isinstance(ds.WindowCenter, pydicom.multival.MultiValue)
-                        else float(ds.WindowCenter)
-                    )
-                )
-                ww = (
-                    window_width
-                    if window_width is not None
-                    else (
-                        float(ds.WindowWidth[0])
-                        if isinstance(ds.WindowWidth, pydicom.multival.MultiValue)
-                        else float(ds.WindowWidth)
-                    )
-                )
-                img_min = wc - ww / 2
-                img_max = wc + ww / 2
-                img = np.clip(img, img_min, img_max)
-                img = ((img - img_min) / (img_max - img_min + 1e-5)) * 255
-                img = img.astype(np.uint8)
-            except Exception as e:
-                print(f"Window level error, fallback to raw: {e}")
-                img = ((img - img.min()) / (img.max() - img.min() + 1e-5)) * 255
-                img = img.astype(np.uint8)
-        elif mode == "raw":
-            img = ((img - img.min()) / (img.max() - img.min() + 1e-5)) * 255
-            img = img.astype(np.uint8)
-
-        # Преобразуем в изображение и добавляем паддинг (512x512 канва)
-        img_pil = Image.fromarray(img).convert("L")
-        img_pil = ImageOps.pad(
-            img_pil,
-            (512, 512),
-            method=Image.Resampling.BICUBIC,
-            color=0,
-            centering=(0.5, 0.5),
-        )
-
-        buf = BytesIO()
-        img_pil.save(buf, format="PNG")
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/png")
+        data, media_type, width, height = render_slice(img, format)
+        headers = {"X-Image-Width": str(width), "X-Image-Height": str(height)}
+        return Response(content=data, media_type=media_type, headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
 
@@ -329,6 +186,49 @@ def reconstruct(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/reconstruct/{plane}/batch")
+def reconstruct_batch(
+    plane: str,
+    start: int = Query(0, ge=0),
+    count: int = Query(16, ge=1, le=MAX_BATCH_SLICES),
+    step: int = Query(1, ge=1),
+    mode: str = Query("auto", enum=["auto", "window", "raw"]),
+    window_center: float = Query(None),
+    window_width: float = Query(None),
+    format: str = Query("jpeg", pattern="^(png|jpeg|webp|raw)$", description="Slice image format, raw is uint8 bytes"),
+    current_user: User = Depends(auth_service.get_current_user),
+):
+    """
+    Срезы start, start + step, ... (не больше count) одним ответом multipart/mixed.
+    Каждая часть отправляется сразу после рендера; номер среза — в заголовке части X-Slice-Index.
+    """
+    try:
+        dicom = load_volume(str(current_user.cor_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    depth = plane_depth(dicom.volume, plane)
+    indexes = range(min(start, depth - 1), depth, step)[:count]
+    boundary = uuid.uuid4().hex
+
+    def parts():
+        for index in indexes:
+            img = apply_window(dicom, plane_slice(dicom.volume, plane, index), mode, window_center, window_width)
+            data, media_type, width, height = render_slice(img, format)
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"X-Slice-Index: {index}\r\n"
+                f"X-Image-Width: {width}\r\n"
+                f"X-Image-Height: {height}\r\n\r\n"
+            ).encode() + data + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}")
+
+
 @router.post("/upload")
 async def upload_dicom_files(
     files: List[UploadFile] = File(...),
@@ -340,6 +240,7 @@ async def upload_dicom_files(
         user_slide_dir = os.path.join(user_dir, "slides")
 
         # --- безопасное удаление старых данных ---
+        volume_cache.invalidate(user_dicom_dir)
         shutil.rmtree(user_dicom_dir, ignore_errors=True)  # не падает, если нет папки
 
         # --- создание директорий ---
@@ -347,53 +248,15 @@ async def upload_dicom_files(
         os.makedirs(user_slide_dir, exist_ok=True)
 
         processed_files = 0
-        valid_dicom = 0
         valid_svs = 0
 
+        # файлы пишутся на диск потоком и проверяются в пуле, пока пишутся следующие
+        ingest = DicomIngest(user_dicom_dir)
         for file in files:
-            file_ext = os.path.splitext(file.filename)[1].lower()
-
-            temp_path = os.path.join(user_dicom_dir, file.filename)
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
+            await asyncio.to_thread(ingest.add_file, file.filename, file.file)
             processed_files += 1
 
-            if file_ext == ".svs":
-                continue
-
-            if file_ext == ".zip":
-                try:
-                    with zipfile.ZipFile(temp_path, "r") as zip_ref:
-                        for member in zip_ref.namelist():
-                            member_path = os.path.join(user_dicom_dir, member)
-                            if not member_path.startswith(user_dicom_dir):
-                                raise ValueError("Zip Slip атака предотвращена!")
-                            zip_ref.extract(member, user_dicom_dir)
-                    os.remove(temp_path)
-                except Exception as e:
-                    print(f"[ERROR] Ошибка распаковки {file.filename}: {e}")
-                    os.remove(temp_path)
-                    continue
-
-        if not os.path.exists(user_dicom_dir):
-            raise HTTPException(status_code=404, detail="User DICOM directory not found")
-
-        dicom_paths = [
-            os.path.join(user_dicom_dir, f)
-            for f in os.listdir(user_dicom_dir)
-            if not f.startswith(".")
-            and os.path.isfile(os.path.join(user_dicom_dir, f))
-            and f.lower().endswith((".dcm", ""))
-            and not f.lower().endswith(".svs")
-        ]
-
-        for file_path in dicom_paths:
-            try:
-                pydicom.dcmread(file_path, stop_before_pixels=True)
-                valid_dicom += 1
-            except:
-                os.remove(file_path)
+        valid_dicom = await ingest.finish()
 
         if valid_dicom == 0 and valid_svs == 0:
             shutil.rmtree(user_dicom_dir, ignore_errors=True)
@@ -401,8 +264,6 @@ async def upload_dicom_files(
                 status_code=400, detail="No valid DICOM or SVS files found."
             )
 
-        load_volume.cache_clear()
-
         if valid_svs > 0 and valid_dicom == 0:
             message = f"Загружен файл SVS ({valid_svs} шт.)"
         elif valid_dicom > 0 and valid_svs == 0:
@@ -424,7 +285,7 @@ async def upload_dicom_files(
 def get_volume_info(current_user: User = Depends(auth_service.get_current_user)):
     try:
         print(f"Loading volume for user cor_id: {current_user.cor_id}")  # Логирование
-        volume, ds = load_volume(str(current_user.cor_id))
+        volume = load_volume(str(current_user.cor_id)).volume
         print(f"Volume shape: {volume.shape}")  # Логирование
         return {
             "slices": volume.shape[0],
@@ -439,7 +300,8 @@ def get_volume_info(current_user: User = Depends(auth_service.get_current_user))
 @router.get("/metadata")
 def get_metadata(current_user: User = Depends(auth_service.get_current_user)):
     try:
-        volume, ds = load_volume(str(current_user.cor_id))
+        dicom = load_volume(str(current_user.cor_id))
+        volume, ds = dicom.volume, dicom.ds
         depth, height, width = volume.shape
 
         spacing = ds.PixelSpacing if hasattr(ds, "PixelSpacing") else [1.0, 1.0]
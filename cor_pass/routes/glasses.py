@@ -1,9 +1,11 @@
 import asyncio
 from datetime import datetime
+from functools import lru_cache
 from io import BytesIO
 import os
 import tempfile
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
+import uuid
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.responses import StreamingResponse
 from openslide import OpenSlide
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -19,9 +21,10 @@ from cor_pass.schemas import (
     UploadGlassSVSResponse
 )
 from cor_pass.repository import glass as glass_service
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from cor_pass.services.access import doctor_access
+from cor_pass.services.preview_cache import preview_cache
 from loguru import logger
 from cor_pass.config.config import settings
 from scan_worker.smbprotocol_worker import save_file_to_smb, save_file_to_smb_manual
@@ -115,49 +118,123 @@ async def change_glass_printing_status(
 
 # Путь к заглушному PNG-файлу
 PLACEHOLDER_PATH = "cor_pass/static/assets/dummy_glass.png"
+# Сколько стёкол можно запросить в /previews/batch за раз
+MAX_BATCH_PREVIEWS = 200
+# Превью может смениться при повторной загрузке скана, поэтому не immutable: после max-age — проверка по ETag
+PREVIEW_CACHE_CONTROL = f"private, max-age={settings.glass_preview_max_age_seconds}"
+# Заглушку клиент не кэширует: настоящее превью может появиться в любой момент
+PLACEHOLDER_CACHE_CONTROL = "no-cache"
+
+
+@lru_cache(maxsize=1)
+def placeholder_png() -> bytes:
+    try:
+        with open(PLACEHOLDER_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.error(f"Заглушный файл {PLACEHOLDER_PATH} не найден")
+        raise HTTPException(status_code=500, detail="Placeholder PNG not found")
+
+
+async def _fetch_preview_png(preview_url: str) -> bytes:
+    buf = await glass_service.fetch_png_from_smb(preview_url)
+    return buf.getvalue()
+
+
+async def load_glass_preview(glass_id: str, preview_url: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """PNG-превью стекла и его ETag; при ошибке или без SMB — заглушка без ETag."""
+    if not settings.smb_enabled:
+        logger.debug(f"SMB отключён, возвращаем заглушный PNG для стекла {glass_id}")
+        return placeholder_png(), None
+    if not preview_url:
+        logger.debug(f"preview_url не задан для стекла {glass_id}, возвращаем заглушный PNG")
+        return placeholder_png(), None
+    try:
+        cached = await preview_cache.load(preview_url, _fetch_preview_png)
+        return cached.data, cached.etag
+    except Exception as e:
+        logger.error(f"Ошибка при получении превью для стекла {glass_id}: {str(e)}")
+        return placeholder_png(), None
+
+
+@router.get(
+    "/previews/batch",
+    dependencies=[Depends(doctor_access)],
+)
+async def get_glass_previews_batch(
+    glass_ids: List[str] = Query(..., description="Glass IDs, repeated parameter"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    PNG-превью нескольких стёкол одним ответом multipart/mixed.
+    Части отправляются по мере готовности, а не в порядке запроса: ID стекла — в заголовке части X-Glass-Id,
+    ETag — как у /{glass_id}/preview. Стёкла, которых нет в базе, перечислены в заголовке X-Glass-Not-Found.
+    """
+    glass_ids = list(dict.fromkeys(glass_ids))
+    if len(glass_ids) > MAX_BATCH_PREVIEWS:
+        raise HTTPException(status_code=400, detail=f"No more than {MAX_BATCH_PREVIEWS} glasses per request")
+    preview_urls = await glass_service.get_glass_preview_urls(db=db, glass_ids=glass_ids)
+    not_found = [glass_id for glass_id in glass_ids if glass_id not in preview_urls]
+    boundary = uuid.uuid4().hex
+    # промахи кэша не должны занять все сессии smb_pool одним запросом
+    fetch_limit = asyncio.Semaphore(settings.smb_pool_max_connections)
+
+    async def load_part(glass_id: str, preview_url: Optional[str]):
+        async with fetch_limit:
+            data, etag = await load_glass_preview(glass_id, preview_url)
+        return glass_id, data, etag
+
+    async def parts():
+        loads = [asyncio.ensure_future(load_part(glass_id, url)) for glass_id, url in preview_urls.items()]
+        try:
+            for load in asyncio.as_completed(loads):
+                glass_id, data, etag = await load
+                etag_header = f"ETag: {etag}\r\n" if etag else ""
+                yield (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: image/png\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"X-Glass-Id: {glass_id}\r\n"
+                    f"{etag_header}\r\n"
+                ).encode() + data + b"\r\n"
+            yield f"--{boundary}--\r\n".encode()
+        finally:
+            # клиент отключился — незавершённые загрузки не нужны
+            for load in loads:
+                load.cancel()
+
+    headers = {"X-Glass-Not-Found": ",".join(not_found)} if not_found else None
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
+
 
 @router.get(
     "/{glass_id}/preview",
     dependencies=[Depends(doctor_access)],
 )
-async def get_glass_preview(glass_id: str, db: AsyncSession = Depends(get_db)):
+async def get_glass_preview(
+    glass_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
     """
     Получает PNG-превью для стекла по его ID. Возвращает заглушный PNG при ошибке.
+    Превью берётся из preview_cache, с SMB загружается только при промахе;
+    при совпадении If-None-Match с ETag отдаётся 304.
     """
-    db_glass = await glass_service.get_glass_preview_png(db=db, glass_id=glass_id)
-    if db_glass is None:
-        logger.error(f"Стекло или preview_url не найдены для ID {glass_id}")
+    preview_urls = await glass_service.get_glass_preview_urls(db=db, glass_ids=[glass_id])
+    if glass_id not in preview_urls:
+        logger.error(f"Стекло не найдено для ID {glass_id}")
         raise HTTPException(status_code=404, detail="Glass or preview URL not found")
-    
-    if not settings.smb_enabled:
-        logger.debug(f"SMB отключён, возвращаем заглушный PNG для стекла {glass_id}")
-        try:
-            with open(PLACEHOLDER_PATH, "rb") as f:
-                placeholder_buf = BytesIO(f.read())
-                placeholder_buf.seek(0)
-                return StreamingResponse(placeholder_buf, media_type="image/png")
-        except FileNotFoundError:
-            logger.error(f"Заглушный файл {PLACEHOLDER_PATH} не найден")
-            raise HTTPException(status_code=500, detail="Placeholder PNG not found")
 
-    try:
-        buf = await glass_service.fetch_png_from_smb(db_glass.preview_url)
-        buf.seek(0)
-        logger.debug(f"Успешно возвращено превью для стекла {glass_id}")
-        return StreamingResponse(buf, media_type="image/png")
-    except asyncio.TimeoutError as e:
-        logger.error(f"Таймаут при получении превью для стекла {glass_id}: {str(e)}")
-        with open(PLACEHOLDER_PATH, "rb") as f:
-            placeholder_buf = BytesIO(f.read())
-            placeholder_buf.seek(0)
-            return StreamingResponse(placeholder_buf, media_type="image/png")
-    except Exception as e:
-        logger.error(f"Ошибка при получении превью для стекла {glass_id}: {str(e)}")
-        with open(PLACEHOLDER_PATH, "rb") as f:
-            placeholder_buf = BytesIO(f.read())
-            placeholder_buf.seek(0)
-            return StreamingResponse(placeholder_buf, media_type="image/png")
-        
+    data, etag = await load_glass_preview(glass_id, preview_urls[glass_id])
+    if etag is None:
+        return Response(content=data, media_type="image/png", headers={"Cache-Control": PLACEHOLDER_CACHE_CONTROL})
+
+    headers = {"ETag": etag, "Cache-Control": PREVIEW_CACHE_CONTROL}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    logger.debug(f"Успешно возвращено превью для стекла {glass_id}")
+    return Response(content=data, media_type="image/png", headers=headers)
 
 
 @router.post("/upload-glass/{glass_id}",
@@ -198,6 +275,8 @@ async def upload_glass_file(
 
         preview_path = smb_full_path.replace(".svs", ".png")
         await save_file_to_smb_manual(buf, preview_path)
+        # файл с тем же именем мог уже быть загружен и лежать в кэше
+        await asyncio.to_thread(preview_cache.invalidate, preview_path)
 
         glass = await db.get(Glass, glass_id)
         if not glass:
@@ -1,94 +1,96 @@
+import asyncio
 import errno
 import re
-from fastapi import APIRouter, Depends, Query, HTTPException
+from typing import Optional, Tuple
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 import os
 import logging
 from openslide import OpenSlide
 from io import BytesIO
-from cor_pass.repository.glass import fetch_file_from_smb, get_glass_svs
-from cor_pass.routes.dicom_router import load_volume
+from cor_pass.repository.glass import get_glass_svs
 from cor_pass.services.auth import auth_service
 from cor_pass.database.models import User
 from PIL import Image
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 from cor_pass.database.db import get_db
-import shutil
+from cor_pass.config.config import settings
 from openslide import OpenSlide, OpenSlideUnsupportedFormatError
 
-from cor_pass.services.safe_delete_smb import DICOM_DIR, safe_delete_dir
+from cor_pass.services.slide_cache import slide_cache
+from cor_pass.services.slide_range import ensure_whole_level
+from cor_pass.services.slide_store import slide_store
+from cor_pass.services.tile_renderer import ClientDisconnected, tile_renderer
+from cor_pass.services.tile_cache import TILE_CACHE_CONTROL, TILE_FORMATS, TileKey, tile_cache
 
 router = APIRouter(prefix="/svs", tags=["SVS"])
 
 # SVS_ROOT_DIR = "svs_users_data"
 # os.makedirs(SVS_ROOT_DIR, exist_ok=True)
-DICOM_ROOT_DIR = "dicom_users_data"
+DICOM_ROOT_DIR = settings.svs_user_slides_root
 
 
 @router.get("/svs_metadata")
 def get_svs_metadata(current_user: User = Depends(auth_service.get_current_user)):
     user_slide_dir = os.path.join(DICOM_ROOT_DIR, str(current_user.cor_id), "slides")
-    svs_files = [f for f in os.listdir(user_slide_dir) if f.lower().endswith(".svs")]
-
-    if not svs_files:
-        raise HTTPException(status_code=404, detail="No SVS files found.")
-
-    svs_path = os.path.join(user_slide_dir, svs_files[0])
+    svs_path = slide_cache.resolve_user_slide(user_slide_dir, str(current_user.cor_id))
 
     try:
-        slide = OpenSlide(svs_path)
-
-        tile_size = 256  # размер тайла, подставь свой, если другой
-
-        # Основные метаданные
-        metadata = {
-            "filename": svs_files[0],
-            "dimensions": {
-                "width": slide.dimensions[0],
-                "height": slide.dimensions[1],
-                "levels": slide.level_count,
-            },
-            "basic_info": {
-                "mpp": float(slide.properties.get("aperio.MPP", 0)),
-                "magnification": slide.properties.get("aperio.AppMag", "N/A"),
-                "scan_date": slide.properties.get("aperio.Time", "N/A"),
-                "scanner": slide.properties.get("aperio.User", "N/A"),
-                "vendor": slide.properties.get("openslide.vendor", "N/A"),
-            },
-            "levels": [],
-            "full_properties": {},
-        }
-
-        # Информация о уровнях + количество тайлов на уровне
-        for level in range(slide.level_count):
-            width, height = slide.level_dimensions[level]
-            tiles_x = (width + tile_size - 1) // tile_size
-            tiles_y = (height + tile_size - 1) // tile_size
-
-            metadata["levels"].append(
-                {
-                    "downsample": float(
-                        slide.properties.get(f"openslide.level[{level}].downsample", 0)
-                    ),
-                    # Размеры берём из slide.level_dimensions, а не из свойств, т.к. они надежнее
-                    "width": width,
-                    "height": height,
-                    "tiles_x": tiles_x,
-                    "tiles_y": tiles_y,
-                    "total_tiles": tiles_x * tiles_y,
-                }
-            )
-
-        # Все свойства для детального просмотра
-        metadata["full_properties"] = dict(slide.properties)
-
-        return metadata
-
+        with slide_cache.open(svs_path) as slide:
+            return _slide_metadata(slide, os.path.basename(svs_path))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _slide_metadata(slide: OpenSlide, filename: str) -> dict:
+    tile_size = 256  # размер тайла, подставь свой, если другой
+
+    # Основные метаданные
+    metadata = {
+        "filename": filename,
+        "dimensions": {
+            "width": slide.dimensions[0],
+            "height": slide.dimensions[1],
+            "levels": slide.level_count,
+        },
+        "basic_info": {
+            "mpp": float(slide.properties.get("aperio.MPP", 0)),
+            "magnification": slide.properties.get("aperio.AppMag", "N/A"),
+            "scan_date": slide.properties.get("aperio.Time", "N/A"),
+            "scanner": slide.properties.get("aperio.User", "N/A"),
+            "vendor": slide.properties.get("openslide.vendor", "N/A"),
+        },
+        "levels": [],
+        "full_properties": {},
+    }
+
+    # Информация о уровнях + количество тайлов на уровне
+    for level in range(slide.level_count):
+        width, height = slide.level_dimensions[level]
+        tiles_x = (width + tile_size - 1) // tile_size
+        tiles_y = (height + tile_size - 1) // tile_size
+
+        metadata["levels"].append(
+            {
+                "downsample": float(
+                    slide.properties.get(f"openslide.level[{level}].downsample", 0)
+                ),
+                # Размеры берём из slide.level_dimensions, а не из свойств, т.к. они надежнее
+                "width": width,
+                "height": height,
+                "tiles_x": tiles_x,
+                "tiles_y": tiles_y,
+                "total_tiles": tiles_x * tiles_y,
+            }
+        )
+
+    # Все свойства для детального просмотра
+    metadata["full_properties"] = dict(slide.properties)
+
+    return metadata
+
+
 @router.get("/preview_svs")
 def preview_svs(
     full: bool = Query(False),
@@ -96,33 +98,11 @@ def preview_svs(
     current_user: User = Depends(auth_service.get_current_user),
 ):
     user_slide_dir = os.path.join(DICOM_ROOT_DIR, str(current_user.cor_id), "slides")
-    svs_files = [f for f in os.listdir(user_slide_dir) if f.lower().endswith(".svs")]
-
-    if not svs_files:
-        raise HTTPException(status_code=404, detail="No SVS found.")
-
-    svs_path = os.path.join(user_slide_dir, svs_files[0])
+    svs_path = slide_cache.resolve_user_slide(user_slide_dir, str(current_user.cor_id))
 
     try:
-        slide = OpenSlide(svs_path)
-
-        if full:
-            # Полное изображение в выбранном разрешении
-            level = min(
-                level, slide.level_count - 1
-            )  # Проверяем, чтобы уровень был допустимым
-            size = slide.level_dimensions[level]
-
-            # Читаем регион целиком
-            img = slide.read_region((0, 0), level, size)
-
-            # Конвертируем в RGB, если нужно
-            if img.mode == "RGBA":
-                img = img.convert("RGB")
-        else:
-            # Миниатюра
-            size = (300, 300)
-            img = slide.get_thumbnail(size)
+        with slide_cache.open(svs_path) as slide:
+            img = _preview_image(slide, svs_path, full, level)
 
         buf = BytesIO()
         img.save(buf, format="PNG")
@@ -132,63 +112,98 @@ def preview_svs(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _preview_image(slide: OpenSlide, svs_path: str, full: bool, level: int) -> Image.Image:
+    if full:
+        # Полное изображение в выбранном разрешении
+        level = min(
+            level, slide.level_count - 1
+        )  # Проверяем, чтобы уровень был допустимым
+        size = slide.level_dimensions[level]
+        ensure_whole_level(svs_path, level)
+
+        # Читаем регион целиком
+        img = slide.read_region((0, 0), level, size)
+
+        # Конвертируем в RGB, если нужно
+        if img.mode == "RGBA":
+            img = img.convert("RGB")
+    else:
+        # Миниатюра
+        size = (300, 300)
+        # get_thumbnail читает уровень, подходящий под это уменьшение
+        downsample = max(dim / thumb for dim, thumb in zip(slide.dimensions, size))
+        ensure_whole_level(svs_path, slide.get_best_level_for_downsample(downsample))
+        img = slide.get_thumbnail(size)
+    return img
+
+
+def _lookup_tile(
+    user_slide_dir: str,
+    user_id: str,
+    level: int,
+    x: int,
+    y: int,
+    tile_size: int,
+    tile_format: str,
+    if_none_match: Optional[str],
+) -> Tuple[str, TileKey, bool, Optional[bytes]]:
+    """
+    Файловая часть запроса тайла: путь к слайду, его отпечаток и чтение кэша.
+    Выполняется в потоке, чтобы stat и чтение с диска не держали event loop.
+    Возвращает путь к слайду, ключ тайла, признак совпадения If-None-Match и тайл из кэша.
+    """
+    svs_path = slide_cache.resolve_user_slide(user_slide_dir, user_id)
+    slide_cache.touch_user_slide(user_id)
+    key = (tile_cache.slide_hash(svs_path), level, x, y, tile_size, tile_format)
+    if if_none_match and tile_cache.etag(key) in [tag.strip() for tag in if_none_match.split(",")]:
+        return svs_path, key, True, None
+    return svs_path, key, False, tile_cache.get(key)
+
+
 @router.get("/tile")
-def get_tile(
+async def get_tile(
+    request: Request,
     level: int = Query(..., description="Zoom level"),
     x: int = Query(..., description="Tile X index"),
     y: int = Query(..., description="Tile Y index"),
     tile_size: int = Query(256, description="Tile size in pixels"),
+    format: str = Query("jpeg", pattern="^(jpeg|png|webp)$", description="Tile image format"),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(auth_service.get_current_user),
 ):
+    """
+    Тайл слайда. Готовые тайлы берутся из кэша (память, затем диск) без обращения к OpenSlide.
+    На диске они могут лежать заранее, если пирамиду сгенерировал scan_worker.
+    ETag строится из отпечатка слайда и координат тайла, поэтому 304 отдаётся без чтения кэша.
+    Недостающие тайлы рендерит tile_renderer в отдельном пуле, а не пул потоков Starlette.
+    Поиск слайда и чтение/запись кэша идут через asyncio.to_thread.
+    """
     try:
         user_slide_dir = os.path.join(
             DICOM_ROOT_DIR, str(current_user.cor_id), "slides"
         )
-        svs_files = [
-            f for f in os.listdir(user_slide_dir) if f.lower().endswith(".svs")
-        ]
-
-        if not svs_files:
-            logger.warning(f"[NO SVS] User {current_user.cor_id} has no SVS files")
-            raise HTTPException(status_code=404, detail="No SVS files found.")
-
-        svs_path = os.path.join(user_slide_dir, svs_files[0])
-        slide = OpenSlide(svs_path)
-
-        if level < 0 or level >= slide.level_count:
-            logger.warning(
-                f"[INVALID LEVEL] level={level}, max={slide.level_count - 1}"
-            )
-            return empty_tile()
-
-        level_width, level_height = slide.level_dimensions[level]
-        tiles_x = (level_width + tile_size - 1) // tile_size
-        tiles_y = (level_height + tile_size - 1) // tile_size
-
-        if x < 0 or x >= tiles_x or y < 0 or y >= tiles_y:
-            logger.warning(
-                f"[OUT OF BOUNDS] level={level}, x={x}, y={y}, tiles_x={tiles_x}, tiles_y={tiles_y}"
-            )
-            return empty_tile()
-
-        # Пересчёт координат тайла из текущего уровня в координаты уровня 0
-        scale = slide.level_downsamples[level]
-        location = (int(x * tile_size * scale), int(y * tile_size * scale))
-
-        # Фактический размер региона (в пикселях уровня level)
-        region_width = min(tile_size, level_width - x * tile_size)
-        region_height = min(tile_size, level_height - y * tile_size)
-
-        region = slide.read_region(
-            location, level, (region_width, region_height)
-        ).convert("RGB")
-        region = region.resize((tile_size, tile_size), Image.LANCZOS)
+        svs_path, key, not_modified, data = await asyncio.to_thread(
+            _lookup_tile, user_slide_dir, str(current_user.cor_id), level, x, y, tile_size, format, if_none_match
+        )
+        media_type = TILE_FORMATS[format][1]
+        headers = {"ETag": tile_cache.etag(key), "Cache-Control": TILE_CACHE_CONTROL}
+        if not_modified:
+            return Response(status_code=304, headers=headers)
 
-        buf = BytesIO()
-        region.save(buf, format="JPEG")
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/jpeg")
+        if data is None:
+            data = await tile_renderer.render(key, svs_path, request)
+            if data is None:
+                return empty_tile()
+            await asyncio.to_thread(tile_cache.put, key, data)
 
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    except HTTPException:
+        logger.warning(f"[NO SVS] User {current_user.cor_id} has no SVS files")
+        return empty_tile()
+    except ClientDisconnected:
+        # ответ уже некому отдавать
+        return Response(status_code=499)
     except Exception as e:
         import traceback
 
@@ -224,65 +239,50 @@ async def upload_svs_from_storage(
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Обрабатывает SVS-файл из хранилища по glass_id, сохраняет его в user_slide_dir.
-    Старые SVS-файлы удаляются перед перемещением нового.
+    Открывает SVS-файл из хранилища по glass_id для пользователя.
+    Слайд берётся из общего кэша slide_store (загружается с SMB только при промахе),
+    в user_slide_dir кладётся симлинк на него вместо прежнего SVS.
     """
-    safe_delete_dir(DICOM_DIR)
     try:
         db_glass = await get_glass_svs(db=db, glass_id=glass_id)
         if db_glass is None:
             logger.error(f"Стекло или scan_url не найдены для ID {glass_id}")
             raise HTTPException(status_code=404, detail="Glass or scan URL not found")
 
-        user_dir = os.path.join(DICOM_ROOT_DIR, str(current_user.cor_id))
-        user_dicom_dir = user_dir
-        user_slide_dir = os.path.join(user_dir, "slides")
-
-        os.makedirs(user_dicom_dir, exist_ok=True)
-        os.makedirs(user_slide_dir, exist_ok=True)
-        logger.debug(f"Созданы директории: {user_dicom_dir}, {user_slide_dir}")
-
-
-        for f in os.listdir(user_slide_dir):
-            f_path = os.path.join(user_slide_dir, f)
-            if os.path.isfile(f_path) and f.lower().endswith(".svs"):
-                try:
-                    os.remove(f_path)
-                    logger.debug(f"Удалён старый SVS-файл: {f_path}")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить файл {f_path}: {e}")
-
-        filename = os.path.basename(db_glass.scan_url)
+        filename = os.path.basename(db_glass.scan_url.replace("\\", "/"))
         file_ext = os.path.splitext(filename)[1].lower()
         if file_ext != ".svs":
             logger.error(f"Файл {filename} не является SVS-файлом")
             raise HTTPException(status_code=400, detail="File is not an SVS file")
 
-
-        temp_path = await fetch_file_from_smb(db_glass.scan_url)
-        logger.debug(f"SVS-файл загружен во временный файл: {temp_path}")
-
         try:
-            OpenSlide(temp_path)
-            target_path = os.path.join(user_slide_dir, filename)
-            shutil.move(temp_path, target_path)
-            logger.info(f"SVS-файл перемещён в: {target_path}")
+            cached_path = await slide_store.get_slide(db_glass.scan_url)
         except OpenSlideUnsupportedFormatError:
             logger.error(f"Файл {filename} не является допустимым SVS-форматом")
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
             raise HTTPException(status_code=400, detail=f"File {filename} is not a valid SVS format")
         except Exception as e:
             logger.error(f"Ошибка при обработке файла {filename}: {str(e)}")
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
             raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+        user_dir = os.path.join(DICOM_ROOT_DIR, str(current_user.cor_id))
+        user_slide_dir = os.path.join(user_dir, "slides")
+        os.makedirs(user_slide_dir, exist_ok=True)
 
-        try:
-            load_volume.cache_clear()
-        except NameError:
-            logger.debug("load_volume не определён, кэш не очищается")
+        # открытые дескрипторы удаляемых файлов держали бы место на диске
+        slide_cache.evict_dir(user_slide_dir)
+        tile_cache.schedule_prune()
+        for f in os.listdir(user_slide_dir):
+            f_path = os.path.join(user_slide_dir, f)
+            if (os.path.isfile(f_path) or os.path.islink(f_path)) and f.lower().endswith(".svs"):
+                try:
+                    os.remove(f_path)
+                    logger.debug(f"Удалён старый SVS-файл: {f_path}")
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить файл {f_path}: {e}")
+
+        target_path = os.path.join(user_slide_dir, filename)
+        os.symlink(os.path.abspath(cached_path), target_path)
+        logger.info(f"SVS-файл {cached_path} подключён как {target_path}")
 
         return {"message": f"Загружен файл SVS (1 шт.)"}
 
@@ -2128,6 +2128,15 @@ class PaginatedResponse(BaseModel, Generic[T]):
     total_pages: int = Field(..., description="Общее количество страниц")
 
 
+class CursorPaginatedResponse(BaseModel, Generic[T]):
+    items: List[T] = Field(..., description="Список элементов на текущей странице")
+    page_size: int = Field(..., description="Количество элементов на странице")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы, None — страниц больше нет")
+    total_count: Optional[int] = Field(None, description="Общее количество элементов (только при запросе по номеру страницы)")
+    page: Optional[int] = Field(None, description="Текущий номер страницы (только при запросе по номеру страницы)")
+    total_pages: Optional[int] = Field(None, description="Общее количество страниц (только при запросе по номеру страницы)")
+
+
 # Модель данных для управления ESS
 
 
@@ -2339,6 +2348,8 @@ class EnergeticObjectBase(BaseModel):
     description: Optional[str] = None
     modbus_registers: Optional[dict] = None
     is_active: bool
+    modbus_host: Optional[str] = None
+    modbus_port: Optional[int] = Field(502, ge=1, le=65535)
 
 class EnergeticObjectCreate(EnergeticObjectBase):
     pass
@@ -2348,6 +2359,8 @@ class EnergeticObjectUpdate(BaseModel):
     description: Optional[str] = None
     modbus_registers: Optional[dict] = None
     is_active: Optional[bool] = None
+    modbus_host: Optional[str] = None
+    modbus_port: Optional[int] = Field(None, ge=1, le=65535)
 
 class EnergeticObjectResponse(EnergeticObjectBase):
     id: str
@@ -0,0 +1,21 @@
+from typing import Optional
+
+from loguru import logger
+
+from cor_pass.database.redis_db import redis_client
+
+SCHEDULE_CHANGES_CHANNEL = "cerbo:schedules:changed"
+# Сообщение без ID объекта сбрасывает кэш расписаний всех объектов
+ALL_OBJECTS = "*"
+
+
+async def notify_schedule_changed(energetic_object_id: Optional[str]):
+    """
+    Сообщает Modbus воркеру, что расписания объекта изменились и кэш нужно перечитать.
+    Ошибка Redis не отменяет изменение в БД: воркер всё равно перечитает расписания
+    при следующей периодической сверке.
+    """
+    try:
+        await redis_client.publish(SCHEDULE_CHANGES_CHANNEL, energetic_object_id or ALL_OBJECTS)
+    except Exception as e:
+        logger.warning(f"Failed to publish schedule change for {energetic_object_id}: {e}")
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import WebSocket
+from loguru import logger
+
+from cor_pass.config.config import settings
+from cor_pass.database.redis_db import redis_client
+
+TELEMETRY_CHANNEL_PREFIX = "cerbo:telemetry:"
+TELEMETRY_CHANNEL_PATTERN = f"{TELEMETRY_CHANNEL_PREFIX}*"
+TELEMETRY_LAST_KEY_PREFIX = "cerbo:telemetry_last:"
+
+# Поля, которые отправляются клиенту всегда, даже если не изменились
+TELEMETRY_ALWAYS_SENT = ("measured_at",)
+
+
+def _json_default(value: Any) -> str:
+    # measured_at в том же ISO-формате, что отдаёт API
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def telemetry_channel(object_id: str) -> str:
+    return f"{TELEMETRY_CHANNEL_PREFIX}{object_id}"
+
+
+async def publish_telemetry(object_id: str, data: Dict[str, Any]):
+    """
+    Публикует свежие показания объекта в Redis канал и сохраняет их как последние,
+    чтобы новый подписчик сразу получил полное состояние.
+    Ошибки Redis не должны останавливать сбор данных, поэтому только логируются.
+    """
+    message = json.dumps(data, default=_json_default)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.publish(telemetry_channel(object_id), message)
+            pipe.set(f"{TELEMETRY_LAST_KEY_PREFIX}{object_id}", message, ex=settings.telemetry_last_value_ttl_seconds)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"[{object_id}] Failed to publish telemetry: {e}")
+
+
+async def get_last_telemetry(object_id: str) -> Optional[Dict[str, Any]]:
+    message = await redis_client.get(f"{TELEMETRY_LAST_KEY_PREFIX}{object_id}")
+    return json.loads(message) if message else None
+
+
+class TelemetrySubscription:
+    """
+    Подписка одного WebSocket клиента на показания объектов.
+    Обновления, пришедшие между отправками, склеиваются (остаётся последнее значение поля),
+    клиенту уходят только изменившиеся поля и не чаще одного раза в min_interval секунд.
+    """
+
+    def __init__(self, websocket: WebSocket, min_interval: float):
+        self.websocket = websocket
+        self.min_interval = min_interval
+        self.object_ids: set = set()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.last_sent: Dict[str, Dict[str, Any]] = {}
+        self.sent_messages = 0
+        self.coalesced_updates = 0
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._send_loop())
+
+    async def subscribe(self, object_ids: Iterable[str]):
+        for object_id in object_ids:
+            if object_id in self.object_ids:
+                continue
+            self.object_ids.add(object_id)
+            last = await get_last_telemetry(object_id)
+            if last:
+                self.offer(object_id, last)
+
+    def unsubscribe(self, object_ids: Iterable[str]):
+        for object_id in object_ids:
+            self.object_ids.discard(object_id)
+            self.pending.pop(object_id, None)
+            self.last_sent.pop(object_id, None)
+
+    def offer(self, object_id: str, data: Dict[str, Any]):
+        if object_id not in self.object_ids:
+            return
+        if object_id in self.pending:
+            self.coalesced_updates += 1
+        self.pending.setdefault(object_id, {}).update(data)
+        self._wakeup.set()
+
+    async def send(self, message: Dict[str, Any]):
+        """Отправляет сообщение клиенту. Все отправки в этот WebSocket идут через этот метод."""
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    def _delta(self, object_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        last = self.last_sent.setdefault(object_id, {})
+        delta = {key: value for key, value in data.items() if last.get(key, object()) != value}
+        if not any(key not in TELEMETRY_ALWAYS_SENT for key in delta):
+            return {}
+        for key in TELEMETRY_ALWAYS_SENT:
+            if key in data:
+                delta[key] = data[key]
+        last.update(data)
+        return delta
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                pending, self.pending = self.pending, {}
+                for object_id, data in pending.items():
+                    delta = self._delta(object_id, data)
+                    if delta:
+                        await self.send({"type": "telemetry", "object_id": object_id, "data": delta})
+                        self.sent_messages += 1
+                await asyncio.sleep(self.min_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Telemetry send loop stopped: {e}")
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
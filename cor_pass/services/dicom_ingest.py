@@ -0,0 +1,83 @@
+import asyncio
+import os
+import shutil
+import zipfile
+from concurrent.futures import Future
+from typing import BinaryIO, List, Optional, Tuple
+
+from loguru import logger
+
+from cor_pass.services.dicom_volume import dicom_decoder, write_slice_index
+
+# Куски, которыми файлы и элементы архива пишутся на диск
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class DicomIngest:
+    """
+    Приём загрузки DICOM в каталог пользователя.
+    Файлы и элементы ZIP пишутся на диск потоком, без распаковки архива целиком,
+    и сразу уходят на проверку заголовка в пул dicom_decoder, пока пишутся следующие.
+    Заголовки срезов сохраняются как индекс тома, поэтому первый load_volume их не перечитывает.
+    """
+
+    def __init__(self, user_dicom_dir: str):
+        self.user_dicom_dir = user_dicom_dir
+        self.checks: List[Tuple[str, Future]] = []
+
+    def _target(self, name: str) -> Optional[str]:
+        # имя без каталогов: файлы из вложенных папок архива тоже попадают в том,
+        # а ".." и скрытые имена (в том числе .volume) не могут ничего перезаписать
+        flat = name.replace("\\", "/").strip("/").replace("/", "_")
+        if not flat or flat.startswith("."):
+            return None
+        return os.path.join(self.user_dicom_dir, flat)
+
+    def _write(self, source: BinaryIO, target: str, check: bool):
+        with open(target, "wb") as buffer:
+            shutil.copyfileobj(source, buffer, COPY_CHUNK_BYTES)
+        if check:
+            self.checks.append((target, dicom_decoder.inspect(target)))
+
+    def add_file(self, filename: str, source: BinaryIO):
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext == ".zip":
+            self._add_zip(filename, source)
+            return
+        target = self._target(os.path.basename(filename.replace("\\", "/")))
+        if target is None:
+            logger.debug(f"[WARN] Пропущен файл с недопустимым именем {filename}")
+            return
+        # SVS не проверяется как DICOM и в том не входит
+        self._write(source, target, check=file_ext != ".svs")
+
+    def _add_zip(self, filename: str, source: BinaryIO):
+        try:
+            with zipfile.ZipFile(source) as archive:
+                for member in archive.infolist():
+                    if member.is_dir():
+                        continue
+                    target = self._target(member.filename)
+                    if target is None:
+                        logger.debug(f"[WARN] Пропущен элемент {member.filename} архива {filename}")
+                        continue
+                    with archive.open(member) as member_file:
+                        self._write(member_file, target, check=not target.lower().endswith(".svs"))
+        except Exception as e:
+            logger.error(f"Ошибка распаковки {filename}: {e}")
+
+    async def finish(self) -> int:
+        """Ждёт проверок, удаляет файлы не-DICOM, сохраняет индекс срезов. Возвращает число DICOM-файлов."""
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for _, future in self.checks))
+        valid_dicom = 0
+        headers = []
+        for (path, _), (valid, header) in zip(self.checks, results):
+            if not valid:
+                os.remove(path)
+                continue
+            valid_dicom += 1
+            if header is not None:
+                headers.append(header)
+        if headers:
+            await asyncio.to_thread(write_slice_index, self.user_dicom_dir, headers)
+        return valid_dicom
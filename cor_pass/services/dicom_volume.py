@@ -0,0 +1,242 @@
+import json
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from loguru import logger
+
+from cor_pass.config.config import settings
+from cor_pass.services.volume_cache import VOLUME_DIR
+
+# Сколько файлов отдавать процессу пула за раз при чтении заголовков
+HEADER_CHUNK_SIZE = 16
+# На сколько пачек на процесс делить декодирование: меньше — меньше накладных, больше — ровнее нагрузка
+DECODE_CHUNKS_PER_WORKER = 4
+# Заголовки срезов, собранные при загрузке, лежат рядом с томом
+SLICE_INDEX_FILE = "index.json"
+
+
+def read_slice_header(path: str) -> Optional[dict]:
+    """
+    Заголовок среза без пиксельных данных: всё, что нужно для группировки, сортировки
+    и выбора типа тома. None — файл не DICOM или не срез объёма.
+    """
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, force=True)
+    except Exception as e:
+        logger.debug(f"[WARN] Пропущен файл {path} из-за ошибки чтения: {e}")
+        return None
+    return _slice_header(path, ds)
+
+
+def inspect_upload_file(path: str) -> Tuple[bool, Optional[dict]]:
+    """
+    Проверка файла при загрузке: (DICOM ли это, заголовок среза или None).
+    Без force, как и прежняя проверка загрузки: файлы без преамбулы DICOM не принимаются.
+    """
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except Exception:
+        return False, None
+    return True, _slice_header(path, ds)
+
+
+def _slice_header(path: str, ds: pydicom.Dataset) -> Optional[dict]:
+    required_attrs = ["ImagePositionPatient", "ImageOrientationPatient", "Rows", "Columns"]
+    if not all(hasattr(ds, attr) for attr in required_attrs):
+        logger.debug(f"[WARN] Файл {path} не содержит необходимых DICOM-тегов. Пропущен.")
+        return None
+    if ds.get("SamplesPerPixel", 1) != 1:
+        logger.debug(f"[WARN] Файл {path} цветной, в том не входит")
+        return None
+
+    bits = ds.get("BitsAllocated", 16)
+    signed = ds.get("PixelRepresentation", 0) == 1
+    dtype = f"{'i' if signed else 'u'}{bits // 8}" if bits in (8, 16, 32) else "f4"
+    return {
+        "path": path,
+        "series": str(ds.get("SeriesInstanceUID", "")),
+        "position": [float(v) for v in ds.ImagePositionPatient],
+        "orientation": [float(v) for v in ds.ImageOrientationPatient],
+        "shape": (int(ds.Rows), int(ds.Columns)),
+        "dtype": dtype,
+        "slope": float(ds.get("RescaleSlope", 1) or 1),
+        "intercept": float(ds.get("RescaleIntercept", 0) or 0),
+    }
+
+
+def write_slice_index(user_dicom_dir: str, headers: List[dict]):
+    """Сохраняет заголовки срезов, прочитанные при загрузке, чтобы decode не читал их снова."""
+    index_dir = os.path.join(user_dicom_dir, VOLUME_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    entries = [dict(h, path=os.path.relpath(h["path"], user_dicom_dir)) for h in headers]
+    temp_path = os.path.join(index_dir, f"{SLICE_INDEX_FILE}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(entries, f)
+    os.replace(temp_path, os.path.join(index_dir, SLICE_INDEX_FILE))
+
+
+def read_slice_index(user_dicom_dir: str) -> Optional[List[dict]]:
+    try:
+        with open(os.path.join(user_dicom_dir, VOLUME_DIR, SLICE_INDEX_FILE)) as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return None
+    return [
+        dict(h, path=os.path.join(user_dicom_dir, h["path"]), shape=tuple(h["shape"])) for h in entries
+    ]
+
+
+def decode_slices_into(
+    volume_path: str,
+    target_shape: Tuple[int, int],
+    items: List[Tuple[int, str, Optional[Tuple[float, float]]]],
+) -> List[int]:
+    """
+    Декодирует пачку срезов (индекс в томе, файл, наклон и сдвиг или None) и пишет их
+    в файл тома. Выполняется в процессе пула, поэтому пиксели не передаются обратно.
+    Возвращает индексы срезов, которые не удалось декодировать.
+    """
+    volume = np.load(volume_path, mmap_mode="r+")
+    failed = []
+    for index, path, rescale in items:
+        try:
+            ds = pydicom.dcmread(path, force=True)
+            transfer_syntax = ds.file_meta.get("TransferSyntaxUID") if hasattr(ds, "file_meta") else None
+            if transfer_syntax and transfer_syntax.is_compressed:
+                ds.decompress()  # Автоматический выбор декомпрессора
+            arr = ds.pixel_array
+            if rescale is not None:
+                arr = arr.astype(np.float32) * rescale[0] + rescale[1]
+            if arr.shape != target_shape:
+                # skimage нужен только для срезов другой формы, а импортируется долго
+                from skimage.transform import resize
+
+                arr = resize(arr, target_shape, preserve_range=True)
+            if arr.dtype.kind == "f" and volume.dtype.kind in "iu":
+                arr = np.rint(arr)
+            volume[index] = arr
+        except Exception as e:
+            logger.debug(f"[ERROR] Ошибка обработки {os.path.basename(path)}: {e}")
+            failed.append(index)
+    volume.flush()
+    return failed
+
+
+class DicomDecoder:
+    """
+    Декодирование серии DICOM в файл тома для volume_cache.
+    Заголовки читаются параллельно без пикселей, из них выбирается самая большая серия
+    и порядок срезов; пиксели декодируют процессы пула прямо в файл тома.
+    Том хранится в исходном типе (int16/uint16), наклон и сдвиг — в метаданных;
+    если у срезов они разные, том приводится к float32 с уже применённым пересчётом.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or settings.dicom_decode_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: форк процесса с потоками uvicorn небезопасен
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def decode(self, user_dicom_dir: str, volume_path: str) -> dict:
+        """Пишет том в volume_path (.npy) и возвращает метаданные для volume.json."""
+        logger.debug("[INFO] Загружаем том из DICOM-файлов...")
+        executor = self._get_executor()
+        # заголовки уже прочитаны при загрузке, если она шла через dicom_ingest
+        headers = read_slice_index(user_dicom_dir)
+        if headers is None:
+            dicom_paths = [
+                os.path.join(user_dicom_dir, f)
+                for f in os.listdir(user_dicom_dir)
+                if not f.startswith(".") and os.path.isfile(os.path.join(user_dicom_dir, f))
+            ]
+            headers = [h for h in executor.map(read_slice_header, dicom_paths, chunksize=HEADER_CHUNK_SIZE) if h]
+        if not headers:
+            raise RuntimeError("Нет подходящих DICOM-файлов с ImagePositionPatient.")
+
+        headers = self._largest_series(headers)
+
+        # Сортировка по проекции позиции на нормаль к срезу
+        orientation = headers[0]["orientation"]
+        normal = np.cross(orientation[:3], orientation[3:])
+        headers.sort(key=lambda h: np.dot(h["position"], normal))
+
+        # Приведение всех к одной форме
+        target_shape = Counter(h["shape"] for h in headers).most_common(1)[0][0]
+        rescales = {(h["slope"], h["intercept"]) for h in headers}
+        dtypes = {h["dtype"] for h in headers}
+        if len(rescales) == 1 and len(dtypes) == 1:
+            dtype = np.dtype(dtypes.pop())
+            slope, intercept = rescales.pop()
+            per_slice = False
+        else:
+            dtype, slope, intercept = np.dtype(np.float32), 1.0, 0.0
+            per_slice = True
+        logger.debug(f"[INFO] Том {len(headers)}x{target_shape}, тип {dtype}, пересчёт по срезам: {per_slice}")
+
+        volume = np.lib.format.open_memmap(volume_path, mode="w+", dtype=dtype, shape=(len(headers),) + target_shape)
+        del volume
+        items = [
+            (index, h["path"], (h["slope"], h["intercept"]) if per_slice else None) for index, h in enumerate(headers)
+        ]
+        chunk = max(1, -(-len(items) // (self.workers * DECODE_CHUNKS_PER_WORKER)))
+        chunks = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+        failed = set()
+        for chunk_failed in executor.map(decode_slices_into, [volume_path] * len(chunks), [target_shape] * len(chunks), chunks):
+            failed.update(chunk_failed)
+        kept = [index for index in range(len(headers)) if index not in failed]
+        if not kept:
+            raise RuntimeError("Не удалось загрузить ни одного среза.")
+        if len(kept) < len(headers):
+            self._compact(volume_path, kept)
+        logger.debug(f"[INFO] Загружено срезов: {len(kept)}")
+
+        return {
+            "header": os.path.relpath(headers[kept[0]]["path"], user_dicom_dir),
+            "slope": slope,
+            "intercept": intercept,
+        }
+
+    @staticmethod
+    def _largest_series(headers: List[dict]) -> List[dict]:
+        series = Counter(h["series"] for h in headers)
+        largest, count = series.most_common(1)[0]
+        if len(series) > 1:
+            logger.debug(f"[INFO] Серий в загрузке: {len(series)}, берём {largest} ({count} срезов)")
+        return [h for h in headers if h["series"] == largest]
+
+    @staticmethod
+    def _compact(volume_path: str, kept: List[int]):
+        """Убирает из тома срезы, которые не удалось декодировать."""
+        source = np.load(volume_path, mmap_mode="r")
+        compact_path = f"{volume_path}.compact"
+        target = np.lib.format.open_memmap(
+            compact_path, mode="w+", dtype=source.dtype, shape=(len(kept),) + source.shape[1:]
+        )
+        for index, source_index in enumerate(kept):
+            target[index] = source[source_index]
+        target.flush()
+        del source, target
+        os.replace(compact_path, volume_path)
+
+    def inspect(self, path: str) -> Future:
+        """Проверка загруженного файла в пуле, см. inspect_upload_file."""
+        return self._get_executor().submit(inspect_upload_file, path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+dicom_decoder = DicomDecoder()
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from prometheus_client import Counter, Gauge
+
+from cor_pass.config.config import settings
+
+# Сколько сохранений между обходами каталога для очистки диска
+PRUNE_EVERY_PUTS = 256
+
+glass_preview_cache_requests_total = Counter(
+    "glass_preview_cache_requests_total", "Glass preview cache lookups", ["result"]
+)
+glass_preview_cache_memory_bytes = Gauge(
+    "glass_preview_cache_memory_bytes", "Bytes of glass previews held in memory"
+)
+
+# Загрузка превью по preview_url, если его нет в кэше
+PreviewFetcher = Callable[[str], Awaitable[bytes]]
+
+
+class CachedPreview:
+    def __init__(self, version: Tuple[int, int], data: bytes):
+        self.version = version
+        self.data = data
+        self.etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+
+
+class PreviewCache:
+    """
+    Кэш PNG-превью стёкол по preview_url: LRU в памяти с лимитом в байтах
+    и файлы на диске в <cache_dir>/<sha1 от preview_url>.png, общие для воркеров.
+    Версия записи — inode и mtime файла на диске: invalidate удаляет файл,
+    и остальные воркеры замечают это по одному stat.
+    ETag — хэш содержимого, поэтому совпадает во всех воркерах.
+    Одновременные промахи по одному preview_url ждут одну загрузку с SMB.
+    get, put и prune_disk работают с диском синхронно: из async-кода они вызываются
+    через asyncio.to_thread, очистка диска идёт в фоновом потоке (schedule_prune).
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, memory_bytes: Optional[int] = None, disk_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or settings.glass_preview_cache_dir
+        self.memory_limit = settings.glass_preview_cache_memory_bytes if memory_bytes is None else memory_bytes
+        self.disk_limit = settings.glass_preview_cache_disk_bytes if disk_bytes is None else disk_bytes
+        self.previews: "OrderedDict[str, CachedPreview]" = OrderedDict()
+        self.memory_used = 0
+        self.puts = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._pruning = False
+
+    def _disk_path(self, preview_url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(preview_url.encode()).hexdigest() + ".png")
+
+    @staticmethod
+    def _version(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def get(self, preview_url: str) -> Optional[CachedPreview]:
+        path = self._disk_path(preview_url)
+        version = self._version(path)
+        if version is None:
+            glass_preview_cache_requests_total.labels(result="miss").inc()
+            return None
+        with self._lock:
+            cached = self.previews.get(preview_url)
+            if cached is not None and cached.version == version:
+                self.previews.move_to_end(preview_url)
+                glass_preview_cache_requests_total.labels(result="memory").inc()
+                return cached
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            glass_preview_cache_requests_total.labels(result="miss").inc()
+            return None
+        glass_preview_cache_requests_total.labels(result="disk").inc()
+        cached = CachedPreview(version, data)
+        self._remember(preview_url, cached)
+        return cached
+
+    def put(self, preview_url: str, data: bytes) -> CachedPreview:
+        path = self._disk_path(preview_url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # запись через временный файл, чтобы параллельный запрос не прочитал половину превью
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to store preview {path} on disk: {e}")
+            # без файла на диске версии нет, запись живёт только в ответе
+            return CachedPreview((0, 0), data)
+
+        cached = CachedPreview(self._version(path) or (0, 0), data)
+        self._remember(preview_url, cached)
+        with self._lock:
+            self.puts += 1
+            prune = self.puts % PRUNE_EVERY_PUTS == 0
+        if prune:
+            self.schedule_prune()
+        return cached
+
+    async def load(self, preview_url: str, fetch: PreviewFetcher) -> CachedPreview:
+        """Превью из кэша или через fetch; на промахе сохраняется в кэш."""
+        cached = await asyncio.to_thread(self.get, preview_url)
+        if cached is not None:
+            return cached
+
+        future = self._inflight.get(preview_url)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[preview_url] = future
+        try:
+            data = await fetch(preview_url)
+            cached = await asyncio.to_thread(self.put, preview_url, data)
+            future.set_result(cached)
+            return cached
+        except BaseException as e:
+            # отмена запроса-загрузчика для ожидающих — обычная ошибка загрузки
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"Preview fetch for {preview_url} cancelled"))
+            # если ожидающих нет, asyncio не должен ругаться на неполученную ошибку
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(preview_url, None)
+
+    def _remember(self, preview_url: str, cached: CachedPreview):
+        if len(cached.data) > self.memory_limit:
+            return
+        with self._lock:
+            previous = self.previews.pop(preview_url, None)
+            if previous is not None:
+                self.memory_used -= len(previous.data)
+            self.previews[preview_url] = cached
+            self.memory_used += len(cached.data)
+            while self.memory_used > self.memory_limit:
+                _, evicted = self.previews.popitem(last=False)
+                self.memory_used -= len(evicted.data)
+            glass_preview_cache_memory_bytes.set(self.memory_used)
+
+    def invalidate(self, preview_url: str):
+        """Сбрасывает превью после перезаписи файла на SMB."""
+        with self._lock:
+            previous = self.previews.pop(preview_url, None)
+            if previous is not None:
+                self.memory_used -= len(previous.data)
+                glass_preview_cache_memory_bytes.set(self.memory_used)
+        try:
+            os.unlink(self._disk_path(preview_url))
+        except FileNotFoundError:
+            pass
+
+    def schedule_prune(self):
+        """Запускает prune_disk в фоновом потоке, если он не идёт сейчас."""
+        with self._lock:
+            if self._pruning:
+                return
+            self._pruning = True
+        threading.Thread(target=self._prune_in_background, name="preview-cache-prune", daemon=True).start()
+
+    def _prune_in_background(self):
+        try:
+            self.prune_disk()
+        except Exception as e:
+            logger.warning(f"Glass preview cache prune failed: {e}")
+        finally:
+            with self._lock:
+                self._pruning = False
+
+    def prune_disk(self):
+        """Удаляет с диска дольше всех не обновлявшиеся превью, пока кэш не уложится в glass_preview_cache_disk_bytes."""
+        if not self.disk_limit or not os.path.isdir(self.cache_dir):
+            return
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or not entry.name.endswith(".png"):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+            total += stat.st_size
+        for _, path, size in sorted(files):
+            if total <= self.disk_limit:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        logger.debug(f"Glass preview cache on disk: {total} bytes")
+
+
+preview_cache = PreviewCache()
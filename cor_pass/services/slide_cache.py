@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from loguru import logger
+from openslide import OpenSlide
+from prometheus_client import Counter, Gauge
+
+from cor_pass.config.config import settings
+
+# Не чаще раза за столько секунд обновляется mtime симлинка на слайд пользователя
+USER_SLIDE_TOUCH_SECONDS = 60
+
+# Попадания и промахи кэшей слайдов: cache=handle — открытые OpenSlide, cache=path — путь к SVS пользователя
+svs_slide_cache_hits_total = Counter(
+    "svs_slide_cache_hits_total", "Slide cache hits", ["cache"]
+)
+svs_slide_cache_misses_total = Counter(
+    "svs_slide_cache_misses_total", "Slide cache misses", ["cache"]
+)
+svs_slide_cache_evictions_total = Counter(
+    "svs_slide_cache_evictions_total", "Slide handles closed by the cache", ["reason"]
+)
+svs_slide_cache_open_handles = Gauge(
+    "svs_slide_cache_open_handles", "OpenSlide handles currently held by the cache"
+)
+
+
+class _SlideHandle:
+    def __init__(self, slide: OpenSlide):
+        self.slide = slide
+        self.last_used = time.monotonic()
+        # Число запросов, читающих слайд прямо сейчас. Закрываем только когда 0.
+        self.users = 0
+        self.evicted = False
+
+
+class SlideHandleCache:
+    """
+    Общий для процесса LRU открытых OpenSlide.
+    Ключ — (реальный путь, mtime), поэтому перезаписанный файл открывается заново.
+    Маршруты /svs синхронные и выполняются в пуле потоков, отсюда блокировка.
+    """
+
+    def __init__(self, max_handles: Optional[int] = None, idle_seconds: Optional[float] = None):
+        self.max_handles = max_handles or settings.svs_slide_cache_max_handles
+        self.idle_seconds = idle_seconds or settings.svs_slide_cache_idle_seconds
+        self.handles: "OrderedDict[Tuple[str, int], _SlideHandle]" = OrderedDict()
+        # cor_id -> (каталог слайдов, mtime каталога, путь к SVS, симлинк пользователя на него)
+        self.user_paths: Dict[str, Tuple[str, int, str, str]] = {}
+        # cor_id -> время последнего touch_user_slide
+        self.user_touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def resolve_user_slide(self, slide_dir: str, user_id: str) -> str:
+        """
+        Путь к SVS пользователя. Каталог перечитывается только когда меняется его mtime
+        (файл добавлен или удалён), иначе хватает одного stat.
+        """
+        try:
+            dir_mtime = os.stat(slide_dir).st_mtime_ns
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="No SVS files found.")
+
+        cached = self.user_paths.get(user_id)
+        if cached and cached[0] == slide_dir and cached[1] == dir_mtime:
+            svs_slide_cache_hits_total.labels(cache="path").inc()
+            return cached[2]
+
+        svs_slide_cache_misses_total.labels(cache="path").inc()
+        svs_files = sorted(f for f in os.listdir(slide_dir) if f.lower().endswith(".svs"))
+        if not svs_files:
+            self.user_paths.pop(user_id, None)
+            raise HTTPException(status_code=404, detail="No SVS files found.")
+        link_path = os.path.join(slide_dir, svs_files[0])
+        svs_path = os.path.realpath(link_path)
+        self.user_paths[user_id] = (slide_dir, dir_mtime, svs_path, link_path)
+        return svs_path
+
+    def touch_user_slide(self, user_id: str):
+        """
+        Отмечает, что пользователь смотрит слайд: обновляет mtime его симлинка, а не самого SVS,
+        чтобы не сбросить ключи кэшей по mtime слайда. По нему slide_store.evict видит, что слайд в работе.
+        """
+        cached = self.user_paths.get(user_id)
+        now = time.time()
+        if cached is None or now - self.user_touched.get(user_id, 0) < USER_SLIDE_TOUCH_SECONDS:
+            return
+        self.user_touched[user_id] = now
+        try:
+            os.utime(cached[3], follow_symlinks=False)
+        except OSError as e:
+            logger.debug(f"Failed to touch {cached[3]}: {e}")
+
+    def open_paths(self) -> Set[str]:
+        """Реальные пути слайдов, открытых в этом процессе."""
+        with self._lock:
+            return {key[0] for key in self.handles}
+
+    @contextmanager
+    def open(self, svs_path: str) -> Iterator[OpenSlide]:
+        """Выдаёт открытый слайд из кэша. Пока блок with не завершён, слайд не будет закрыт."""
+        handle = self._acquire(svs_path)
+        try:
+            yield handle.slide
+        finally:
+            self._release(handle)
+
+    def _acquire(self, svs_path: str) -> _SlideHandle:
+        path = os.path.realpath(svs_path)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self._lock:
+            self._evict_idle()
+            handle = self.handles.get(key)
+            if handle is not None:
+                svs_slide_cache_hits_total.labels(cache="handle").inc()
+                self.handles.move_to_end(key)
+                handle.users += 1
+                handle.last_used = time.monotonic()
+                return handle
+
+        svs_slide_cache_misses_total.labels(cache="handle").inc()
+        # Разбор TIFF занимает время, поэтому открываем вне блокировки
+        slide = OpenSlide(path)
+
+        with self._lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                handle = _SlideHandle(slide)
+                for stale_key in [k for k in self.handles if k[0] == path]:
+                    self._evict(stale_key, "stale")
+                self.handles[key] = handle
+                while len(self.handles) > self.max_handles:
+                    self._evict(next(iter(self.handles)), "lru")
+            else:
+                # параллельный запрос успел открыть тот же файл
+                slide.close()
+            self.handles.move_to_end(key)
+            handle.users += 1
+            handle.last_used = time.monotonic()
+            svs_slide_cache_open_handles.set(len(self.handles))
+            return handle
+
+    def _release(self, handle: _SlideHandle):
+        with self._lock:
+            handle.users -= 1
+            handle.last_used = time.monotonic()
+            if handle.evicted and handle.users == 0:
+                handle.slide.close()
+
+    def _evict(self, key: Tuple[str, int], reason: str):
+        handle = self.handles.pop(key)
+        handle.evicted = True
+        if handle.users == 0:
+            handle.slide.close()
+        svs_slide_cache_evictions_total.labels(reason=reason).inc()
+        svs_slide_cache_open_handles.set(len(self.handles))
+        logger.debug(f"Closed cached slide {key[0]} ({reason})")
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_seconds
+        for key in [k for k, h in self.handles.items() if h.users == 0 and h.last_used < deadline]:
+            self._evict(key, "idle")
+
+    def evict_dir(self, slide_dir: str):
+        """Закрывает слайды из каталога, например перед удалением файлов при загрузке нового SVS."""
+        prefix = os.path.realpath(slide_dir) + os.sep
+        with self._lock:
+            for key in [k for k in self.handles if k[0].startswith(prefix)]:
+                self._evict(key, "removed")
+            for user_id in [u for u, cached in self.user_paths.items() if cached[2].startswith(prefix)]:
+                del self.user_paths[user_id]
+
+
+slide_cache = SlideHandleCache()
@@ -0,0 +1,263 @@
+import json
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+from cor_pass.config.config import settings
+from cor_pass.services.smb_client import read_smb_range, smb_pool, smb_relative_path
+from cor_pass.services.tile_cache import FINGERPRINT_SAMPLE_BYTES
+
+# Рядом с разреженным SVS: откуда он и какие блоки уже скачаны (по байту на блок)
+SOURCE_SUFFIX = ".range.json"
+BLOCKS_SUFFIX = ".range.blocks"
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+TIFF_INT_FORMATS = {1: "B", 3: "H", 4: "I", 16: "Q"}
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+
+svs_range_fetched_bytes_total = Counter(
+    "svs_range_fetched_bytes_total", "Bytes of SVS files fetched from SMB by range reads"
+)
+
+
+class _TiledLevel:
+    def __init__(self, width: int, height: int, tile_width: int, tile_height: int, offsets: List[int], counts: List[int]):
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.offsets = offsets
+        self.counts = counts
+
+
+class RangeSlideSource:
+    """
+    Локальный разреженный SVS, который дозаполняется с SMB по блокам svs_range_block_bytes.
+    OpenSlide читает обычный файл, поэтому перед чтением региона нужные блоки
+    докачиваются: при создании — заголовок TIFF и все каталоги (IFD) со значениями тегов,
+    затем — только тайлы запрошенных регионов.
+    Состояние блоков хранится в файле рядом, поэтому его видят и процессы пула рендера.
+    """
+
+    def __init__(self, svs_path: str, scan_url: str, size: int, block_size: int):
+        self.svs_path = svs_path
+        self.scan_url = scan_url
+        self.size = size
+        self.block_size = block_size
+        self.block_count = (size + block_size - 1) // block_size
+        self._levels: Optional[List[_TiledLevel]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, svs_path: str, scan_url: str, size: int) -> "RangeSlideSource":
+        """Создаёт разреженный файл и скачивает всё, что OpenSlide читает при открытии."""
+        source = cls(svs_path, scan_url, size, settings.svs_range_block_bytes)
+        with open(svs_path, "wb") as f:
+            f.truncate(size)
+        with open(svs_path + BLOCKS_SUFFIX, "wb") as f:
+            f.truncate(source.block_count)
+        with open(svs_path + SOURCE_SUFFIX, "w") as f:
+            json.dump({"scan_url": scan_url, "size": size, "block_size": source.block_size}, f)
+        # начало и конец файла входят в отпечаток слайда для кэша тайлов
+        source.ensure_range(0, FINGERPRINT_SAMPLE_BYTES)
+        source.ensure_range(max(size - FINGERPRINT_SAMPLE_BYTES, 0), FINGERPRINT_SAMPLE_BYTES)
+        # самый мелкий уровень OpenSlide читает при открытии для openslide.quickhash-1
+        source.ensure_level(len(source.levels()) - 1)
+        return source
+
+    @classmethod
+    def load(cls, svs_path: str) -> Optional["RangeSlideSource"]:
+        try:
+            with open(svs_path + SOURCE_SUFFIX) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(svs_path, meta["scan_url"], meta["size"], meta["block_size"])
+
+    def _missing_blocks(self, first: int, last: int) -> List[int]:
+        with open(self.svs_path + BLOCKS_SUFFIX, "rb") as f:
+            f.seek(first)
+            present = f.read(last - first + 1)
+        return [first + i for i, flag in enumerate(present) if not flag]
+
+    def ensure_range(self, offset: int, length: int):
+        """Докачивает недостающие блоки диапазона, соседние блоки — одним запросом."""
+        if length <= 0 or offset >= self.size:
+            return
+        first = offset // self.block_size
+        last = min(offset + length - 1, self.size - 1) // self.block_size
+        missing = self._missing_blocks(first, last)
+        if not missing:
+            return
+
+        runs: List[Tuple[int, int]] = []
+        for block in missing:
+            if runs and runs[-1][1] == block - 1:
+                runs[-1] = (runs[-1][0], block)
+            else:
+                runs.append((block, block))
+
+        with self._lock, smb_pool.connection() as conn:
+            data_fd = os.open(self.svs_path, os.O_WRONLY)
+            blocks_fd = os.open(self.svs_path + BLOCKS_SUFFIX, os.O_WRONLY)
+            try:
+                for start, end in runs:
+                    begin = start * self.block_size
+                    length = min((end + 1) * self.block_size, self.size) - begin
+                    data = read_smb_range(conn, smb_relative_path(self.scan_url), begin, length)
+                    if len(data) != length:
+                        raise RuntimeError(f"Expected {length} bytes at {begin}, got {len(data)}")
+                    os.pwrite(data_fd, data, begin)
+                    # блок помечается скачанным только после записи данных
+                    os.pwrite(blocks_fd, b"\x01" * (end - start + 1), start)
+                    svs_range_fetched_bytes_total.inc(length)
+            finally:
+                os.close(data_fd)
+                os.close(blocks_fd)
+
+    def _read(self, offset: int, length: int) -> bytes:
+        self.ensure_range(offset, length)
+        with open(self.svs_path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def levels(self) -> List[_TiledLevel]:
+        """Тайловые каталоги TIFF от большего к меньшему — это уровни OpenSlide."""
+        if self._levels is None:
+            self._levels = sorted(self._parse_tiled_levels(), key=lambda level: level.width, reverse=True)
+        return self._levels
+
+    def _parse_tiled_levels(self) -> List[_TiledLevel]:
+        header = self._read(0, 16)
+        order = {b"II": "<", b"MM": ">"}.get(header[:2])
+        if order is None:
+            raise ValueError(f"{self.scan_url} is not a TIFF file")
+        bigtiff = struct.unpack(order + "H", header[2:4])[0] == 43
+        if bigtiff:
+            ifd_offset = struct.unpack(order + "Q", header[8:16])[0]
+            count_format, entry_size, value_format = "Q", 20, "Q"
+        else:
+            ifd_offset = struct.unpack(order + "I", header[4:8])[0]
+            count_format, entry_size, value_format = "H", 12, "I"
+        count_size = struct.calcsize(count_format)
+        value_size = struct.calcsize(value_format)
+
+        levels = []
+        seen = set()
+        while ifd_offset and ifd_offset not in seen:
+            seen.add(ifd_offset)
+            count = struct.unpack(order + count_format, self._read(ifd_offset, count_size))[0]
+            raw = self._read(ifd_offset + count_size, count * entry_size + value_size)
+            tags: Dict[int, list] = {}
+            for index in range(count):
+                entry = raw[index * entry_size:(index + 1) * entry_size]
+                tag, tag_type = struct.unpack(order + "HH", entry[:4])
+                value_count = struct.unpack(order + value_format, entry[4:4 + value_size])[0]
+                value_bytes = entry[4 + value_size:]
+                total = TIFF_TYPE_SIZES.get(tag_type, 1) * value_count
+                if total > value_size:
+                    # значение не поместилось в запись — лежит по смещению, его тоже читает OpenSlide
+                    value_offset = struct.unpack(order + value_format, value_bytes)[0]
+                    value_bytes = self._read(value_offset, total)
+                if tag_type in TIFF_INT_FORMATS:
+                    tags[tag] = list(struct.unpack(f"{order}{value_count}{TIFF_INT_FORMATS[tag_type]}", value_bytes[:total]))
+            ifd_offset = struct.unpack(order + value_format, raw[count * entry_size:])[0]
+
+            if TAG_TILE_OFFSETS in tags and TAG_TILE_WIDTH in tags:
+                levels.append(
+                    _TiledLevel(
+                        tags[TAG_IMAGE_WIDTH][0],
+                        tags[TAG_IMAGE_LENGTH][0],
+                        tags[TAG_TILE_WIDTH][0],
+                        tags[TAG_TILE_LENGTH][0],
+                        tags[TAG_TILE_OFFSETS],
+                        tags[TAG_TILE_BYTE_COUNTS],
+                    )
+                )
+        return levels
+
+    def ensure_level_rect(self, level: int, x: int, y: int, width: int, height: int):
+        """Докачивает тайлы TIFF, покрывающие прямоугольник в пикселях уровня level."""
+        levels = self.levels()
+        if level < 0 or level >= len(levels):
+            return
+        tiled = levels[level]
+        tiles_across = (tiled.width + tiled.tile_width - 1) // tiled.tile_width
+        tiles_down = (tiled.height + tiled.tile_height - 1) // tiled.tile_height
+        first_col = max(x // tiled.tile_width, 0)
+        last_col = min((x + width - 1) // tiled.tile_width, tiles_across - 1)
+        first_row = max(y // tiled.tile_height, 0)
+        last_row = min((y + height - 1) // tiled.tile_height, tiles_down - 1)
+        for row in range(first_row, last_row + 1):
+            # тайлы одной строки обычно лежат в файле подряд — один диапазон на строку
+            # пустые тайлы (смещение и размер 0) OpenSlide не читает
+            indexes = [
+                i for i in (row * tiles_across + col for col in range(first_col, last_col + 1)) if tiled.counts[i]
+            ]
+            if not indexes:
+                continue
+            begin = min(tiled.offsets[i] for i in indexes)
+            end = max(tiled.offsets[i] + tiled.counts[i] for i in indexes)
+            if end - begin <= sum(tiled.counts[i] for i in indexes) * 2:
+                self.ensure_range(begin, end - begin)
+            else:
+                for i in indexes:
+                    self.ensure_range(tiled.offsets[i], tiled.counts[i])
+
+    def ensure_level(self, level: int):
+        levels = self.levels()
+        if 0 <= level < len(levels):
+            self.ensure_level_rect(level, 0, 0, levels[level].width, levels[level].height)
+
+
+_sources: Dict[str, Optional[RangeSlideSource]] = {}
+_sources_lock = threading.Lock()
+
+
+def range_source_for(svs_path: str) -> Optional[RangeSlideSource]:
+    """Источник докачки для слайда или None, если слайд скачан целиком."""
+    path = os.path.realpath(svs_path)
+    with _sources_lock:
+        if path not in _sources:
+            _sources[path] = RangeSlideSource.load(path)
+        return _sources[path]
+
+
+def forget_range_source(svs_path: str):
+    with _sources_lock:
+        _sources.pop(os.path.realpath(svs_path), None)
+
+
+def ensure_tile(svs_path: str, level: int, x: int, y: int, tile_size: int):
+    """
+    Докачивает данные для тайла /svs/tile. Координаты считаются так же, как в read_tile_region
+    и в OpenSlide: через уровень 0 с отбрасыванием дробной части.
+    """
+    source = range_source_for(svs_path)
+    if source is None:
+        return
+    levels = source.levels()
+    if level < 0 or level >= len(levels):
+        return
+    base, tiled = levels[0], levels[level]
+    # так OpenSlide вычисляет downsample уровня, если формат не задаёт его явно
+    downsample = (base.width / tiled.width + base.height / tiled.height) / 2
+    left = int(int(x * tile_size * downsample) / downsample)
+    top = int(int(y * tile_size * downsample) / downsample)
+    width = min(tile_size, tiled.width - x * tile_size)
+    height = min(tile_size, tiled.height - y * tile_size)
+    source.ensure_level_rect(level, left, top, width, height)
+
+
+def ensure_whole_level(svs_path: str, level: int):
+    source = range_source_for(svs_path)
+    if source is not None:
+        source.ensure_level(level)
@@ -0,0 +1,145 @@
+import asyncio
+import glob
+import hashlib
+import os
+from typing import Dict, Optional
+
+from loguru import logger
+from openslide import OpenSlide
+from prometheus_client import Counter
+
+from cor_pass.config.config import settings
+from cor_pass.repository.glass import fetch_file_from_smb, get_smb_file_attributes
+from cor_pass.services.slide_cache import slide_cache
+from cor_pass.services.slide_range import BLOCKS_SUFFIX, SOURCE_SUFFIX, RangeSlideSource, forget_range_source
+
+SLIDE_SUFFIX = ".svs"
+RANGE_SUFFIXES = (SOURCE_SUFFIX, BLOCKS_SUFFIX)
+
+svs_slide_store_requests_total = Counter(
+    "svs_slide_store_requests_total", "Shared SVS cache lookups", ["result"]
+)
+
+
+def slide_cache_key(scan_url: str, size: int, mtime: float) -> str:
+    """Ключ содержимого: тот же scan_url после перезаписи файла на SMB даёт другой ключ."""
+    return hashlib.sha1(f"{scan_url}|{size}|{int(mtime)}".encode()).hexdigest()
+
+
+class SlideStore:
+    """
+    Общий для всех пользователей локальный кэш SVS-файлов с SMB.
+    Файл хранится один раз в <cache_dir>/<ключ>.svs, пользователи ссылаются на него симлинком.
+    В режиме svs_slide_fetch_mode=range файл разреженный и дозаполняется по мере просмотра.
+    Одновременные запросы одного слайда ждут одну загрузку. При превышении
+    svs_slide_store_bytes удаляются слайды, которые дольше всех не открывали и не просматривали:
+    время просмотра — mtime симлинков пользователей, его обновляет запрос тайлов.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or settings.svs_slide_store_dir
+        self.max_bytes = settings.svs_slide_store_bytes if max_bytes is None else max_bytes
+        self.downloads: Dict[str, asyncio.Future] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{SLIDE_SUFFIX}")
+
+    async def get_slide(self, scan_url: str) -> str:
+        """Путь к локальной копии слайда. Загружает его с SMB, если копии нет."""
+        size, mtime = await get_smb_file_attributes(scan_url)
+        key = slide_cache_key(scan_url, size, mtime)
+        path = self._path(key)
+
+        if os.path.exists(path):
+            svs_slide_store_requests_total.labels(result="hit").inc()
+            # mtime локальной копии — время последнего открытия для LRU
+            os.utime(path)
+            return path
+
+        download = self.downloads.get(key)
+        if download is None:
+            svs_slide_store_requests_total.labels(result="miss").inc()
+            download = asyncio.ensure_future(self._download(scan_url, size, path))
+            self.downloads[key] = download
+            download.add_done_callback(lambda _: self.downloads.pop(key, None))
+        else:
+            svs_slide_store_requests_total.labels(result="shared_download").inc()
+        return await asyncio.shield(download)
+
+    async def _download(self, scan_url: str, size: int, path: str) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        range_mode = settings.svs_slide_fetch_mode == "range"
+        # место освобождаем заранее, чтобы новый файл поместился в бюджет
+        await asyncio.to_thread(self.evict, 0 if range_mode else size)
+        if range_mode:
+            # разреженный файл: сейчас скачиваются только заголовок и каталоги TIFF
+            temp_path = f"{path}.part"
+            await asyncio.to_thread(RangeSlideSource.create, temp_path, scan_url, size)
+        else:
+            temp_path = await fetch_file_from_smb(scan_url, target_dir=self.cache_dir)
+        try:
+            # OpenSlideUnsupportedFormatError уходит вызывающему, битый файл в кэш не попадает
+            await asyncio.to_thread(lambda: OpenSlide(temp_path).close())
+            if range_mode:
+                # служебные файлы переносятся раньше слайда: читатель видит слайд уже с ними
+                for suffix in RANGE_SUFFIXES:
+                    os.replace(temp_path + suffix, path + suffix)
+            os.replace(temp_path, path)
+        finally:
+            for leftover in [temp_path] + [temp_path + suffix for suffix in RANGE_SUFFIXES]:
+                if os.path.exists(leftover):
+                    os.unlink(leftover)
+        logger.info(f"SVS {scan_url} cached as {path} ({size} bytes, {settings.svs_slide_fetch_mode})")
+        return path
+
+    @staticmethod
+    def _last_viewed() -> Dict[str, float]:
+        """Реальный путь слайда -> последний mtime симлинков <svs_user_slides_root>/<cor_id>/slides/*.svs на него."""
+        viewed: Dict[str, float] = {}
+        for link in glob.glob(os.path.join(settings.svs_user_slides_root, "*", "slides", f"*{SLIDE_SUFFIX}")):
+            try:
+                if not os.path.islink(link):
+                    continue
+                target = os.path.realpath(link)
+                viewed[target] = max(viewed.get(target, 0), os.lstat(link).st_mtime)
+            except OSError:
+                continue
+        return viewed
+
+    def evict(self, incoming_bytes: int = 0):
+        """
+        Удаляет слайды, которые дольше всех не открывали и не просматривали, пока кэш
+        с новым файлом не уложится в бюджет. Слайды, открытые в slide_cache этого процесса, не трогает.
+        """
+        if not self.max_bytes or not os.path.isdir(self.cache_dir):
+            return
+        viewed = self._last_viewed()
+        open_paths = slide_cache.open_paths()
+        slides = []
+        total = incoming_bytes
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                # занятое место, а не размер: у разреженных слайдов он почти весь пустой
+                used = stat.st_blocks * 512
+                total += used
+                real_path = os.path.realpath(entry.path)
+                if entry.name.endswith(SLIDE_SUFFIX) and real_path not in open_paths:
+                    slides.append((max(stat.st_mtime, viewed.get(real_path, 0)), entry.path, used))
+        for _, path, size in sorted(slides):
+            if total <= self.max_bytes:
+                break
+            try:
+                # открытые дескрипторы OpenSlide продолжают читать удалённый файл до закрытия
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            forget_range_source(path)
+            for suffix in RANGE_SUFFIXES:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            total -= size
+            logger.info(f"Evicted cached SVS {path} ({size} bytes)")
+
+
+slide_store = SlideStore()
@@ -0,0 +1,169 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from openslide import OpenSlide
+from PIL import Image
+
+from cor_pass.config.config import settings
+from cor_pass.services.tile_cache import TILE_FORMATS, slide_fingerprint, tile_path
+
+# Файл-метка в каталоге слайда: пирамида сгенерирована полностью
+PYRAMID_COMPLETE_MARKER = ".pyramid_complete"
+
+_pyramid_pool: Optional[ProcessPoolExecutor] = None
+
+
+def read_tile_region(slide: OpenSlide, level: int, x: int, y: int, tile_size: int) -> Optional[Image.Image]:
+    """Регион тайла, приведённый к tile_size, или None, если тайл вне слайда."""
+    if level < 0 or level >= slide.level_count:
+        logger.warning(
+            f"[INVALID LEVEL] level={level}, max={slide.level_count - 1}"
+        )
+        return None
+
+    level_width, level_height = slide.level_dimensions[level]
+    tiles_x = (level_width + tile_size - 1) // tile_size
+    tiles_y = (level_height + tile_size - 1) // tile_size
+
+    if x < 0 or x >= tiles_x or y < 0 or y >= tiles_y:
+        logger.warning(
+            f"[OUT OF BOUNDS] level={level}, x={x}, y={y}, tiles_x={tiles_x}, tiles_y={tiles_y}"
+        )
+        return None
+
+    # Пересчёт координат тайла из текущего уровня в координаты уровня 0
+    scale = slide.level_downsamples[level]
+    location = (int(x * tile_size * scale), int(y * tile_size * scale))
+
+    # Фактический размер региона (в пикселях уровня level)
+    region_width = min(tile_size, level_width - x * tile_size)
+    region_height = min(tile_size, level_height - y * tile_size)
+
+    region = slide.read_region(
+        location, level, (region_width, region_height)
+    ).convert("RGB")
+    return region.resize((tile_size, tile_size), Image.LANCZOS)
+
+
+def encode_tile(region: Image.Image, tile_format: str) -> bytes:
+    buf = BytesIO()
+    region.save(buf, format=TILE_FORMATS[tile_format][0])
+    return buf.getvalue()
+
+
+def render_slide_thumbnail(svs_path: str, size: Tuple[int, int] = (512, 512)) -> bytes:
+    """PNG-миниатюра слайда для preview_url. Выполняется в процессе пула scan_worker."""
+    slide = OpenSlide(svs_path)
+    try:
+        preview = slide.get_thumbnail(size)
+    finally:
+        slide.close()
+    buf = BytesIO()
+    preview.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def render_tile_band(
+    svs_path: str,
+    out_dir: str,
+    slide_hash: str,
+    level: int,
+    rows: Tuple[int, int],
+    tile_size: int,
+    tile_format: str,
+) -> int:
+    """
+    Рендерит строки тайлов [rows[0], rows[1]) одного уровня и пишет их на диск.
+    Выполняется в процессе пула, поэтому слайд открывается здесь же.
+    """
+    slide = OpenSlide(svs_path)
+    try:
+        level_width, _ = slide.level_dimensions[level]
+        tiles_x = (level_width + tile_size - 1) // tile_size
+        level_dir = os.path.join(out_dir, slide_hash, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        written = 0
+        for y in range(*rows):
+            for x in range(tiles_x):
+                path = tile_path(out_dir, slide_hash, level, x, y, tile_size, tile_format)
+                if os.path.exists(path):
+                    continue
+                data = encode_tile(read_tile_region(slide, level, x, y, tile_size), tile_format)
+                fd, tmp_path = tempfile.mkstemp(dir=level_dir, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                written += 1
+        return written
+    finally:
+        slide.close()
+
+
+def _pyramid_bands(svs_path: str, tile_size: int, band_rows: int) -> List[Tuple[int, Tuple[int, int]]]:
+    slide = OpenSlide(svs_path)
+    try:
+        bands = []
+        # от мелких уровней к крупным: обзорные тайлы готовы первыми
+        for level in reversed(range(slide.level_count)):
+            _, level_height = slide.level_dimensions[level]
+            tiles_y = (level_height + tile_size - 1) // tile_size
+            for start in range(0, tiles_y, band_rows):
+                bands.append((level, (start, min(start + band_rows, tiles_y))))
+        return bands
+    finally:
+        slide.close()
+
+
+def _get_pyramid_pool() -> ProcessPoolExecutor:
+    global _pyramid_pool
+    if _pyramid_pool is None:
+        _pyramid_pool = ProcessPoolExecutor(
+            max_workers=settings.svs_pyramid_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pyramid_pool
+
+
+async def generate_slide_pyramid(
+    svs_path: str,
+    out_dir: Optional[str] = None,
+    tile_size: Optional[int] = None,
+    tile_format: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Заранее рендерит все тайлы слайда в раскладке дискового кэша /svs/tile.
+    Уровни режутся на полосы по svs_pyramid_band_rows строк, полосы рендерятся в пуле процессов.
+    Возвращает хэш слайда или None, если пирамида уже была сгенерирована.
+    """
+    out_dir = out_dir or settings.svs_tile_cache_dir
+    tile_size = tile_size or settings.svs_pyramid_tile_size
+    tile_format = tile_format or settings.svs_pyramid_format
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"Неизвестный формат тайлов: {tile_format}")
+
+    loop = asyncio.get_running_loop()
+    slide_hash = await loop.run_in_executor(None, slide_fingerprint, svs_path)
+    marker = os.path.join(out_dir, slide_hash, f"{PYRAMID_COMPLETE_MARKER}_{tile_size}_{tile_format}")
+    if os.path.exists(marker):
+        return None
+
+    bands = await loop.run_in_executor(None, _pyramid_bands, svs_path, tile_size, settings.svs_pyramid_band_rows)
+    pool = _get_pyramid_pool()
+    written = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                pool, render_tile_band, svs_path, out_dir, slide_hash, level, rows, tile_size, tile_format
+            )
+            for level, rows in bands
+        )
+    )
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, "w").close()
+    logger.info(f"Pyramid for {svs_path} ({slide_hash}) generated: {sum(written)} tiles")
+    return slide_hash
@@ -0,0 +1,231 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional
+
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+from smb.SMBConnection import SMBConnection
+from smb.smb_structs import OperationFailure
+
+from cor_pass.config.config import settings
+
+smb_pool_connections = Gauge(
+    "smb_pool_connections", "SMB sessions held by the pool", ["server", "state"]
+)
+smb_pool_connects_total = Counter(
+    "smb_pool_connects_total", "SMB sessions opened by the pool", ["server", "result"]
+)
+smb_pool_discarded_total = Counter(
+    "smb_pool_discarded_total", "SMB sessions closed by the pool", ["server", "reason"]
+)
+smb_pool_wait_seconds = Histogram(
+    "smb_pool_wait_seconds", "Time spent waiting for a free SMB session"
+)
+
+
+def connect_smb(server_ip: Optional[str] = None) -> SMBConnection:
+    server_ip = server_ip or settings.smb_server_ip
+    conn = SMBConnection(
+        settings.smb_user,
+        settings.smb_pass,
+        my_name=socket.gethostname(),
+        remote_name=settings.remote_name,
+        use_ntlm_v2=True,
+        is_direct_tcp=True,
+    )
+    if not conn.connect(server_ip, 445):
+        logger.error(f"Не удалось подключиться к SMB-серверу {server_ip}")
+        raise RuntimeError("Failed to connect to SMB server")
+    return conn
+
+
+class _IdleConnection:
+    def __init__(self, conn: SMBConnection):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+
+class SMBConnectionPool:
+    """
+    Пул аутентифицированных сессий SMB, общий для всех потоков процесса.
+    Сессия выдаётся одному потоку на время with smb_pool.connection(), затем возвращается в пул,
+    поэтому запросы подряд не проходят заново TCP и NTLM.
+    На сервер открывается не больше smb_pool_max_connections сессий, остальные ждут свободную.
+    Простаивающие сессии раз в smb_pool_keepalive_seconds проверяются echo,
+    а после smb_pool_idle_seconds без работы закрываются.
+    Сессия, на которой случилась ошибка связи, закрывается; следующая выдача откроет новую.
+    """
+
+    def __init__(
+        self,
+        max_per_server: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        keepalive_seconds: Optional[float] = None,
+        acquire_timeout: Optional[float] = None,
+    ):
+        self.max_per_server = max_per_server or settings.smb_pool_max_connections
+        self.idle_seconds = settings.smb_pool_idle_seconds if idle_seconds is None else idle_seconds
+        self.keepalive_seconds = settings.smb_pool_keepalive_seconds if keepalive_seconds is None else keepalive_seconds
+        self.acquire_timeout = settings.smb_pool_acquire_timeout_seconds if acquire_timeout is None else acquire_timeout
+        self._idle: Dict[str, List[_IdleConnection]] = {}
+        self._open: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._keepalive_thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def connection(self, server_ip: Optional[str] = None) -> Iterator[SMBConnection]:
+        server_ip = server_ip or settings.smb_server_ip
+        conn = self._acquire(server_ip)
+        try:
+            yield conn
+        except OperationFailure:
+            # сервер ответил ошибкой (нет файла, нет прав) — сессия исправна
+            self._release(server_ip, conn)
+            raise
+        except BaseException:
+            # после обрыва или таймаута состояние сессии неизвестно
+            self._discard(server_ip, conn, "error")
+            raise
+        else:
+            self._release(server_ip, conn)
+
+    def _acquire(self, server_ip: str) -> SMBConnection:
+        self._start_keepalive()
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        with self._cond:
+            while True:
+                idle = self._idle.get(server_ip)
+                if idle:
+                    # последняя возвращённая сессия: лишние дольше простаивают и закрываются
+                    entry = idle.pop()
+                    break
+                if self._open.get(server_ip, 0) < self.max_per_server:
+                    self._open[server_ip] = self._open.get(server_ip, 0) + 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"No free SMB connection to {server_ip} in {self.acquire_timeout} s")
+                self._cond.wait(remaining)
+            self._report(server_ip)
+        smb_pool_wait_seconds.observe(time.monotonic() - start)
+
+        if entry is None:
+            return self._connect(server_ip)
+        if time.monotonic() - entry.last_checked > self.keepalive_seconds and not self._alive(entry.conn):
+            self._close(entry.conn)
+            smb_pool_discarded_total.labels(server=server_ip, reason="dead").inc()
+            return self._connect(server_ip)
+        return entry.conn
+
+    def _connect(self, server_ip: str) -> SMBConnection:
+        """Новая сессия на уже занятое место в пуле; при неудаче место освобождается."""
+        try:
+            conn = connect_smb(server_ip)
+        except BaseException:
+            smb_pool_connects_total.labels(server=server_ip, result="failed").inc()
+            with self._cond:
+                self._open[server_ip] -= 1
+                self._report(server_ip)
+                self._cond.notify()
+            raise
+        smb_pool_connects_total.labels(server=server_ip, result="ok").inc()
+        return conn
+
+    def _release(self, server_ip: str, conn: SMBConnection):
+        with self._cond:
+            self._idle.setdefault(server_ip, []).append(_IdleConnection(conn))
+            self._report(server_ip)
+            self._cond.notify()
+
+    def _discard(self, server_ip: str, conn: SMBConnection, reason: str):
+        self._close(conn)
+        smb_pool_discarded_total.labels(server=server_ip, reason=reason).inc()
+        with self._cond:
+            self._open[server_ip] -= 1
+            self._report(server_ip)
+            self._cond.notify()
+
+    def _report(self, server_ip: str):
+        idle = len(self._idle.get(server_ip, ()))
+        smb_pool_connections.labels(server=server_ip, state="idle").set(idle)
+        smb_pool_connections.labels(server=server_ip, state="in_use").set(self._open.get(server_ip, 0) - idle)
+
+    @staticmethod
+    def _alive(conn: SMBConnection) -> bool:
+        try:
+            conn.echo(b"keepalive", timeout=10)
+            return True
+        except Exception as e:
+            logger.debug(f"SMB session failed keepalive: {e}")
+            return False
+
+    @staticmethod
+    def _close(conn: SMBConnection):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Failed to close SMB connection: {e}")
+
+    def _start_keepalive(self):
+        if self._keepalive_thread is not None:
+            return
+        with self._cond:
+            if self._keepalive_thread is None and not self._stop.is_set():
+                self._keepalive_thread = threading.Thread(target=self._keepalive, name="smb-pool-keepalive", daemon=True)
+                self._keepalive_thread.start()
+
+    def _keepalive(self):
+        while not self._stop.wait(self.keepalive_seconds):
+            now = time.monotonic()
+            due = []
+            with self._cond:
+                # проверяемые сессии вынимаются из пула, чтобы их не выдали на время echo
+                for server_ip, idle in self._idle.items():
+                    keep = [entry for entry in idle if now - entry.last_checked < self.keepalive_seconds]
+                    due.extend((server_ip, entry) for entry in idle if now - entry.last_checked >= self.keepalive_seconds)
+                    idle[:] = keep
+            for server_ip, entry in due:
+                if now - entry.last_used >= self.idle_seconds:
+                    self._discard(server_ip, entry.conn, "idle")
+                elif not self._alive(entry.conn):
+                    self._discard(server_ip, entry.conn, "dead")
+                else:
+                    entry.last_checked = time.monotonic()
+                    with self._cond:
+                        self._idle.setdefault(server_ip, []).insert(0, entry)
+                        self._report(server_ip)
+                        self._cond.notify()
+
+    def close(self):
+        """Закрывает простаивающие сессии и останавливает keepalive; занятые закроются при возврате."""
+        self._stop.set()
+        with self._cond:
+            idle = [(server_ip, entry) for server_ip, entries in self._idle.items() for entry in entries]
+            self._idle.clear()
+        for server_ip, entry in idle:
+            self._discard(server_ip, entry.conn, "shutdown")
+
+
+smb_pool = SMBConnectionPool()
+
+
+def smb_relative_path(path: str) -> str:
+    """Путь внутри шары для UNC-пути вида \\\\сервер\\шара\\..."""
+    prefix = f"\\\\{settings.smb_server_ip}\\{settings.smb_share}\\"
+    if path.startswith(prefix):
+        return path[len(prefix):].strip("/\\")
+    return path.strip("/\\")
+
+
+def read_smb_range(conn: SMBConnection, relative_path: str, offset: int, length: int) -> bytes:
+    """Читает length байт файла на SMB начиная с offset."""
+    buf = BytesIO()
+    conn.retrieveFileFromOffset(settings.smb_share, relative_path, buf, offset=offset, max_length=length)
+    return buf.getvalue()
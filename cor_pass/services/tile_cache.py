@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from prometheus_client import Counter, Gauge
+
+from cor_pass.config.config import settings
+
+TILE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+# Тайл по ключу не меняется: другой файл слайда даёт другой хэш и другой ключ
+TILE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Сколько байт с начала и с конца файла входит в отпечаток слайда
+FINGERPRINT_SAMPLE_BYTES = 64 * 1024
+# Не чаще одного обхода каталога кэша за столько секунд
+PRUNE_INTERVAL_SECONDS = 300
+
+svs_tile_cache_requests_total = Counter(
+    "svs_tile_cache_requests_total", "Rendered SVS tile lookups", ["result"]
+)
+svs_tile_cache_memory_bytes = Gauge(
+    "svs_tile_cache_memory_bytes", "Bytes of rendered tiles held in memory"
+)
+
+TileKey = Tuple[str, int, int, int, int, str]
+
+
+def slide_fingerprint(svs_path: str) -> str:
+    """
+    Отпечаток содержимого слайда: размер плюс первые и последние байты файла.
+    Читать весь многогигабайтный SVS ради хэша слишком дорого, а повторно загруженный
+    тот же файл получает новый mtime, поэтому mtime в отпечаток не входит.
+    """
+    size = os.path.getsize(svs_path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(svs_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+        if size > FINGERPRINT_SAMPLE_BYTES:
+            f.seek(max(size - FINGERPRINT_SAMPLE_BYTES, FINGERPRINT_SAMPLE_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def tile_path(cache_dir: str, slide_hash: str, level: int, x: int, y: int, tile_size: int, tile_format: str) -> str:
+    return os.path.join(cache_dir, slide_hash, str(level), f"{x}_{y}_{tile_size}.{tile_format}")
+
+
+class TileCache:
+    """
+    Двухуровневый кэш отрендеренных тайлов: LRU в памяти с лимитом в байтах
+    и файлы на диске в <cache_dir>/<хэш слайда>/<level>/<x>_<y>_<tile_size>.<format>.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        memory_bytes: Optional[int] = None,
+        disk_bytes: Optional[int] = None,
+    ):
+        self.cache_dir = cache_dir or settings.svs_tile_cache_dir
+        self.memory_limit = settings.svs_tile_cache_memory_bytes if memory_bytes is None else memory_bytes
+        self.disk_limit = settings.svs_tile_cache_disk_bytes if disk_bytes is None else disk_bytes
+        self.tiles: "OrderedDict[TileKey, bytes]" = OrderedDict()
+        self.memory_used = 0
+        # (путь, mtime) -> отпечаток, чтобы не читать файл на каждый тайл
+        self.fingerprints: Dict[Tuple[str, int], str] = {}
+        self._lock = threading.Lock()
+        self._pruning = False
+        self._pruned_at: Optional[float] = None
+
+    def slide_hash(self, svs_path: str) -> str:
+        key = (svs_path, os.stat(svs_path).st_mtime_ns)
+        fingerprint = self.fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = slide_fingerprint(svs_path)
+            self.fingerprints = {k: v for k, v in self.fingerprints.items() if k[0] != svs_path}
+            self.fingerprints[key] = fingerprint
+            slide_dir = os.path.join(self.cache_dir, fingerprint)
+            if os.path.isdir(slide_dir):
+                # mtime каталога слайда — время последнего открытия, по нему чистит prune_disk
+                os.utime(slide_dir)
+        return fingerprint
+
+    @staticmethod
+    def etag(key: TileKey) -> str:
+        return '"{}-{}-{}-{}-{}-{}"'.format(*key)
+
+    def _disk_path(self, key: TileKey) -> str:
+        return tile_path(self.cache_dir, *key)
+
+    def get(self, key: TileKey) -> Optional[bytes]:
+        with self._lock:
+            data = self.tiles.get(key)
+            if data is not None:
+                self.tiles.move_to_end(key)
+                svs_tile_cache_requests_total.labels(result="memory").inc()
+                return data
+
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            svs_tile_cache_requests_total.labels(result="miss").inc()
+            return None
+        svs_tile_cache_requests_total.labels(result="disk").inc()
+        self._remember(key, data)
+        return data
+
+    def put(self, key: TileKey, data: bytes):
+        self._remember(key, data)
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # запись через временный файл, чтобы параллельный запрос не прочитал половину тайла
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to store tile {path} on disk: {e}")
+
+    def _remember(self, key: TileKey, data: bytes):
+        if len(data) > self.memory_limit:
+            return
+        with self._lock:
+            previous = self.tiles.pop(key, None)
+            if previous is not None:
+                self.memory_used -= len(previous)
+            self.tiles[key] = data
+            self.memory_used += len(data)
+            while self.memory_used > self.memory_limit:
+                _, evicted = self.tiles.popitem(last=False)
+                self.memory_used -= len(evicted)
+            svs_tile_cache_memory_bytes.set(self.memory_used)
+
+    def schedule_prune(self):
+        """
+        Запускает prune_disk в фоновом потоке, если он не идёт сейчас
+        и прошло больше PRUNE_INTERVAL_SECONDS с прошлого запуска.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._pruning or (self._pruned_at is not None and now - self._pruned_at < PRUNE_INTERVAL_SECONDS):
+                return
+            self._pruning = True
+            self._pruned_at = now
+        threading.Thread(target=self._prune_in_background, name="tile-cache-prune", daemon=True).start()
+
+    def _prune_in_background(self):
+        try:
+            self.prune_disk()
+        except Exception as e:
+            logger.warning(f"Tile cache prune failed: {e}")
+        finally:
+            with self._lock:
+                self._pruning = False
+
+    def prune_disk(self):
+        """
+        Удаляет с диска тайлы слайдов, которые дольше всех не использовались,
+        пока кэш не уложится в svs_tile_cache_disk_bytes. Обход каталога дорогой,
+        поэтому из запросов он вызывается только через schedule_prune.
+        """
+        if not self.disk_limit or not os.path.isdir(self.cache_dir):
+            return
+        slides = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            size = 0
+            for root, _, files in os.walk(entry.path):
+                size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            slides.append((entry.stat().st_mtime, entry.path, size))
+            total += size
+        for _, path, size in sorted(slides):
+            if total <= self.disk_limit:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Pruned tile cache {path} ({size} bytes)")
+
+
+tile_cache = TileCache()
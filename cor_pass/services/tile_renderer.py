@@ -0,0 +1,143 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
+
+from cor_pass.config.config import settings
+from cor_pass.services.slide_cache import slide_cache
+from cor_pass.services.slide_range import ensure_tile
+from cor_pass.services.slide_tiles import encode_tile, read_tile_region
+from cor_pass.services.tile_cache import TileKey
+
+# process — отдельные процессы (обход GIL), thread — отдельный пул потоков
+RENDER_BACKENDS = ("process", "thread")
+# Как часто проверять, не отключился ли клиент, пока тайл ждёт в очереди
+DISCONNECT_POLL_SECONDS = 0.1
+
+svs_tile_renders_total = Counter(
+    "svs_tile_renders_total", "SVS tile render requests", ["result"]
+)
+svs_tile_render_seconds = Histogram(
+    "svs_tile_render_seconds", "Time from submitting a tile render to its result"
+)
+svs_tile_renders_in_flight = Gauge(
+    "svs_tile_renders_in_flight", "Distinct tiles queued or rendering"
+)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def render_tile_job(svs_path: str, level: int, x: int, y: int, tile_size: int, tile_format: str) -> Optional[bytes]:
+    """
+    Рендер одного тайла. В режиме process выполняется в процессе пула,
+    и slide_cache там свой: каждый процесс держит собственные дескрипторы OpenSlide.
+    """
+    # слайд может быть скачан не целиком, см. slide_range
+    ensure_tile(svs_path, level, x, y, tile_size)
+    with slide_cache.open(svs_path) as slide:
+        region = read_tile_region(slide, level, x, y, tile_size)
+    if region is None:
+        return None
+    return encode_tile(region, tile_format)
+
+
+class _RenderJob:
+    def __init__(self, future: Future):
+        self.future = future
+        self.result = asyncio.wrap_future(future)
+        self.waiters = 0
+
+
+class TileRenderer:
+    """
+    Рендер тайлов вне пула потоков Starlette, чтобы панорамирование слайда
+    не занимало потоки остальных синхронных эндпоинтов.
+    Одновременные запросы одного тайла ждут один рендер; если все ждущие клиенты
+    отключились, ещё не начатый рендер снимается с очереди.
+    """
+
+    def __init__(self, backend: Optional[str] = None, workers: Optional[int] = None):
+        self.backend = backend or settings.svs_render_backend
+        if self.backend not in RENDER_BACKENDS:
+            raise ValueError(f"Неизвестный режим рендера: {self.backend}. Допустимые: {', '.join(RENDER_BACKENDS)}")
+        self.workers = workers or settings.svs_render_workers
+        self.jobs: Dict[TileKey, _RenderJob] = {}
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.backend == "process":
+                # spawn: форк процесса с потоками uvicorn небезопасен
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="svs-render")
+        return self._executor
+
+    def _submit(self, key: TileKey, svs_path: str) -> _RenderJob:
+        _, level, x, y, tile_size, tile_format = key
+        job = _RenderJob(self._get_executor().submit(render_tile_job, svs_path, level, x, y, tile_size, tile_format))
+        self.jobs[key] = job
+        svs_tile_renders_in_flight.set(len(self.jobs))
+        job.result.add_done_callback(lambda _: self._forget(key, job))
+        return job
+
+    def _forget(self, key: TileKey, job: _RenderJob):
+        if self.jobs.get(key) is job:
+            del self.jobs[key]
+            svs_tile_renders_in_flight.set(len(self.jobs))
+
+    async def render(self, key: TileKey, svs_path: str, request: Optional[Request] = None) -> Optional[bytes]:
+        """Байты тайла или None, если тайл вне слайда. ClientDisconnected — клиент ушёл, не дождавшись."""
+        job = self.jobs.get(key)
+        if job is None:
+            job = self._submit(key, svs_path)
+            svs_tile_renders_total.labels(result="rendered").inc()
+        else:
+            svs_tile_renders_total.labels(result="deduplicated").inc()
+
+        job.waiters += 1
+        try:
+            with svs_tile_render_seconds.time():
+                return await self._wait(job, request)
+        finally:
+            job.waiters -= 1
+            # никто больше не ждёт: снимаем рендер, если он ещё в очереди
+            if job.waiters == 0 and not job.future.done() and job.future.cancel():
+                # сразу, а не в колбэке job.result: следующий запрос тайла не должен получить отменённый рендер
+                self._forget(key, job)
+                svs_tile_renders_total.labels(result="cancelled").inc()
+
+    async def _wait(self, job: _RenderJob, request: Optional[Request]) -> Optional[bytes]:
+        if request is None:
+            return await asyncio.shield(job.result)
+
+        result = asyncio.ensure_future(asyncio.shield(job.result))
+        disconnect = asyncio.ensure_future(self._wait_disconnect(request))
+        try:
+            await asyncio.wait({result, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if result.done():
+                return result.result()
+            raise ClientDisconnected()
+        finally:
+            disconnect.cancel()
+            result.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(request: Request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+tile_renderer = TileRenderer()
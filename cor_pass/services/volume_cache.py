@@ -0,0 +1,199 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pydicom
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+
+from cor_pass.config.config import settings
+
+# Каталог рядом с загрузкой пользователя: точка в имени — его пропускают чтение и проверка DICOM
+VOLUME_DIR = ".volume"
+VOLUME_FILE = "volume.npy"
+META_FILE = "volume.json"
+LOCK_FILE = ".lock"
+
+# Сколько таблиц окна держит том: у вьюера обычно несколько пресетов окна
+WINDOW_LUT_CACHE_SIZE = 16
+
+# Декодер DICOM: (каталог, путь файла тома) -> метаданные: файл-образец заголовка, наклон и сдвиг
+VolumeDecoder = Callable[[str, str], dict]
+
+dicom_volume_cache_requests_total = Counter(
+    "dicom_volume_cache_requests_total", "DICOM volume cache lookups", ["result"]
+)
+dicom_volume_cache_mapped_bytes = Gauge(
+    "dicom_volume_cache_mapped_bytes", "Bytes of DICOM volumes mapped by this process"
+)
+dicom_volume_build_seconds = Histogram(
+    "dicom_volume_build_seconds", "Time to decode DICOM files into a volume file"
+)
+
+
+class DicomVolume:
+    """
+    Отображённый том в типе исходных пикселей и заголовок без пикселей.
+    Значения в единицах модальности (HU для КТ) — pixel * slope + intercept.
+    """
+
+    def __init__(self, version: Tuple[int, int], volume: np.ndarray, ds: pydicom.Dataset, slope: float, intercept: float):
+        self.version = version
+        self.volume = volume
+        self.ds = ds
+        self.slope = slope
+        self.intercept = intercept
+        self.window_luts: "OrderedDict[Tuple[float, float], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def values(self, img: np.ndarray) -> np.ndarray:
+        """Срез тома в единицах модальности (float32)."""
+        if self.slope == 1 and self.intercept == 0 and img.dtype == np.float32:
+            return img
+        return img.astype(np.float32) * self.slope + self.intercept
+
+    @staticmethod
+    def _window_values(values: np.ndarray, low: float, high: float) -> np.ndarray:
+        values = np.clip(values, low, high)
+        return (((values - low) / (high - low + 1e-5)) * 255).astype(np.uint8)
+
+    def window(self, img: np.ndarray, low: float, high: float, cache: bool = True) -> np.ndarray:
+        """
+        Окно [low, high] в единицах модальности -> uint8.
+        Для 8- и 16-битных томов — один np.take по таблице, построенной по всем значениям пикселя.
+        """
+        if self.volume.dtype.kind not in "iu" or self.volume.dtype.itemsize > 2:
+            return self._window_values(self.values(img), low, high)
+
+        key = (low, high)
+        with self._lock:
+            lut = self.window_luts.get(key)
+            if lut is not None:
+                self.window_luts.move_to_end(key)
+        if lut is None:
+            # все значения пикселя в порядке беззнакового представления, чтобы индексом был сам пиксель
+            raw = np.arange(2 ** (8 * self.volume.dtype.itemsize)).astype(f"u{self.volume.dtype.itemsize}")
+            lut = self._window_values(self.values(raw.view(self.volume.dtype)), low, high)
+            if cache:
+                with self._lock:
+                    self.window_luts[key] = lut
+                    while len(self.window_luts) > WINDOW_LUT_CACHE_SIZE:
+                        self.window_luts.popitem(last=False)
+        return np.take(lut, img.view(f"u{img.dtype.itemsize}"))
+
+    def window_full_range(self, img: np.ndarray) -> np.ndarray:
+        """Растяжение от минимума до максимума среза. Границы у каждого среза свои, таблица не кэшируется."""
+        low, high = sorted(float(v) for v in self.values(np.array([img.min(), img.max()], dtype=img.dtype)))
+        return self.window(img, low, high, cache=False)
+
+
+class VolumeCache:
+    """
+    Тома DICOM, сохранённые один раз в <каталог пользователя>/.volume/volume.npy.
+    Файл отображается в память (mmap), поэтому все воркеры uvicorn делят одни страницы,
+    а после перезапуска том не декодируется заново.
+    Процесс держит отображёнными тома суммарно не больше dicom_volume_cache_bytes,
+    дольше всех не запрошенные отпускаются.
+    Версия тома — inode и mtime volume.json: загрузка удаляет каталог пользователя,
+    и остальные воркеры замечают это по одному stat.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = settings.dicom_volume_cache_bytes if max_bytes is None else max_bytes
+        self.volumes: "OrderedDict[str, DicomVolume]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_dir: str, decode: VolumeDecoder) -> DicomVolume:
+        """Том пользователя (только чтение), при первом запросе декодируется через decode."""
+        volume_dir = os.path.join(user_dir, VOLUME_DIR)
+        meta_path = os.path.join(volume_dir, META_FILE)
+
+        version = self._version(meta_path)
+        with self._lock:
+            mapped = self.volumes.get(user_dir)
+            if mapped is not None and mapped.version == version:
+                self.volumes.move_to_end(user_dir)
+                dicom_volume_cache_requests_total.labels(result="hit").inc()
+                return mapped
+
+        if version is None:
+            version = self._build(user_dir, volume_dir, meta_path, decode)
+        else:
+            dicom_volume_cache_requests_total.labels(result="mapped").inc()
+
+        mapped = self._map(user_dir, volume_dir, meta_path, version)
+        with self._lock:
+            self.volumes[user_dir] = mapped
+            self.volumes.move_to_end(user_dir)
+            self._evict()
+        return mapped
+
+    @staticmethod
+    def _version(meta_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(meta_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _build(self, user_dir: str, volume_dir: str, meta_path: str, decode: VolumeDecoder) -> Tuple[int, int]:
+        os.makedirs(volume_dir, exist_ok=True)
+        with open(os.path.join(volume_dir, LOCK_FILE), "w") as lock:
+            # один декодер на том для всех процессов, остальные ждут готовый файл
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            version = self._version(meta_path)
+            if version is not None:
+                dicom_volume_cache_requests_total.labels(result="mapped").inc()
+                return version
+
+            dicom_volume_cache_requests_total.labels(result="built").inc()
+            with dicom_volume_build_seconds.time():
+                temp_path = os.path.join(volume_dir, f"{VOLUME_FILE}.{os.getpid()}.tmp")
+                try:
+                    # декодер пишет срезы прямо в файл, без копии тома в памяти
+                    meta = decode(user_dir, temp_path)
+                    os.replace(temp_path, os.path.join(volume_dir, VOLUME_FILE))
+                finally:
+                    if os.path.exists(temp_path):
+                        os.unlink(temp_path)
+
+            # volume.json пишется последним: его наличие означает, что том готов
+            temp_meta = f"{meta_path}.{os.getpid()}.tmp"
+            with open(temp_meta, "w") as f:
+                json.dump(meta, f)
+            os.replace(temp_meta, meta_path)
+            logger.info(f"DICOM volume for {user_dir} saved")
+            return self._version(meta_path)
+
+    @staticmethod
+    def _map(user_dir: str, volume_dir: str, meta_path: str, version: Tuple[int, int]) -> DicomVolume:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        volume = np.load(os.path.join(volume_dir, VOLUME_FILE), mmap_mode="r")
+        ds = pydicom.dcmread(os.path.join(user_dir, meta["header"]), force=True, stop_before_pixels=True)
+        # тома без slope в volume.json сохранены в float32 с уже применённым пересчётом
+        return DicomVolume(version, volume, ds, meta.get("slope", 1.0), meta.get("intercept", 0.0))
+
+    def _evict(self):
+        # последний запрошенный том остаётся, даже если сам больше бюджета
+        total = sum(mapped.volume.nbytes for mapped in self.volumes.values())
+        while total > self.max_bytes and len(self.volumes) > 1:
+            user_dir, mapped = self.volumes.popitem(last=False)
+            total -= mapped.volume.nbytes
+            logger.debug(f"Unmapped DICOM volume for {user_dir} ({mapped.volume.nbytes} bytes)")
+        dicom_volume_cache_mapped_bytes.set(total)
+
+    def invalidate(self, user_dir: str):
+        """Сбрасывает том пользователя перед новой загрузкой: и в памяти, и на диске."""
+        with self._lock:
+            self.volumes.pop(user_dir, None)
+            self._evict()
+        shutil.rmtree(os.path.join(user_dir, VOLUME_DIR), ignore_errors=True)
+
+
+volume_cache = VolumeCache()
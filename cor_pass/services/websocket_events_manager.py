@@ -7,6 +7,11 @@ import uuid
 from fastapi import WebSocket, WebSocketDisconnect, status
 import json
 from cor_pass.database.redis_db import redis_client
+from cor_pass.services.cerbo_telemetry import (
+    TELEMETRY_CHANNEL_PATTERN,
+    TELEMETRY_CHANNEL_PREFIX,
+    TelemetrySubscription,
+)
 from fastapi.websockets import WebSocketState
 
 from loguru import logger
@@ -142,8 +147,12 @@ class WebSocketEventsManager:
     async def _listen_pubsub(self):
         pubsub = redis_client.pubsub()
         await pubsub.subscribe("ws:broadcast", f"ws:worker:{self.worker_id}")
+        await pubsub.psubscribe(TELEMETRY_CHANNEL_PATTERN)
 
         async for message in pubsub.listen():
+            if message["type"] == "pmessage":
+                self._dispatch_telemetry(message["channel"], message["data"])
+                continue
             if message["type"] != "message":
                 continue
             try:
@@ -183,9 +192,31 @@ class WebSocketEventsManager:
         logger.info(f"WS connected {connection_id} from {client_ip} with session_id={session_id}")
         return connection_id
 
+    async def subscribe_telemetry(self, connection_id: str, min_interval: float) -> TelemetrySubscription:
+        """Переводит соединение в режим телеметрии: broadcast-события ему больше не отправляются."""
+        conn = self.active_connections[connection_id]
+        subscription = TelemetrySubscription(conn["websocket"], min_interval)
+        conn["telemetry"] = subscription
+        return subscription
+
+    def _dispatch_telemetry(self, channel: str, message: str):
+        """Раздаёт показания объекта локальным подписчикам телеметрии."""
+        object_id = channel[len(TELEMETRY_CHANNEL_PREFIX):]
+        try:
+            data = json.loads(message)
+        except ValueError as e:
+            logger.warning(f"Invalid telemetry message in {channel}: {e}")
+            return
+        for conn in self.active_connections.values():
+            subscription = conn.get("telemetry")
+            if subscription:
+                subscription.offer(object_id, data)
+
     async def disconnect(self, connection_id: str):
         """Отключение WebSocket клиента."""
         conn = self.active_connections.pop(connection_id, None)
+        if conn and conn.get("telemetry"):
+            await conn["telemetry"].close()
         if conn and conn["websocket"].client_state == WebSocketState.CONNECTED:
             await conn["websocket"].close(code=status.WS_1000_NORMAL_CLOSURE)
 
@@ -231,8 +262,8 @@ class WebSocketEventsManager:
         dead_ids = []
 
         for connection_id, conn in self.active_connections.items():
-            if conn["session_id"] is not None:
-                continue  # Пропускаем клиентов с session_id
+            if conn["session_id"] is not None or conn.get("telemetry"):
+                continue  # Пропускаем клиентов с session_id и подписчиков телеметрии
             websocket = conn["websocket"]
             if websocket.client_state != WebSocketState.CONNECTED:
                 dead_ids.append(connection_id)
@@ -0,0 +1,95 @@
+"""
+Нагрузочный тест /api/svs/tile: много клиентов одновременно листают слайд.
+
+Параллельно с тайлами раз в --probe-interval секунд запрашивается --probe-url,
+чтобы видеть, не голодают ли остальные эндпоинты, пока рендерятся тайлы.
+
+    python devops/tile_storm.py --base-url http://localhost:8000 --token <JWT> \\
+        --clients 32 --duration 30 --level 0 --probe-url /api/healthchecker
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(name: str, latencies: List[float], statuses: Dict[int, int], duration: float):
+    print(
+        f"{name}: {len(latencies)} requests, {len(latencies) / duration:.1f} req/s, "
+        f"p50={percentile(latencies, 0.5) * 1000:.1f}ms p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:.1f}ms "
+        f"mean={(statistics.mean(latencies) if latencies else 0) * 1000:.1f}ms statuses={dict(statuses)}"
+    )
+
+
+async def tile_client(client: httpx.AsyncClient, args, deadline: float, latencies: List[float], statuses: Dict[int, int]):
+    # каждый клиент панорамирует от случайной точки, соседние клиенты пересекаются по тайлам
+    x, y = random.randrange(args.grid), random.randrange(args.grid)
+    while time.monotonic() < deadline:
+        x = (x + random.choice((-1, 0, 1))) % args.grid
+        y = (y + random.choice((-1, 0, 1))) % args.grid
+        params = {"level": args.level, "x": x, "y": y, "tile_size": args.tile_size}
+        started = time.monotonic()
+        try:
+            response = await client.get(args.tile_path, params=params, timeout=args.abandon_after)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            latencies.append(time.monotonic() - started)
+        except httpx.TimeoutException:
+            # клиент "ушёл": проверяет отмену рендеров в очереди
+            statuses[0] = statuses.get(0, 0) + 1
+
+
+async def probe_client(client: httpx.AsyncClient, args, deadline: float, latencies: List[float], statuses: Dict[int, int]):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        response = await client.get(args.probe_url)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        latencies.append(time.monotonic() - started)
+        await asyncio.sleep(args.probe_interval)
+
+
+async def main(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.clients + 1)
+    tile_latencies, tile_statuses = [], {}
+    probe_latencies, probe_statuses = [], {}
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits) as client:
+        started = time.monotonic()
+        deadline = started + args.duration
+        tasks = [tile_client(client, args, deadline, tile_latencies, tile_statuses) for _ in range(args.clients)]
+        if args.probe_url:
+            tasks.append(probe_client(client, args, deadline, probe_latencies, probe_statuses))
+        await asyncio.gather(*tasks)
+        duration = time.monotonic() - started
+
+    report("tiles", tile_latencies, tile_statuses, duration)
+    if args.probe_url:
+        report("probe", probe_latencies, probe_statuses, duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile storm load test for /api/svs/tile")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--tile-path", default="/api/svs/tile")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--level", type=int, default=0)
+    parser.add_argument("--grid", type=int, default=40, help="Size of the tile area the clients pan over")
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--abandon-after", type=float, default=5, help="Client timeout, seconds")
+    parser.add_argument("--probe-url", default="")
+    parser.add_argument("--probe-interval", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
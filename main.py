@@ -60,6 +60,9 @@ from cor_pass.routes import (
 )
 from cor_pass.config.config import settings
 from cor_pass.services.ip2_location import initialize_ip2location
+from cor_pass.services.tile_renderer import tile_renderer
+from cor_pass.services.dicom_volume import dicom_decoder
+from cor_pass.services.smb_client import smb_pool
 from loguru import logger
 from cor_pass.services.auth import auth_service
 from fastapi.responses import JSONResponse
@@ -276,6 +279,9 @@ async def startup():
 async def shutdown_event():
     logger.info("------------- SHUTDOWN --------------")
     await close_modbus_client(app)
+    tile_renderer.shutdown()
+    dicom_decoder.shutdown()
+    smb_pool.close()
 
 
 auth_attempts = defaultdict(list)
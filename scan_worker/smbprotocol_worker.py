@@ -1,21 +1,26 @@
 import asyncio
 import enum
-import socket
+import json
+import multiprocessing
 import os
 import re
 import sys
 from datetime import datetime, timedelta
-from smb.SMBConnection import SMBConnection
+from smb.smb_structs import OperationFailure
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, joinedload
 from sqlalchemy.future import select
+from sqlalchemy import or_, update
 from loguru import logger
-from openslide import OpenSlide
 from io import BytesIO
 import tempfile
 import time
 from cor_pass.database.models import Cassette, Glass, Sample 
 from cor_pass.config.config import settings
+from cor_pass.services.slide_tiles import generate_slide_pyramid, render_slide_thumbnail
+from cor_pass.services.smb_client import smb_pool, smb_relative_path
+from concurrent.futures import ProcessPoolExecutor
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 import enum
 
 SMB_USER = settings.smb_user
@@ -26,6 +31,47 @@ REMOTE_NAME = settings.remote_name
 DATABASE_URL = settings.sqlalchemy_database_url
 SCAN_INTERVAL_SECONDS = settings.scan_interval_seconds
 BASE_PATH = settings.base_path
+SCAN_WATERMARK_PATH = settings.scan_watermark_path
+# Папки на шаре, в которых нет сканов стёкол
+SCAN_SKIP_FOLDERS = ["LenaThyroidChile", "test"]
+PREVIEW_SIZE = (512, 512)
+
+scan_glasses_matched_total = Counter(
+    "scan_glasses_matched_total", "Glasses matched to a scan file on SMB"
+)
+scan_preview_jobs_total = Counter(
+    "scan_preview_jobs_total", "Preview jobs finished by the scan worker", ["result"]
+)
+scan_preview_committed_total = Counter(
+    "scan_preview_committed_total", "preview_url values committed to the database"
+)
+scan_preview_downloaded_bytes_total = Counter(
+    "scan_preview_downloaded_bytes_total", "Bytes of SVS files downloaded for previews"
+)
+scan_preview_stage_seconds = Histogram(
+    "scan_preview_stage_seconds", "Time spent in each preview stage", ["stage"]
+)
+scan_preview_queue_depth = Gauge(
+    "scan_preview_queue_depth", "Preview jobs waiting in the queue"
+)
+scan_preview_in_flight = Gauge(
+    "scan_preview_in_flight", "Preview jobs being downloaded, rendered or uploaded"
+)
+scan_preview_pending = Gauge(
+    "scan_preview_pending", "Preview jobs of the current run not finished yet"
+)
+
+_preview_pool = None
+
+
+def _get_preview_pool() -> ProcessPoolExecutor:
+    global _preview_pool
+    if _preview_pool is None:
+        _preview_pool = ProcessPoolExecutor(
+            max_workers=settings.scan_preview_render_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _preview_pool
 
 
 engine = create_async_engine(DATABASE_URL, echo=False)
@@ -104,26 +150,10 @@ async def fetch_file_from_smb(path: str) -> str:
     loop = asyncio.get_running_loop()
 
     def _read_file():
-        conn = SMBConnection(
-            SMB_USER,
-            SMB_PASS,
-            my_name=socket.gethostname(),
-            remote_name=REMOTE_NAME,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        if not conn.connect(SMB_SERVER_IP, 445):
-            raise RuntimeError("Failed to connect to SMB server")
-
-        prefix = f"\\\\{SMB_SERVER_IP}\\{SMB_SHARE}\\"
-        if path.startswith(prefix):
-            relative_path = path[len(prefix):].strip("/\\")
-        else:
-            relative_path = path.strip("/\\")
-
+        relative_path = smb_relative_path(path)
         logger.debug(f"relative_path: {relative_path}")
 
-        try:
+        with smb_pool.connection() as conn:
             file_info = conn.getAttributes(SMB_SHARE, relative_path)
             logger.debug(f"file_info: {file_info}, type: {type(file_info)}")
             filesize = getattr(file_info, "file_size", None)
@@ -139,13 +169,12 @@ async def fetch_file_from_smb(path: str) -> str:
 
                 temp_file.seek(0, os.SEEK_END)
                 file_size = temp_file.tell()
-                logger.debug(f"Total bytes written to temp file: {file_size}")
-                if file_size != filesize:
-                    raise RuntimeError(f"Expected {filesize} bytes, but wrote {file_size} bytes")
-                
-                return temp_file.name
-        finally:
-            conn.close()
+        logger.debug(f"Total bytes written to temp file: {file_size}")
+        if file_size != filesize:
+            os.unlink(temp_file.name)
+            raise RuntimeError(f"Expected {filesize} bytes, but wrote {file_size} bytes")
+
+        return temp_file.name
 
     return await loop.run_in_executor(None, _read_file)
 
@@ -153,30 +182,12 @@ async def save_file_to_smb(data: BytesIO, path: str) -> None:
     loop = asyncio.get_running_loop()
 
     def _write_file():
-        conn = SMBConnection(
-            SMB_USER,
-            SMB_PASS,
-            my_name=socket.gethostname(),
-            remote_name=REMOTE_NAME,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        if not conn.connect(SMB_SERVER_IP, 445):
-            raise RuntimeError("Failed to connect to SMB server")
-
-        prefix = f"\\\\{SMB_SERVER_IP}\\{SMB_SHARE}\\"
-        if path.startswith(prefix):
-            relative_path = path[len(prefix):].strip("/\\")
-        else:
-            relative_path = path.strip("/\\")
-
+        relative_path = smb_relative_path(path)
         logger.debug(f"Saving file to SMB: {relative_path}")
-        try:
+        with smb_pool.connection() as conn:
             data.seek(0)
             conn.storeFile(SMB_SHARE, relative_path, data)
-            logger.debug(f"Successfully saved file to {relative_path}")
-        finally:
-            conn.close()
+        logger.debug(f"Successfully saved file to {relative_path}")
 
     await loop.run_in_executor(None, _write_file)
 
@@ -184,149 +195,262 @@ async def save_file_to_smb_manual(data: BytesIO, path: str) -> None:
     loop = asyncio.get_running_loop()
 
     def _write_file():
-        conn = SMBConnection(
-            SMB_USER,
-            SMB_PASS,
-            my_name=socket.gethostname(),
-            remote_name=REMOTE_NAME,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        if not conn.connect(SMB_SERVER_IP, 445):
-            raise RuntimeError("Failed to connect to SMB server")
-
-        prefix = f"\\\\{SMB_SERVER_IP}\\{SMB_SHARE}\\"
-        if path.startswith(prefix):
-            relative_path = path[len(prefix):].strip("/\\")
-        else:
-            relative_path = path.strip("/\\")
-
+        relative_path = smb_relative_path(path)
         dir_path, filename = os.path.split(relative_path)
 
-        # создаём директории если их нет
-        if dir_path:
-            parts = dir_path.replace("\\", "/").split("/")
-            current = ""
-            for part in parts:
-                current = f"{current}/{part}" if current else part
-                try:
-                    conn.createDirectory(SMB_SHARE, current)
-                except Exception:
-                    # игнорируем, если уже есть
-                    pass
+        with smb_pool.connection() as conn:
+            # создаём директории если их нет
+            if dir_path:
+                parts = dir_path.replace("\\", "/").split("/")
+                current = ""
+                for part in parts:
+                    current = f"{current}/{part}" if current else part
+                    try:
+                        conn.createDirectory(SMB_SHARE, current)
+                    except OperationFailure:
+                        # игнорируем, если уже есть
+                        pass
 
-        try:
             data.seek(0)
             conn.storeFile(SMB_SHARE, relative_path, data)
-        finally:
-            conn.close()
 
     await loop.run_in_executor(None, _write_file)
 
 
-def list_files_in_folder(conn, share, folder_path):
-    files = []
-    # logger.debug(f"Сканируем папку: {share}/{folder_path}")
+def scan_key(info: dict) -> tuple:
+    """Ключ сопоставления файла скана со стеклом."""
+    return (
+        info["case_code"],
+        info["sample"],
+        info["cassette"],
+        info["glass_number"],
+        info["staining"],
+        info["cor_id"],
+    )
+
+
+def load_scan_watermark() -> dict:
     try:
-        entries = conn.listPath(share, folder_path)
-        folder_contents = [entry.filename for entry in entries if entry.filename not in ['.', '..']]
-        # logger.info(f"Содержимое папки {share}/{folder_path}: {folder_contents}")
-        for entry in entries:
-            if entry.filename in [".", ".."]:
-                continue
-            if not entry.isDirectory:
-                files.append(f"{folder_path}/{entry.filename}")
+        with open(SCAN_WATERMARK_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        logger.error(f"Ошибка при сканировании папки {share}/{folder_path}: {str(e)}")
-    return files
-
-def list_files_for_current_date(conn, share, base_path, include_yesterday=True):
-    files = []
+        logger.warning(f"Не удалось прочитать {SCAN_WATERMARK_PATH}, папки будут просканированы заново: {e}")
+        return {}
+
+
+def save_scan_watermark(watermark: dict):
+    temp_path = f"{SCAN_WATERMARK_PATH}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(watermark, f)
+    os.replace(temp_path, SCAN_WATERMARK_PATH)
+
+
+def list_folder_scans(conn, share, folder_path) -> dict:
+    """Имя файла -> ключ scan_key (списком) или None, если имя не разбирается. Каждое имя разбирается один раз."""
+    scans = {}
+    for entry in conn.listPath(share, folder_path):
+        if entry.filename in [".", ".."] or entry.isDirectory:
+            continue
+        info = parse_filename(entry.filename)
+        scans[entry.filename] = list(scan_key(info)) if info else None
+    return scans
+
+
+def build_scan_index(conn, share, base_path, watermark: dict) -> dict:
+    """
+    Индекс scan_key -> путь файла по всем папкам с датами.
+    Папка перечитывается, только если изменилось её время записи; иначе берётся
+    список из watermark, сохранённый с прошлого прохода. watermark обновляется на месте.
+    """
+    base_path_clean = base_path.lstrip("/")
     try:
-        base_path_clean = base_path.lstrip("/")
         entries = conn.listPath(share, base_path_clean)
-        date_folders = [entry.filename for entry in entries if entry.isDirectory and entry.filename not in ['.', '..']]
-        # logger.info(f"Доступные папки с датами в {share}/{base_path_clean}: {date_folders}")
     except Exception as e:
         logger.error(f"Ошибка при получении списка папок в {share}/{base_path_clean}: {str(e)}")
-        return files
+        return {}
+    folders = {
+        entry.filename: entry.last_write_time
+        for entry in entries
+        if entry.isDirectory and entry.filename not in [".", ".."]
+    }
 
+    # свежие папки первыми: при повторном скане стекла берётся файл из них
     current_date = datetime.now().strftime("%Y-%m-%d")
-    if current_date in date_folders:
-        files.extend(list_files_in_folder(conn, share, f"{base_path}/{current_date}".lstrip("/")))
-
-    if include_yesterday:
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-        if yesterday in date_folders:
-            files.extend(list_files_in_folder(conn, share, f"{base_path}/{yesterday}".lstrip("/")))
-
-    for folder in date_folders:
-        if folder not in [current_date, yesterday, 'LenaThyroidChile', 'test']:
-            files.extend(list_files_in_folder(conn, share, f"{base_path}/{folder}".lstrip("/")))
-
-    return files
-
-async def update_scan_urls():
-    def sync_scan():
-        conn = SMBConnection(
-            SMB_USER,
-            SMB_PASS,
-            my_name=socket.gethostname(),
-            remote_name=REMOTE_NAME,
-            use_ntlm_v2=True,
-            is_direct_tcp=True
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    ordered = [folder for folder in (current_date, yesterday) if folder in folders]
+    ordered += [folder for folder in folders if folder not in [current_date, yesterday, *SCAN_SKIP_FOLDERS]]
+
+    index = {}
+    listed = 0
+    seen = {}
+    for folder in ordered:
+        folder_path = f"{base_path}/{folder}".lstrip("/")
+        state = watermark.get(folder)
+        if state is None or state["mtime"] != folders[folder]:
+            try:
+                state = {"mtime": folders[folder], "scans": list_folder_scans(conn, share, folder_path)}
+                listed += 1
+            except Exception as e:
+                # при ошибке остаётся прежний список, папка перечитается на следующем проходе
+                logger.error(f"Ошибка при сканировании папки {share}/{folder_path}: {str(e)}")
+                if state is None:
+                    continue
+                state = dict(state, mtime=None)
+        seen[folder] = state
+        for filename, key in state["scans"].items():
+            if key:
+                index.setdefault(tuple(key), f"{folder_path}/{filename}")
+
+    # удалённые с шары папки забываются
+    watermark.clear()
+    watermark.update(seen)
+    logger.debug(f"SMB: папок {len(ordered)}, перечитано {listed}, сканов в индексе {len(index)}")
+    return index
+
+
+class PreviewJob:
+    def __init__(self, glass_id: str, scan_url: str):
+        self.glass_id = glass_id
+        self.scan_url = scan_url
+        self.preview_path = scan_url.replace('.svs', '.png').replace('.SVS', '.png')
+
+
+class PreviewPipeline:
+    """
+    Превью для новых сканов вне транзакции сопоставления.
+    Задания идут через ограниченную очередь; скачивание и загрузка на SMB ограничены
+    своими семафорами, миниатюры рендерятся в пуле процессов. Готовые preview_url
+    записываются в БД пачками по scan_preview_commit_batch.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.scan_preview_queue_size)
+        self.results: asyncio.Queue = asyncio.Queue()
+        self.download_slots = asyncio.Semaphore(settings.scan_preview_download_concurrency)
+        self.upload_slots = asyncio.Semaphore(settings.scan_preview_upload_concurrency)
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+
+    async def run(self, jobs):
+        self.total = len(jobs)
+        scan_preview_pending.set(self.total)
+        started = time.monotonic()
+        workers = [asyncio.create_task(self._worker()) for _ in range(settings.scan_preview_workers)]
+        committer = asyncio.create_task(self._commit_results())
+        try:
+            for job in jobs:
+                await self.queue.put(job)
+                scan_preview_queue_depth.set(self.queue.qsize())
+            await self.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.results.put(None)
+            await committer
+            scan_preview_pending.set(0)
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Превью: готово {self.done}, ошибок {self.failed} из {self.total} за {elapsed:.0f} с "
+            f"({self.done / elapsed * 60 if elapsed else 0:.1f} в минуту)"
         )
-        logger.debug(f"Попытка подключения к SMB-серверу: {SMB_SERVER_IP}, share: {SMB_SHARE}, remote_name: {REMOTE_NAME}")
-        connected = conn.connect(SMB_SERVER_IP, 445)
-        if not connected:
-            raise RuntimeError("Не удалось подключиться к SMB-серверу")
-        logger.info("Успешно подключились к SMB-серверу")
 
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            scan_preview_queue_depth.set(self.queue.qsize())
+            scan_preview_in_flight.inc()
+            try:
+                await self._process(job)
+                self.done += 1
+                scan_preview_jobs_total.labels(result="done").inc()
+                await self.results.put(job)
+            except Exception as e:
+                self.failed += 1
+                scan_preview_jobs_total.labels(result="failed").inc()
+                logger.error(f"Ошибка при генерации или сохранении превью для {job.scan_url}: {str(e)}")
+            finally:
+                scan_preview_in_flight.dec()
+                scan_preview_pending.set(self.total - self.done - self.failed)
+                self.queue.task_done()
+
+    async def _process(self, job: PreviewJob):
+        loop = asyncio.get_running_loop()
+        async with self.download_slots:
+            with scan_preview_stage_seconds.labels(stage="download").time():
+                temp_file_path = await fetch_file_from_smb(job.scan_url)
         try:
-            shares = conn.listShares()
-        except Exception as e:
-            logger.error(f"Ошибка при получении списка шар: {str(e)}")
+            scan_preview_downloaded_bytes_total.inc(os.path.getsize(temp_file_path))
+            with scan_preview_stage_seconds.labels(stage="render").time():
+                png = await loop.run_in_executor(_get_preview_pool(), render_slide_thumbnail, temp_file_path, PREVIEW_SIZE)
+            async with self.upload_slots:
+                with scan_preview_stage_seconds.labels(stage="upload").time():
+                    await save_file_to_smb(BytesIO(png), job.preview_path)
+            logger.debug(f"[OK] Стекло {job.glass_id} → preview_url: {job.preview_path} ({self.done + self.failed + 1}/{self.total})")
+
+            if settings.svs_pyramid_enabled:
+                # слайд уже скачан ради превью, заодно готовим тайлы для /svs/tile
+                try:
+                    await generate_slide_pyramid(temp_file_path)
+                except Exception as e:
+                    logger.error(f"Ошибка при генерации пирамиды тайлов для {job.scan_url}: {str(e)}")
+        finally:
+            if os.path.exists(temp_file_path):
+                os.unlink(temp_file_path)
+                logger.debug(f"Temporary file {temp_file_path} deleted")
 
+    async def _commit_results(self):
+        batch = []
+        while True:
+            try:
+                job = await asyncio.wait_for(self.results.get(), timeout=settings.scan_preview_commit_seconds)
+            except asyncio.TimeoutError:
+                await self._commit(batch)
+                continue
+            if job is None:
+                await self._commit(batch)
+                return
+            batch.append(job)
+            if len(batch) >= settings.scan_preview_commit_batch:
+                await self._commit(batch)
+
+    @staticmethod
+    async def _commit(batch):
+        if not batch:
+            return
         try:
-            root_entries = conn.listPath(SMB_SHARE, "")
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(Glass), [{"id": job.glass_id, "preview_url": job.preview_path} for job in batch]
+                )
+                await session.commit()
+            scan_preview_committed_total.inc(len(batch))
         except Exception as e:
-            logger.error(f"Ошибка при сканировании корня шары {SMB_SHARE}: {str(e)}")
+            # превью уже на SMB; стёкла остались без preview_url и попадут в следующий проход
+            logger.error(f"Не удалось сохранить preview_url для {len(batch)} стёкол: {str(e)}")
+        batch.clear()
 
-        path_parts = BASE_PATH.lstrip("/").split("/")
-        current_path = ""
-        for part in path_parts:
-            current_path = f"{current_path}/{part}".lstrip("/")
-            # logger.debug(f"Проверка папки: {SMB_SHARE}/{current_path}")
-            try:
-                entries = conn.listPath(SMB_SHARE, current_path)
-                # logger.info(f"Содержимое папки {SMB_SHARE}/{current_path}: {[entry.filename for entry in entries if entry.filename not in ['.', '..']]}")
-                for entry in entries:
-                    if entry.filename in [".", ".."]:
-                        continue
-                    # logger.debug(f"Права для {entry.filename}: isDirectory={entry.isDirectory}, read={entry.isReadOnly is False}")
-            except Exception as e:
-                logger.error(f"Ошибка при сканировании папки {SMB_SHARE}/{current_path}: {str(e)}")
-                if "Unable to open directory" in str(e):
-                    logger.warning(f"Папка {SMB_SHARE}/{current_path} не существует или недоступна")
 
-        try:
-            scanner_entries = conn.listPath("scanner", "")
-        except Exception as e:
-            logger.error(f"Ошибка при сканировании корня шары scanner: {str(e)}")
+async def update_scan_urls():
+    watermark = load_scan_watermark()
 
-        files = list_files_for_current_date(conn, SMB_SHARE, BASE_PATH, include_yesterday=True)
-        conn.close()
-        return files
+    def sync_scan():
+        logger.debug(f"Обход SMB-сервера: {SMB_SERVER_IP}, share: {SMB_SHARE}, remote_name: {REMOTE_NAME}")
+        with smb_pool.connection() as conn:
+            return build_scan_index(conn, SMB_SHARE, BASE_PATH, watermark)
 
-    smb_files = await asyncio.to_thread(sync_scan)
-    for file in smb_files:
-        pass
-        # logger.debug(f"Обнаружен файл: {file}")
+    scan_index = await asyncio.to_thread(sync_scan)
+    save_scan_watermark(watermark)
 
     async with AsyncSessionLocal() as session:
         try:
             result = await session.execute(
                 select(Glass)
+                .where(or_(Glass.scan_url.is_(None), Glass.preview_url.is_(None)))
                 .options(
                     joinedload(Glass.cassette)
                     .joinedload(Cassette.sample)
@@ -339,13 +463,8 @@ async def update_scan_urls():
             raise
 
         updated = 0
-        skipped = 0
+        jobs = []
         for glass in glasses:
-            if glass.scan_url and glass.preview_url:
-                skipped += 1
-                # logger.debug(f"[SKIP] Стекло {glass.id} уже имеет scan_url: {glass.scan_url} и preview_url: {glass.preview_url}")
-                continue
-
             case_code = glass.cassette.sample.case.case_code
             sample_number = glass.cassette.sample.sample_number
             cassette_number = glass.cassette.cassette_number
@@ -353,59 +472,27 @@ async def update_scan_urls():
             staining = glass.staining.abbr() if glass.staining else None
             cor_id = glass.cassette.sample.case.patient_id
 
-            # logger.debug(f"Проверяем стекло {glass.id}: case_code={case_code}, sample={sample_number}, cassette={cassette_number}, glass_number={glass_number}, staining={staining}, cor_id={cor_id}")
+            # Учитываем, что cassette_number в базе данных может быть длиннее, но нам нужна только последняя буква + цифра
+            cassette_last = cassette_number[-2:] if cassette_number and len(cassette_number) >= 2 else None
 
-            for file in smb_files:
-                info = parse_filename(file)
-                if not info:
-                    continue
+            file = scan_index.get((case_code, sample_number, cassette_last, glass_number, staining, cor_id))
+            if file is None:
+                continue
 
-                # Учитываем, что cassette_number в базе данных может быть длиннее, но нам нужна только последняя буква + цифра
-                cassette_last = cassette_number[-2:] if cassette_number and len(cassette_number) >= 2 else None
-
-                # logger.debug(f"Сравниваем с файлом {file}: {info}")
-
-                if (
-                    info["case_code"] == case_code and
-                    info["sample"] == sample_number and
-                    info["cassette"] == cassette_last and
-                    info["glass_number"] == glass_number and
-                    info["staining"] == staining and
-                    info["cor_id"] == cor_id
-                ):
-                    if file.lower().endswith('.svs'):
-                        scan_url = f"\\\\{SMB_SERVER_IP}\\{SMB_SHARE}\\{file}"
-                        glass.scan_url = scan_url
-                        logger.debug(f"[OK] Стекло {glass.id} → scan_url: {scan_url}")
-
-                        if not glass.preview_url:
-                            try:
-                                temp_file_path = await fetch_file_from_smb(scan_url)
-                                try:
-                                    start_time = time.time()
-                                    slide = OpenSlide(temp_file_path)
-                                    logger.debug(f"Time to open slide: {time.time() - start_time} seconds")
-                                    preview = slide.get_thumbnail((512, 512))
-                                    buf = BytesIO()
-                                    preview.save(buf, format="PNG")
-                                    buf.seek(0)
-                                    preview_path = scan_url.replace('.svs', '.png').replace('.SVS', '.png')
-                                    await save_file_to_smb(buf, preview_path)
-                                    glass.preview_url = preview_path
-                                    logger.debug(f"[OK] Стекло {glass.id} → preview_url: {preview_path}")
-                                finally:
-                                    if os.path.exists(temp_file_path):
-                                        os.unlink(temp_file_path)
-                                        logger.debug(f"Temporary file {temp_file_path} deleted")
-                            except Exception as e:
-                                logger.error(f"Ошибка при генерации или сохранении превью для {file}: {str(e)}")
-                                continue
-
-                        updated += 1
-                        break
+            scan_url = f"\\\\{SMB_SERVER_IP}\\{SMB_SHARE}\\{file}"
+            glass.scan_url = scan_url
+            updated += 1
+            scan_glasses_matched_total.inc()
+            logger.debug(f"[OK] Стекло {glass.id} → scan_url: {scan_url}")
+            if not glass.preview_url:
+                jobs.append(PreviewJob(glass.id, scan_url))
 
+        # scan_url сохраняется сразу, превью дописываются пачками по мере готовности
         await session.commit()
-        # logger.info(f"Обновлено {updated} записей, пропущено {skipped} записей")
+        logger.info(f"Стёкол без скана или превью: {len(glasses)}, найдено сканов {updated}, превью в очереди {len(jobs)}")
+
+    if jobs:
+        await PreviewPipeline().run(jobs)
 
 async def main():
     while True:
@@ -419,4 +506,6 @@ async def main():
 if __name__ == "__main__":
     if settings.app_env in ["development", "lab-neuro"]:
         if settings.smb_enabled:
+            if settings.scan_worker_metrics_port:
+                start_http_server(settings.scan_worker_metrics_port)
             asyncio.run(main())
\ No newline at end of file
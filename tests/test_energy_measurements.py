@@ -0,0 +1,107 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from cor_pass.database.models import Base, CerboMeasurement, EnergeticObject
+from cor_pass.repository.cerbo_service import get_energy_measurements_service
+
+# Отдельная база PostgreSQL для теста (postgresql+asyncpg://...), таблицы создаются в своей схеме
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+TEST_SCHEMA = "test_energy_measurements"
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+PERIOD_START = datetime(2026, 1, 1)
+PERIOD_END = PERIOD_START + timedelta(hours=6)
+# объект -> (чётность секунды измерений, пропуски в данных)
+OBJECTS = {
+    "house": (0, [(timedelta(minutes=50), timedelta(minutes=100))]),
+    "office": (1, [(timedelta(hours=3), timedelta(hours=3, minutes=20)), (timedelta(hours=5, minutes=2), timedelta(hours=5, minutes=4))]),
+}
+INTERVALS = [5, 7, 30, 60]
+
+
+def make_measurements(object_id: str, object_name: str, parity: int, gaps) -> list:
+    # Секунды измерений разных объектов не совпадают: при равном measured_at порядок строк
+    # в выборке по всем объектам не определён ни в SQL, ни в Python
+    rng = random.Random(object_name)
+    measurements = []
+    offset = timedelta(seconds=parity)
+    while offset < PERIOD_END - PERIOD_START:
+        if not any(start <= offset < end for start, end in gaps):
+            index = len(measurements)
+            measurements.append(CerboMeasurement(
+                energetic_object_id=object_id,
+                object_name=object_name,
+                measured_at=PERIOD_START + offset,
+                general_battery_power=round(rng.uniform(-3000, 3000), 1),
+                inverter_total_ac_output=round(rng.uniform(0, 5000), 1),
+                # сеть попеременно отдаёт и принимает энергию
+                ess_total_input_power=round(rng.uniform(-4000, 4000), 1),
+                solar_total_pv_power=round(rng.uniform(0, 6000), 1),
+                soc=None if index % 5 == 0 else round(rng.uniform(20, 100), 1),
+            ))
+        offset += timedelta(seconds=2 * rng.randint(10, 40))
+    if parity == 0:
+        # измерение ровно на конце периода входит только в итоги
+        measurements.append(CerboMeasurement(
+            energetic_object_id=object_id,
+            object_name=object_name,
+            measured_at=PERIOD_END,
+            general_battery_power=100.0,
+            inverter_total_ac_output=100.0,
+            ess_total_input_power=-100.0,
+            solar_total_pv_power=100.0,
+            soc=None,
+        ))
+    return measurements
+
+
+async def with_measurements(check):
+    engine = create_async_engine(TEST_DATABASE_URL, connect_args={"server_settings": {"search_path": TEST_SCHEMA}})
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {TEST_SCHEMA}"))
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(text("CREATE TABLE cerbo_measurements_default PARTITION OF cerbo_measurements DEFAULT"))
+
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            for object_name, (parity, gaps) in OBJECTS.items():
+                energetic_object = EnergeticObject(id=f"object-{object_name}", name=object_name)
+                db.add(energetic_object)
+                db.add_all(make_measurements(energetic_object.id, object_name, parity, gaps))
+            await db.commit()
+            await check(db)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+def test_sql_matches_python_energy_calculation():
+    async def check(db):
+        for object_name in [None, *OBJECTS]:
+            for interval_minutes in INTERVALS:
+                # границы периода не ровные: оба пути округляют их одинаково
+                kwargs = dict(
+                    object_name=object_name,
+                    start_date=PERIOD_START + timedelta(minutes=10),
+                    end_date=PERIOD_END - timedelta(minutes=30),
+                    interval_minutes=interval_minutes,
+                )
+                expected = await get_energy_measurements_service(db, method="python", **kwargs)
+                actual = await get_energy_measurements_service(db, method="sql", **kwargs)
+                assert actual == expected, (object_name, interval_minutes)
+
+                if object_name and interval_minutes == 5:
+                    counts = [interval["measurement_count"] for interval in expected["intervals"]]
+                    # в фикстуре есть интервалы без данных и интервалы с данными
+                    assert 0 in counts and max(counts) >= 3, object_name
+
+    asyncio.run(with_measurements(check))
@@ -0,0 +1,56 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from cor_pass.schemas import FullDeviceMeasurementCreate
+from worker import ingest_buffer
+from worker.ingest_buffer import MeasurementIngestBuffer
+
+
+def make_row(index: int) -> FullDeviceMeasurementCreate:
+    return FullDeviceMeasurementCreate(
+        measured_at=datetime(2026, 1, 1) + timedelta(seconds=index),
+        object_name="test",
+        energetic_object_id="object-1",
+        general_battery_power=float(index),
+        inverter_total_ac_output=0.0,
+        ess_total_input_power=0.0,
+        solar_total_pv_power=0.0,
+        soc=50.0,
+    )
+
+
+def test_stop_during_collection_keeps_every_row(tmp_path, monkeypatch):
+    stored = []
+
+    @asynccontextmanager
+    async def session_maker():
+        yield None
+
+    async def bulk_insert(db, batch):
+        stored.extend(row.general_battery_power for row in batch)
+
+    monkeypatch.setattr(ingest_buffer, "async_session_maker", session_maker)
+    monkeypatch.setattr(ingest_buffer, "create_full_device_measurements_bulk", bulk_insert)
+    spool_path = tmp_path / "spool.jsonl"
+
+    async def scenario():
+        # пачка не наберётся и не истечёт по времени: stop() застаёт цикл в сборе пачки
+        buffer = MeasurementIngestBuffer(batch_size=100, flush_seconds=60, spool_path=str(spool_path))
+        await buffer.start()
+        for index in range(5):
+            await buffer.put(make_row(index))
+        await asyncio.sleep(0.05)
+        assert buffer.queue.empty()
+        for index in range(5, 8):
+            await buffer.put(make_row(index))
+        await buffer.stop()
+
+    # stop() не должен ждать flush_seconds
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    spooled = []
+    if spool_path.exists():
+        spooled = [json.loads(line)["general_battery_power"] for line in spool_path.read_text().splitlines()]
+    assert sorted(stored + spooled) == [float(index) for index in range(8)]
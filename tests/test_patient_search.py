@@ -0,0 +1,116 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from cor_pass.database.models import Base, Patient
+from cor_pass.repository.patient import find_patient, search_patients
+from cor_pass.services.search_token_generator import generate_ngrams, get_patient_search_tokens
+
+# Отдельная база PostgreSQL для теста (postgresql+asyncpg://...), таблицы создаются в своей схеме
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+TEST_SCHEMA = "test_patient_search"
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+PATIENTS = [
+    ("Иванов", "Иван", "Иванович"),
+    ("Иванова", "Мария", "Петровна"),
+    ("Петров", "Пётр", None),
+    ("Петренко", "Ольга", "Ивановна"),
+    ("Сидорова", "Анна", None),
+    ("Smith", "John", None),
+    ("Johnson", "Anne", None),
+    ("Ivanenko", "Anna", "Olegovna"),
+]
+
+QUERIES = ["иванов", "иванова мария", "петр", "анна", "ann", "johns", "smit", "ivan", "ан", "jo"]
+
+# совпадает с "John" только по биграмме "hn": триграмм запроса нет ни у одного пациента
+TYPO_QUERY = "jxhn"
+
+
+def query_ngrams(query: str) -> List[str]:
+    # так же, как строит запрос маршрут поиска врача
+    ngrams = generate_ngrams(query, n=2)
+    ngrams.extend(generate_ngrams(query, n=3))
+    return sorted(set(ngrams))
+
+
+def substring_scores(patients: Dict[str, str], ngrams: List[str]) -> Dict[str, int]:
+    """Прежний поиск: кандидаты по ILIKE '%ngram%', счёт — число н-грамм, входящих в search_tokens."""
+    scores = {}
+    for patient_id, search_tokens in patients.items():
+        score = sum(1 for ngram in ngrams if ngram in search_tokens)
+        if score:
+            scores[patient_id] = score
+    return scores
+
+
+def substring_best(patients: Dict[str, str], ngrams: List[str]) -> Optional[int]:
+    scores = substring_scores(patients, ngrams)
+    return max(scores.values()) if scores else None
+
+
+async def with_patients(check):
+    engine = create_async_engine(TEST_DATABASE_URL, connect_args={"server_settings": {"search_path": TEST_SCHEMA}})
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {TEST_SCHEMA}"))
+            await conn.run_sync(Base.metadata.create_all)
+
+        patients = {}
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            for index, (surname, first_name, middle_name) in enumerate(PATIENTS):
+                patient = Patient(
+                    id=f"patient-{index}",
+                    patient_cor_id=f"cor-{index}",
+                    search_tokens=get_patient_search_tokens(first_name, surname, middle_name),
+                )
+                db.add(patient)
+                patients[patient.id] = patient.search_tokens
+            await db.commit()
+            await check(db, patients)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+def test_sql_ranking_matches_substring_scorer():
+    async def check(db, patients):
+        for query in QUERIES:
+            ngrams = query_ngrams(query)
+            expected = substring_scores(patients, ngrams)
+            trigrams = [ngram for ngram in ngrams if len(ngram) >= 3]
+            if trigrams:
+                # кандидаты теперь только пациенты хотя бы с одной триграммой запроса
+                expected = {
+                    patient_id: score for patient_id, score in expected.items()
+                    if any(ngram in patients[patient_id].split(" ") for ngram in trigrams)
+                }
+
+            matches = await search_patients(db, ngrams, limit=len(PATIENTS))
+            found = {patient.id: score for patient, score in matches}
+            assert found == expected, query
+            assert [score for _, score in matches] == sorted(found.values(), reverse=True), query
+
+            best = await find_patient(db, " ".join(ngrams))
+            assert best is not None, query
+            assert expected[best.id] == substring_best(patients, ngrams), query
+
+    asyncio.run(with_patients(check))
+
+
+def test_bigram_only_match_is_not_found():
+    async def check(db, patients):
+        ngrams = query_ngrams(TYPO_QUERY)
+        # прежний поиск находил пациента по одной биграмме
+        assert substring_best(patients, ngrams) == 1
+        assert await find_patient(db, " ".join(ngrams)) is None
+
+    asyncio.run(with_patients(check))
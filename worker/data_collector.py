@@ -10,11 +10,15 @@ from worker.modbus_client import (
     ESS_UNIT_ID,
     SOLAR_CHARGER_SLAVE_IDS,
     REGISTERS,
+    INVERTER_REGISTERS,
+    ESS_AC_REGISTERS,
+    SOLAR_CHARGER_PV_POWER_REGISTER,
     decode_signed_16,
     decode_signed_32,
     register_modbus_error, 
    
 )
+from worker.polling_engine import INPUT_TABLE, HOLDING_TABLE, RegisterSnapshot
 
 async def collect_battery_data(
     modbus_client: AsyncModbusTcpClient, transaction_id: UUID
@@ -114,20 +118,26 @@ async def collect_inverter_power_data(
         raise
 
 
+def decode_ess_ac_value(reg_name: str, value: int) -> float:
+    """Масштабирует сырое значение AC-регистра ESS по типу величины."""
+    if "voltage" in reg_name:
+        return round(value / 10.0, 2)
+    if "current" in reg_name:
+        return round(decode_signed_16(value) / 10.0, 2)
+    if "frequency" in reg_name:
+        return round(decode_signed_16(value) / 100.0, 2)
+    if "power" in reg_name:
+        return round(decode_signed_16(value) * 10, 2)
+    return value
+
+
 async def collect_ess_ac_data(
     modbus_client: AsyncModbusTcpClient, transaction_id: UUID 
 ) -> Dict[str, Any]:
     """Собирает AC-данные с ESS."""
     try:
         slave = ESS_UNIT_ID
-        registers_map = {
-            3: "input_voltage_l1", 4: "input_voltage_l2", 5: "input_voltage_l3",
-            6: "input_current_l1", 7: "input_current_l2", 8: "input_current_l3",
-            9: "input_frequency_l1", 10: "input_frequency_l2", 11: "input_frequency_l3",
-            12: "input_power_l1", 13: "input_power_l2", 14: "input_power_l3",
-            15: "output_voltage_l1", 16: "output_voltage_l2", 17: "output_voltage_l3",
-            18: "output_current_l1", 19: "output_current_l2", 20: "output_current_l3",
-        }
+        registers_map = ESS_AC_REGISTERS
         start = min(registers_map.keys())
         count = max(registers_map.keys()) - start + 1
 
@@ -144,17 +154,7 @@ async def collect_ess_ac_data(
         raw = result.registers
         collected_values = {}
         for reg_address, reg_name in registers_map.items():
-            value = raw[reg_address - start]
-            if "voltage" in reg_name:
-                collected_values[reg_name] = round(value / 10.0, 2)
-            elif "current" in reg_name:
-                collected_values[reg_name] = round(decode_signed_16(value) / 10.0, 2)
-            elif "frequency" in reg_name:
-                collected_values[reg_name] = round(decode_signed_16(value) / 100.0, 2)
-            elif "power" in reg_name:
-                collected_values[reg_name] = round(decode_signed_16(value) * 10, 2)
-            else:
-                collected_values[reg_name] = value
+            collected_values[reg_name] = decode_ess_ac_value(reg_name, raw[reg_address - start])
 
         total_input_power = round(
             collected_values["input_power_l1"]
@@ -231,6 +231,76 @@ async def get_battery_status(modbus_client: AsyncModbusTcpClient, transaction_id
         raise HTTPException(status_code=500, detail="Modbus ошибка")
 
 
+def decode_battery_data(snapshot: RegisterSnapshot) -> Dict[str, Any]:
+    """Данные батареи (включая SOC) из регистров, прочитанных движком опроса."""
+
+    def get_value(name: str) -> int:
+        return snapshot[(BATTERY_ID, INPUT_TABLE, REGISTERS[name])]
+
+    voltage = get_value("voltage") / 100
+    current = decode_signed_16(get_value("current")) / 10
+    soc = get_value("soc") / 10
+
+    return {
+        "battery_voltage": voltage,
+        "battery_current": current,
+        "battery_soc": soc,
+        "battery_temperature": get_value("temperature") / 10,
+        "battery_power_reg": decode_signed_16(get_value("power")),
+        "battery_soh": get_value("soh") / 10,
+        "general_battery_power": round(voltage * current, 2),
+        "soc": soc,
+    }
+
+
+def decode_inverter_power_data(snapshot: RegisterSnapshot) -> Dict[str, Any]:
+    """Мощность инвертора из регистров, прочитанных движком опроса."""
+
+    def get_value(name: str) -> int:
+        address = INVERTER_REGISTERS[name]
+        return decode_signed_32(
+            snapshot[(INVERTER_ID, HOLDING_TABLE, address)],
+            snapshot[(INVERTER_ID, HOLDING_TABLE, address + 1)],
+        )
+
+    ac_output_l1 = get_value("output_power_l1")
+    ac_output_l2 = get_value("output_power_l2")
+    ac_output_l3 = get_value("output_power_l3")
+
+    return {
+        "inverter_dc_power": get_value("inverter_power"),
+        "inverter_ac_output_l1": ac_output_l1,
+        "inverter_ac_output_l2": ac_output_l2,
+        "inverter_ac_output_l3": ac_output_l3,
+        "inverter_total_ac_output": round(ac_output_l1 + ac_output_l2 + ac_output_l3, 2),
+    }
+
+
+def decode_ess_ac_data(snapshot: RegisterSnapshot) -> Dict[str, Any]:
+    """AC-данные ESS из регистров, прочитанных движком опроса."""
+    collected_values = {
+        reg_name: decode_ess_ac_value(reg_name, snapshot[(ESS_UNIT_ID, INPUT_TABLE, reg_address)])
+        for reg_address, reg_name in ESS_AC_REGISTERS.items()
+    }
+    collected_values["ess_total_input_power"] = round(
+        collected_values["input_power_l1"]
+        + collected_values["input_power_l2"]
+        + collected_values["input_power_l3"],
+        2,
+    )
+    return collected_values
+
+
+def decode_solarchargers_power_sum(snapshot: RegisterSnapshot) -> Dict[str, Any]:
+    """Сумма регистров 3730 по всем MPPT, ответившим в этом цикле."""
+    total_power = 0
+    for slave in SOLAR_CHARGER_SLAVE_IDS:
+        value = snapshot.get((slave, INPUT_TABLE, SOLAR_CHARGER_PV_POWER_REGISTER))
+        if value is not None:
+            total_power += value
+    return {"solar_total_pv_power": total_power}
+
+
 async def read_grid_feed_w(modbus_client: AsyncModbusTcpClient) -> Optional[int]: 
     """Чтение текущего значения AC Power Setpoint Fine."""
     try:
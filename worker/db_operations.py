@@ -1,8 +1,10 @@
 from datetime import datetime, timedelta
 from typing import List, Optional, Tuple
-from sqlalchemy import delete, func, select, update
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from cor_pass.database.models import CerboMeasurement, EnergeticSchedule
+from cor_pass.repository.cerbo_pagination import fetch_measurement_page
+from cor_pass.repository.cerbo_rollup import mark_late_measurements
 from cor_pass.schemas import (
     EnergeticScheduleBase,
     EnergeticScheduleCreate,
@@ -27,39 +29,42 @@ async def create_full_device_measurement(
         raise
 
 
+async def create_full_device_measurements_bulk(
+    db: AsyncSession, rows: List[FullDeviceMeasurementCreate]
+) -> int:
+    """
+    Сохраняет пачку измерений одним multi-row INSERT без повторного чтения строк.
+    Измерения старше окна пересчёта агрегатов (например, из spool) отмечаются для пересчёта в той же транзакции.
+    """
+    if not rows:
+        return 0
+    await db.execute(insert(CerboMeasurement), [row.model_dump() for row in rows])
+    await mark_late_measurements(db, rows)
+    await db.commit()
+    return len(rows)
+
+
 async def get_device_measurements_paginated(
     db: AsyncSession,
-    page: int = 1,
     page_size: int = 10,
+    cursor: Optional[str] = None,
     object_id: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-) -> Tuple[List[CerboMeasurement], int]:
-    """Получает записи CerboMeasurement с пагинацией, фильтруя по объекту."""
+) -> Tuple[List[CerboMeasurement], Optional[str]]:
+    """Получает записи CerboMeasurement с keyset-пагинацией, фильтруя по объекту."""
     query = select(CerboMeasurement)
-    count_query = select(func.count()).select_from(CerboMeasurement)
 
     if object_id:
         query = query.where(CerboMeasurement.object_name == object_id)
-        count_query = count_query.where(CerboMeasurement.object_name == object_id)
 
     if start_date:
         query = query.where(CerboMeasurement.measured_at >= start_date)
-        count_query = count_query.where(CerboMeasurement.measured_at >= start_date)
 
     if end_date:
         query = query.where(CerboMeasurement.measured_at <= end_date)
-        count_query = count_query.where(CerboMeasurement.measured_at <= end_date)
-
-    offset = (page - 1) * page_size
-    query = query.offset(offset).limit(page_size).order_by(CerboMeasurement.measured_at.desc())
-
-    result = await db.execute(query)
-    measurements = result.scalars().all()
 
-    total_count_result = await db.execute(count_query)
-    total_count = total_count_result.scalar_one()
-    return measurements, total_count
+    return await fetch_measurement_page(db, query, page_size, cursor)
 
 
 async def create_schedule(
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+from typing import List, Optional
+
+from loguru import logger
+
+from cor_pass.config.config import settings
+from cor_pass.database.db import async_session_maker
+from cor_pass.schemas import FullDeviceMeasurementCreate
+from worker.db_operations import create_full_device_measurements_bulk
+
+
+class MeasurementIngestBuffer:
+    """
+    Буфер измерений для всех задач сбора.
+    Строки накапливаются в ограниченной очереди и сохраняются пачками,
+    когда набирается batch_size строк или проходит flush_seconds.
+    Если очередь заполнена, put() ждёт (backpressure на задачи сбора).
+    Строки, которые не удалось сохранить, дописываются в локальный spool-файл
+    и повторно загружаются при следующем запуске.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_seconds: Optional[float] = None,
+        spool_path: Optional[str] = None,
+    ):
+        self.queue: asyncio.Queue[FullDeviceMeasurementCreate] = asyncio.Queue(
+            maxsize=max_queue_size or settings.measurement_ingest_queue_size
+        )
+        self.batch_size = batch_size or settings.measurement_ingest_batch_size
+        self.flush_seconds = flush_seconds or settings.measurement_ingest_flush_seconds
+        self.spool_path = spool_path or settings.measurement_spool_path
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.flushed_rows = 0
+        self.spooled_rows = 0
+
+    async def start(self):
+        if self._flush_task:
+            return
+        await self._replay_spool()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(
+            f"Measurement ingest buffer started (batch={self.batch_size}, "
+            f"flush={self.flush_seconds}s, queue={self.queue.maxsize})"
+        )
+
+    async def put(self, row: FullDeviceMeasurementCreate):
+        """Добавляет измерение в буфер. Ждёт, если очередь заполнена."""
+        if self.queue.full():
+            logger.warning(f"Measurement ingest queue is full ({self.queue.maxsize}), waiting for flush")
+        await self.queue.put(row)
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет всё, что осталось в очереди."""
+        if self._flush_task:
+            # wait_for может поглотить отмену, если get() завершился одновременно с ней,
+            # поэтому цикл ещё и проверяет флаг
+            self._stopping = True
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+            self._stopping = False
+
+        remaining = self._drain(self.queue.qsize())
+        while remaining:
+            await self._flush(remaining)
+            remaining = self._drain(self.batch_size)
+        logger.info(
+            f"Measurement ingest buffer stopped (flushed: {self.flushed_rows}, spooled: {self.spooled_rows})"
+        )
+
+    def _drain(self, limit: int) -> List[FullDeviceMeasurementCreate]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            batch = []
+            try:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + self.flush_seconds
+                while len(batch) < self.batch_size and not self._stopping:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                # строки уже вынуты из очереди, и stop() их не увидит: сохраняем в spool
+                if batch:
+                    self._write_spool(batch)
+                raise
+
+    async def _flush(self, batch: List[FullDeviceMeasurementCreate]):
+        try:
+            async with async_session_maker() as db:
+                await create_full_device_measurements_bulk(db, batch)
+            self.flushed_rows += len(batch)
+            logger.debug(f"Flushed {len(batch)} measurements (queue: {self.queue.qsize()})")
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} measurements, writing to spool: {e}", exc_info=True)
+            self._write_spool(batch)
+
+    def _write_spool(self, batch: List[FullDeviceMeasurementCreate]):
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for row in batch:
+                    spool.write(row.model_dump_json() + "\n")
+            self.spooled_rows += len(batch)
+        except Exception as e:
+            logger.critical(f"Failed to spool {len(batch)} measurements to {self.spool_path}: {e}", exc_info=True)
+
+    async def _replay_spool(self):
+        # незавершённый replay после падения обрабатывается первым, новый spool — при следующем запуске
+        replay_path = f"{self.spool_path}.replay"
+        if os.path.exists(self.spool_path) and not os.path.exists(replay_path):
+            os.replace(self.spool_path, replay_path)
+        if not os.path.exists(replay_path):
+            return
+
+        rows = []
+        with open(replay_path, encoding="utf-8") as spool:
+            for line in spool:
+                if line.strip():
+                    rows.append(FullDeviceMeasurementCreate(**json.loads(line)))
+        logger.info(f"Replaying {len(rows)} spooled measurements from {self.spool_path}")
+
+        for start in range(0, len(rows), self.batch_size):
+            await self._flush(rows[start:start + self.batch_size])
+        os.remove(replay_path)
+
+
+measurement_buffer = MeasurementIngestBuffer()
@@ -1,4 +1,5 @@
 import asyncio
+import signal
 from datetime import datetime, time as dt_time
 from typing import Optional
 from uuid import uuid4
@@ -23,6 +24,10 @@ from cor_pass.database.models import EnergeticObject
 from worker.schedule_task import send_dvcc_max_charge_current_command, send_vebus_soc_command
 from cor_pass.config.config import settings
 from worker.worker_manager import WorkerManager
+from worker.modbus_pool import modbus_pool
+from worker.ingest_buffer import measurement_buffer
+from worker.tasks import measurement_partition_task_worker, measurement_rollup_task_worker
+from worker.schedule_index import schedule_index
 
 
 DEFAULT_grid_feed_kw = 70000
@@ -38,7 +43,31 @@ current_active_schedule_id: Optional[str] = None
 CHECK_INTERVAL = 5
 worker_manager = WorkerManager()
 
+async def shutdown_workers():
+    """Останавливает воркеры и сохраняет буфер измерений перед выходом."""
+    for obj_id in list(worker_manager.tasks.keys()):
+        await worker_manager.stop_worker(obj_id)
+    await measurement_buffer.stop()
+    await modbus_pool.close_all()
+
+
 async def main_worker_entrypoint():
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    await measurement_buffer.start()
+    rollup_task = asyncio.create_task(measurement_rollup_task_worker())
+    partition_task = asyncio.create_task(measurement_partition_task_worker())
+    schedule_listener_task = asyncio.create_task(schedule_index.listen())
+    try:
+        await supervise_workers()
+    finally:
+        rollup_task.cancel()
+        partition_task.cancel()
+        schedule_listener_task.cancel()
+        await shutdown_workers()
+
+
+async def supervise_workers():
     while True:
         try:
             async with async_session_maker() as db:
@@ -47,18 +76,28 @@ async def main_worker_entrypoint():
                 )
                 active_objects = result.scalars().all()
 
-                # запуск новых воркеров
+                # запуск новых воркеров и перезапуск при смене адреса Modbus
                 for energy_obj in active_objects:
                     object_id = energy_obj.id
                     object_name = energy_obj.name
-                    if energy_obj.id not in worker_manager.tasks:
-                        await worker_manager.start_worker(object_id=object_id, object_name=object_name)
+                    endpoint = (energy_obj.modbus_host, energy_obj.modbus_port)
+                    if object_id in worker_manager.tasks and worker_manager.endpoints.get(object_id) != endpoint:
+                        await worker_manager.stop_worker(object_id)
+                    if object_id not in worker_manager.tasks:
+                        await worker_manager.start_worker(
+                            object_id=object_id,
+                            object_name=object_name,
+                            modbus_host=energy_obj.modbus_host,
+                            modbus_port=energy_obj.modbus_port,
+                        )
 
                 # остановка неактивных
                 for obj_id in list(worker_manager.tasks.keys()):
                     if obj_id not in [o.id for o in active_objects]:
                         await worker_manager.stop_worker(obj_id)
 
+            await modbus_pool.health_check()
+
         except Exception as e:
             logger.error(f"Error in main loop: {e}", exc_info=True)
 
@@ -31,6 +31,17 @@ INVERTER_REGISTERS = {
     "output_power_l3": 882,
 }
 
+ESS_AC_REGISTERS = {
+    3: "input_voltage_l1", 4: "input_voltage_l2", 5: "input_voltage_l3",
+    6: "input_current_l1", 7: "input_current_l2", 8: "input_current_l3",
+    9: "input_frequency_l1", 10: "input_frequency_l2", 11: "input_frequency_l3",
+    12: "input_power_l1", 13: "input_power_l2", 14: "input_power_l3",
+    15: "output_voltage_l1", 16: "output_voltage_l2", 17: "output_voltage_l3",
+    18: "output_current_l1", 19: "output_current_l2", 20: "output_current_l3",
+}
+
+SOLAR_CHARGER_PV_POWER_REGISTER = 3730
+
 ESS_REGISTERS_MODE = {
     "switch_position": 33,
 }
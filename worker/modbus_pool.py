@@ -0,0 +1,175 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from loguru import logger
+from pymodbus.client import AsyncModbusTcpClient
+
+from cor_pass.config.config import settings
+from worker.modbus_client import MODBUS_IP, MODBUS_PORT
+
+MODBUS_TIMEOUT_SECONDS = 5
+RECONNECT_BASE_DELAY_SECONDS = 1
+
+
+class ModbusDeviceConnection:
+    """
+    Подключение к одному Modbus TCP шлюзу (host, port).
+    Подключается лениво при первом запросе, переподключается с экспоненциальной
+    задержкой и ограничивает количество одновременных запросов к устройству.
+    Все unit id (батарея, инвертор, ESS, MPPT) опрашиваются через одно подключение.
+    """
+
+    def __init__(self, host: str, port: int, max_concurrency: int):
+        self.host = host
+        self.port = port
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client: Optional[AsyncModbusTcpClient] = None
+        self.failures = 0
+        self.next_attempt_at = 0.0
+        self._connect_lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"<ModbusDeviceConnection({self.host}:{self.port}, connected={self.connected}, failures={self.failures})>"
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.client and self.client.connected)
+
+    def _backoff_delay(self) -> float:
+        return min(
+            RECONNECT_BASE_DELAY_SECONDS * 2 ** max(self.failures - 1, 0),
+            settings.modbus_reconnect_max_backoff_seconds,
+        )
+
+    def _close_client(self):
+        if self.client:
+            try:
+                self.client.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка при закрытии Modbus клиента {self.host}:{self.port}: {e}")
+            self.client = None
+
+    async def get_client(self) -> Optional[AsyncModbusTcpClient]:
+        """
+        Возвращает подключённый клиент или None, если устройство недоступно
+        и время следующей попытки переподключения ещё не наступило.
+        """
+        if self.connected:
+            return self.client
+
+        async with self._connect_lock:
+            if self.connected:
+                return self.client
+
+            loop = asyncio.get_running_loop()
+            if loop.time() < self.next_attempt_at:
+                return None
+
+            self._close_client()
+            logger.info(f"🔄 Подключение к Modbus {self.host}:{self.port} (попытка #{self.failures + 1})")
+            client = AsyncModbusTcpClient(host=self.host, port=self.port, timeout=MODBUS_TIMEOUT_SECONDS)
+            try:
+                await client.connect()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка подключения к Modbus {self.host}:{self.port}: {e}")
+
+            if not client.connected:
+                client.close()
+                self.failures += 1
+                delay = self._backoff_delay()
+                self.next_attempt_at = loop.time() + delay
+                logger.error(f"❌ Modbus {self.host}:{self.port} недоступен. Следующая попытка через {delay}s")
+                return None
+
+            logger.info(f"✅ Подключение к Modbus {self.host}:{self.port} установлено")
+            self.client = client
+            self.failures = 0
+            self.next_attempt_at = 0.0
+            return client
+
+    async def mark_broken(self, client: AsyncModbusTcpClient):
+        """
+        Закрывает подключение после ошибки транспорта, следующий запрос переподключится.
+        client — клиент, на котором случилась ошибка: если другой объект того же шлюза
+        уже переподключился, новый клиент не закрывается.
+        """
+        async with self._connect_lock:
+            if self.client is not client:
+                return
+            logger.warning(f"🔌 Modbus подключение {self.host}:{self.port} помечено как неисправное")
+            self._close_client()
+
+    @asynccontextmanager
+    async def limit(self) -> AsyncIterator[None]:
+        """Занимает один слот из лимита одновременных запросов к устройству."""
+        async with self.semaphore:
+            yield
+
+    async def close(self):
+        async with self._connect_lock:
+            self._close_client()
+
+
+class ModbusConnectionPool:
+    """
+    Пул Modbus подключений, по одному на каждый адрес энергетического объекта.
+    Объекты с одним шлюзом делят подключение: acquire/release считают владельцев,
+    и подключение закрывается, только когда его отпустил последний.
+    """
+
+    def __init__(self, max_concurrency_per_device: Optional[int] = None):
+        self.max_concurrency_per_device = (
+            max_concurrency_per_device or settings.modbus_device_max_concurrency
+        )
+        self.connections: Dict[Tuple[str, int], ModbusDeviceConnection] = {}
+        self.owners: Dict[Tuple[str, int], int] = {}
+
+    @staticmethod
+    def _key(host: Optional[str], port: Optional[int]) -> Tuple[str, int]:
+        # без адреса используется шлюз по умолчанию: (None, None) и (MODBUS_IP, MODBUS_PORT) — одно устройство
+        return host or MODBUS_IP, port or MODBUS_PORT
+
+    def get_connection(
+        self, host: Optional[str] = None, port: Optional[int] = None
+    ) -> ModbusDeviceConnection:
+        """Возвращает подключение для адреса объекта. Без адреса используется шлюз по умолчанию."""
+        key = self._key(host, port)
+        connection = self.connections.get(key)
+        if connection is None:
+            connection = ModbusDeviceConnection(key[0], key[1], self.max_concurrency_per_device)
+            self.connections[key] = connection
+        return connection
+
+    def acquire(self, host: Optional[str] = None, port: Optional[int] = None) -> ModbusDeviceConnection:
+        """Подключение для нового владельца (объекта); парный вызов — release."""
+        key = self._key(host, port)
+        self.owners[key] = self.owners.get(key, 0) + 1
+        return self.get_connection(*key)
+
+    async def health_check(self):
+        """Проверяет все подключения и переподключает разорванные (с учётом задержки)."""
+        for connection in list(self.connections.values()):
+            if not connection.connected:
+                await connection.get_client()
+
+    async def release(self, host: Optional[str] = None, port: Optional[int] = None):
+        """Отпускает подключение; закрывает и удаляет его, если владельцев не осталось."""
+        key = self._key(host, port)
+        owners = self.owners.get(key, 0) - 1
+        if owners > 0:
+            self.owners[key] = owners
+            return
+        self.owners.pop(key, None)
+        connection = self.connections.pop(key, None)
+        if connection:
+            await connection.close()
+
+    async def close_all(self):
+        for connection in list(self.connections.values()):
+            await connection.close()
+        self.connections.clear()
+        self.owners.clear()
+
+
+modbus_pool = ModbusConnectionPool()
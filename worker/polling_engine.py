@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from loguru import logger
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ConnectionException
+
+from cor_pass.config.config import settings
+from worker.modbus_client import (
+    BATTERY_ID,
+    INVERTER_ID,
+    ESS_UNIT_ID,
+    SOLAR_CHARGER_SLAVE_IDS,
+    REGISTERS,
+    INVERTER_REGISTERS,
+    ESS_AC_REGISTERS,
+    SOLAR_CHARGER_PV_POWER_REGISTER,
+    register_modbus_error,
+)
+
+INPUT_TABLE = "input"
+HOLDING_TABLE = "holding"
+
+# Ограничение протокола Modbus на количество регистров в одном запросе
+MAX_REGISTERS_PER_READ = 125
+
+# (slave, таблица, адрес, количество регистров)
+RegisterRequest = Tuple[int, str, int, int]
+# (slave, таблица, адрес) -> сырое значение регистра
+RegisterSnapshot = Dict[Tuple[int, str, int], int]
+
+
+def build_cerbo_register_requests() -> List[RegisterRequest]:
+    """
+    Формирует список всех регистров, которые нужно прочитать за один цикл опроса Cerbo.
+    Блок батареи запрашивается целиком, как и раньше, чтобы данные для SOC
+    брались из того же чтения.
+    """
+    battery_addresses = list(REGISTERS.values())
+    battery_start = min(battery_addresses)
+    battery_count = max(battery_addresses) - battery_start + 1
+
+    requests: List[RegisterRequest] = [(BATTERY_ID, INPUT_TABLE, battery_start, battery_count)]
+    requests += [(INVERTER_ID, HOLDING_TABLE, address, 2) for address in INVERTER_REGISTERS.values()]
+    requests += [(ESS_UNIT_ID, INPUT_TABLE, address, 1) for address in ESS_AC_REGISTERS]
+    requests += [
+        (slave, INPUT_TABLE, SOLAR_CHARGER_PV_POWER_REGISTER, 1)
+        for slave in SOLAR_CHARGER_SLAVE_IDS
+    ]
+    return requests
+
+
+def coalesce_register_requests(
+    requests: Iterable[RegisterRequest],
+    max_gap: int,
+    max_count: int = MAX_REGISTERS_PER_READ,
+) -> List[RegisterRequest]:
+    """
+    Объединяет запросы к одному slave и одной таблице в минимальное количество блоков.
+    Соседние диапазоны склеиваются, если промежуток между ними не больше max_gap
+    и итоговый блок не превышает max_count регистров.
+    """
+    grouped: Dict[Tuple[int, str], List[Tuple[int, int]]] = {}
+    for slave, table, address, count in requests:
+        grouped.setdefault((slave, table), []).append((address, address + count))
+
+    blocks: List[RegisterRequest] = []
+    for (slave, table), ranges in grouped.items():
+        ranges.sort()
+        start, end = ranges[0]
+        for range_start, range_end in ranges[1:]:
+            merged_end = max(end, range_end)
+            if range_start <= end + max_gap and merged_end - start <= max_count:
+                end = merged_end
+            else:
+                blocks.append((slave, table, start, end - start))
+                start, end = range_start, range_end
+        blocks.append((slave, table, start, end - start))
+    return blocks
+
+
+class ModbusPollingEngine:
+    """
+    Опрашивает заранее спланированные блоки регистров.
+    Разные slave опрашиваются параллельно, количество одновременных запросов
+    ограничено max_in_flight. Длительность каждого цикла сравнивается с интервалом опроса.
+    """
+
+    def __init__(
+        self,
+        requests: Iterable[RegisterRequest],
+        interval_seconds: float,
+        max_in_flight: Optional[int] = None,
+        max_gap: Optional[int] = None,
+    ):
+        self.interval_seconds = interval_seconds
+        self.max_in_flight = max_in_flight or settings.modbus_poll_max_in_flight
+        gap = settings.modbus_register_max_gap if max_gap is None else max_gap
+        self.blocks = coalesce_register_requests(requests, max_gap=gap)
+
+        self.blocks_by_slave: Dict[int, List[RegisterRequest]] = {}
+        for block in self.blocks:
+            self.blocks_by_slave.setdefault(block[0], []).append(block)
+
+        self.last_cycle_seconds: Optional[float] = None
+        self.overrun_count = 0
+        # Ошибка транспорта (обрыв TCP) в последнем цикле; ответы-исключения устройства сюда не попадают
+        self.last_transport_error: Optional[ConnectionException] = None
+
+    async def _read_block(
+        self,
+        modbus_client: AsyncModbusTcpClient,
+        block: RegisterRequest,
+        transaction_id: UUID,
+    ) -> Optional[List[int]]:
+        slave, table, address, count = block
+        try:
+            if table == HOLDING_TABLE:
+                result = await modbus_client.read_holding_registers(address=address, count=count, slave=slave)
+            else:
+                result = await modbus_client.read_input_registers(address=address, count=count, slave=slave)
+            if result.isError() or not hasattr(result, "registers"):
+                register_modbus_error()
+                logger.warning(
+                    f"[{transaction_id}] Modbus error reading {table} registers {address}-{address + count - 1} from slave {slave}: {result}",
+                    extra={"slave_id": slave},
+                )
+                return None
+            return result.registers
+        except Exception as e:
+            register_modbus_error()
+            if isinstance(e, ConnectionException):
+                self.last_transport_error = e
+            logger.warning(
+                f"[{transaction_id}] Exception while reading {table} registers {address}-{address + count - 1} from slave {slave}: {e}",
+                extra={"slave_id": slave},
+            )
+            return None
+
+    async def _poll_slave(
+        self,
+        modbus_client: AsyncModbusTcpClient,
+        blocks: List[RegisterRequest],
+        semaphore: asyncio.Semaphore,
+        snapshot: RegisterSnapshot,
+        transaction_id: UUID,
+    ):
+        for block in blocks:
+            async with semaphore:
+                registers = await self._read_block(modbus_client, block, transaction_id)
+            if registers is None:
+                continue
+            slave, table, address, _ = block
+            for offset, value in enumerate(registers):
+                snapshot[(slave, table, address + offset)] = value
+
+    async def poll(
+        self,
+        modbus_client: AsyncModbusTcpClient,
+        transaction_id: UUID,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ) -> RegisterSnapshot:
+        """
+        Выполняет один цикл опроса и возвращает прочитанные регистры.
+        Если передан semaphore (лимит устройства из пула подключений), используется он,
+        иначе количество одновременных запросов ограничивается max_in_flight.
+        """
+        snapshot: RegisterSnapshot = {}
+        self.last_transport_error = None
+        semaphore = semaphore or asyncio.Semaphore(self.max_in_flight)
+        started_at = time.monotonic()
+
+        await asyncio.gather(
+            *(
+                self._poll_slave(modbus_client, blocks, semaphore, snapshot, transaction_id)
+                for blocks in self.blocks_by_slave.values()
+            )
+        )
+
+        self.last_cycle_seconds = time.monotonic() - started_at
+        if self.last_cycle_seconds > self.interval_seconds:
+            self.overrun_count += 1
+            logger.warning(
+                f"[{transaction_id}] Polling cycle took {self.last_cycle_seconds:.3f}s, "
+                f"interval is {self.interval_seconds}s ({len(self.blocks)} reads, overruns: {self.overrun_count})"
+            )
+        else:
+            logger.debug(
+                f"[{transaction_id}] Polling cycle took {self.last_cycle_seconds:.3f}s "
+                f"of {self.interval_seconds}s ({len(self.blocks)} reads)"
+            )
+        return snapshot
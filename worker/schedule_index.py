@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from cor_pass.config.config import settings
+from cor_pass.database.db import async_session_maker
+from cor_pass.database.models import EnergeticSchedule
+from cor_pass.database.redis_db import redis_client
+from cor_pass.services.cerbo_schedule_events import ALL_OBJECTS, SCHEDULE_CHANGES_CHANNEL
+from worker.db_operations import get_all_schedules
+
+REDIS_RETRY_SECONDS = 5
+
+
+def is_schedule_active(schedule: EnergeticSchedule, now_time: dt_time) -> bool:
+    if schedule.start_time <= schedule.end_time:
+        return schedule.start_time <= now_time < schedule.end_time
+    # расписание переходит через полночь
+    return now_time >= schedule.start_time or now_time < schedule.end_time
+
+
+def find_active_schedule(
+    schedules: Sequence[EnergeticSchedule], now_time: dt_time
+) -> Optional[EnergeticSchedule]:
+    """Первое по времени начала расписание, в интервал которого попадает now_time."""
+    for schedule in schedules:
+        if is_schedule_active(schedule, now_time):
+            return schedule
+    return None
+
+
+def next_schedule_transition(
+    schedules: Sequence[EnergeticSchedule], now: datetime
+) -> Optional[datetime]:
+    """Ближайший после now момент начала или окончания любого из расписаний."""
+    transitions = []
+    for schedule in schedules:
+        for moment in (schedule.start_time, schedule.end_time):
+            at = datetime.combine(now.date(), moment)
+            if at <= now:
+                at += timedelta(days=1)
+            transitions.append(at)
+    return min(transitions, default=None)
+
+
+class ScheduleIndex:
+    """
+    Кэш расписаний (без ручного режима) по объектам, общий для всех задач воркера.
+    Объект перечитывается из БД после уведомления об изменении через Redis
+    или по истечении schedule_cache_ttl_seconds, если уведомление потерялось.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds or settings.schedule_cache_ttl_seconds
+        self.schedules: Dict[str, List[EnergeticSchedule]] = {}
+        self.loaded_at: Dict[str, float] = {}
+        self.changed: Dict[str, asyncio.Event] = {}
+
+    def _changed_event(self, object_id: str) -> asyncio.Event:
+        return self.changed.setdefault(object_id, asyncio.Event())
+
+    async def get(self, object_id: str) -> List[EnergeticSchedule]:
+        now = asyncio.get_running_loop().time()
+        loaded_at = self.loaded_at.get(object_id)
+        if loaded_at is None or now - loaded_at > self.ttl_seconds:
+            async with async_session_maker() as db:
+                schedules = await get_all_schedules(db, object_id)
+            self.schedules[object_id] = [s for s in schedules if not s.is_manual_mode]
+            self.loaded_at[object_id] = now
+        return self.schedules[object_id]
+
+    def invalidate(self, object_id: Optional[str] = None):
+        """Сбрасывает кэш объекта (или всех объектов) и будит ожидающие его задачи."""
+        object_ids = set(self.changed) | set(self.loaded_at) if object_id is None else [object_id]
+        for changed_id in object_ids:
+            self.loaded_at.pop(changed_id, None)
+            self.schedules.pop(changed_id, None)
+            self._changed_event(changed_id).set()
+
+    async def wait_for_change(self, object_id: str, timeout: float) -> bool:
+        """Ждёт изменения расписаний объекта не дольше timeout. True — если они изменились."""
+        event = self._changed_event(object_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+    async def listen(self):
+        """Слушает уведомления об изменении расписаний из API."""
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(SCHEDULE_CHANGES_CHANNEL)
+                # уведомления, пропущенные без подписки, компенсируются полным сбросом
+                self.invalidate()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    object_id = message["data"]
+                    logger.info(f"Schedules changed for {object_id}, invalidating cache")
+                    self.invalidate(None if object_id == ALL_OBJECTS else object_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Schedule change listener error: {e}. Retrying in {REDIS_RETRY_SECONDS}s")
+                await asyncio.sleep(REDIS_RETRY_SECONDS)
+            finally:
+                await pubsub.aclose()
+
+
+schedule_index = ScheduleIndex()
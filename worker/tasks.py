@@ -1,24 +1,33 @@
 import asyncio
-from datetime import datetime, time as dt_time
-from typing import Optional
+from datetime import datetime, time as dt_time, timedelta
+from typing import Dict, Optional, Tuple
 from uuid import uuid4
 
 from loguru import logger
 from cor_pass.database.db import async_session_maker
 from cor_pass.schemas import FullDeviceMeasurementCreate
-from worker.modbus_client import (
-    get_modbus_client_singleton
-)
+from worker.modbus_pool import ModbusDeviceConnection, modbus_pool
 from worker.data_collector import (
-    collect_battery_data,
-    collect_inverter_power_data,
-    collect_ess_ac_data,
-    get_solarchargers_current_sum,
-    get_battery_status,
+    decode_battery_data,
+    decode_inverter_power_data,
+    decode_ess_ac_data,
+    decode_solarchargers_power_sum,
     send_grid_feed_w_command,
 )
-from worker.db_operations import create_full_device_measurement, get_all_schedules, update_schedule_is_active_status
-from worker.schedule_task import send_dvcc_max_charge_current_command, send_vebus_soc_command
+from worker.polling_engine import ModbusPollingEngine, build_cerbo_register_requests
+from worker.db_operations import update_schedule_is_active_status
+from worker.schedule_index import find_active_schedule, next_schedule_transition, schedule_index
+from worker.ingest_buffer import measurement_buffer
+from cor_pass.repository.cerbo_rollup import refresh_measurement_rollups
+from cor_pass.repository.cerbo_partitions import maintain_measurement_partitions
+from cor_pass.services.cerbo_telemetry import publish_telemetry
+from worker.schedule_task import (
+    read_dvcc_max_charge_current,
+    read_grid_feed_w,
+    read_vebus_soc,
+    send_dvcc_max_charge_current_command,
+    send_vebus_soc_command,
+)
 from cor_pass.config.config import settings
 
 
@@ -32,60 +41,124 @@ SCHEDULE_CHECK_INTERVAL_SECONDS = 3
 
 current_active_schedule_id: Optional[str] = None
 
+def loop_time() -> float:
+    return asyncio.get_running_loop().time()
+
+
+async def sleep_until_next_cycle(cycle_started_at: float):
+    """Ждёт остаток интервала сбора, чтобы циклы шли с фиксированным шагом."""
+    elapsed = loop_time() - cycle_started_at
+    await asyncio.sleep(max(0.0, COLLECTION_INTERVAL_SECONDS - elapsed))
+
+
+# Команда записи, чтение текущего значения и приведение цели к тому, что вернёт чтение
+INVERTER_SETPOINTS = {
+    "grid_feed_w": (
+        lambda client, value: send_grid_feed_w_command(modbus_client=client, grid_feed_w=value),
+        read_grid_feed_w,
+        lambda value: int(value / 100) * 100,
+    ),
+    "battery_level_percent": (
+        lambda client, value: send_vebus_soc_command(modbus_client=client, battery_level_percent=value),
+        read_vebus_soc,
+        int,
+    ),
+    "charge_battery_value": (
+        lambda client, value: send_dvcc_max_charge_current_command(modbus_client=client, charge_battery_value=value),
+        read_dvcc_max_charge_current,
+        int,
+    ),
+}
+
+
 async def set_inverter_parameters(
+    connection: ModbusDeviceConnection,
     object_id: str,
     grid_feed_w: int,
     battery_level_percent: int,
-    charge_battery_value: int
+    charge_battery_value: int,
+    written_setpoints: Optional[Dict[str, Tuple[int, float]]] = None,
 ):
-    modbus_client_instance = await get_modbus_client_singleton()
+    """
+    Записывает параметры инвертора.
+    Если передан written_setpoints (значение и время последней записи по каждому параметру объекта),
+    регистр пишется только когда цель отличается от записанного ранее значения,
+    а после schedule_setpoint_verify_seconds — от значения, прочитанного из инвертора.
+    """
+    modbus_client_instance = await connection.get_client()
     if not modbus_client_instance:
         logger.error(f"[{object_id}] Не удалось получить Modbus клиент для установки параметров инвертора.")
         return
 
     if settings.app_env == "development":
-        await send_grid_feed_w_command(modbus_client=modbus_client_instance, grid_feed_w=grid_feed_w)
-        await send_vebus_soc_command(modbus_client=modbus_client_instance, battery_level_percent=battery_level_percent)
-        await send_dvcc_max_charge_current_command(modbus_client=modbus_client_instance, charge_battery_value=charge_battery_value)
+        targets = {
+            "grid_feed_w": grid_feed_w,
+            "battery_level_percent": battery_level_percent,
+            "charge_battery_value": charge_battery_value,
+        }
+        async with connection.limit():
+            for name, value in targets.items():
+                send_setpoint, read_setpoint, normalize = INVERTER_SETPOINTS[name]
+                target = normalize(value)
+                if written_setpoints is not None:
+                    written = written_setpoints.get(name)
+                    if written and written[0] == target and loop_time() - written[1] < settings.schedule_setpoint_verify_seconds:
+                        continue
+                    if await read_setpoint(modbus_client_instance) == target:
+                        written_setpoints[name] = (target, loop_time())
+                        logger.debug(f"[{object_id}] {name} already set to {target}, skipping write")
+                        continue
+                await send_setpoint(modbus_client_instance, value)
+                if written_setpoints is not None:
+                    written_setpoints[name] = (target, loop_time())
 
 
-async def cerbo_collection_task_worker(object_id: str, object_name: str):
+async def cerbo_collection_task_worker(
+    object_id: str,
+    object_name: str,
+    modbus_host: Optional[str] = None,
+    modbus_port: Optional[int] = None,
+):
+    connection = modbus_pool.get_connection(modbus_host, modbus_port)
+    polling_engine = ModbusPollingEngine(
+        build_cerbo_register_requests(), interval_seconds=COLLECTION_INTERVAL_SECONDS
+    )
+    logger.info(f"[{object_id}] Polling plan: {len(polling_engine.blocks)} reads per cycle: {polling_engine.blocks}")
+
     while True:
+        cycle_started_at = loop_time()
         transaction_id = uuid4()
-        modbus_client_instance = await get_modbus_client_singleton()
+        modbus_client_instance = await connection.get_client()
 
         try:
-            if not modbus_client_instance or not modbus_client_instance.connected:
-                logger.critical(f"[{object_id}] [{transaction_id}] Modbus client not connected. Skipping cycle.")
-                await asyncio.sleep(COLLECTION_INTERVAL_SECONDS)
+            if not modbus_client_instance:
+                logger.critical(f"[{object_id}] [{transaction_id}] Modbus client {connection.host}:{connection.port} not connected. Skipping cycle.")
+                await sleep_until_next_cycle(cycle_started_at)
                 continue
 
-            collected_data = {}
+            snapshot = await polling_engine.poll(
+                modbus_client_instance, transaction_id, semaphore=connection.semaphore
+            )
+            # пустой снимок бывает и без обрыва (например, устройство отвечает исключением на неверный unit id),
+            # а клиент общий для всех объектов шлюза, поэтому закрываем его только при ошибке транспорта
+            if polling_engine.last_transport_error is not None or not modbus_client_instance.connected:
+                await connection.mark_broken(modbus_client_instance)
 
-            try:
-                collected_data.update(await collect_battery_data(modbus_client_instance, transaction_id))
-            except Exception:
-                pass
-            try:
-                collected_data.update(await collect_inverter_power_data(modbus_client_instance, transaction_id))
-            except Exception:
-                pass
-            try:
-                collected_data.update(await collect_ess_ac_data(modbus_client_instance, transaction_id))
-            except Exception:
-                pass
-            try:
-                collected_data.update(await get_solarchargers_current_sum(modbus_client_instance, transaction_id))
-            except Exception:
-                pass
-            try:
-                collected_data.update(await get_battery_status(modbus_client_instance, transaction_id))
-            except Exception:
-                pass
+            collected_data = {}
+            for decoder in (
+                decode_battery_data,
+                decode_inverter_power_data,
+                decode_ess_ac_data,
+                decode_solarchargers_power_sum,
+            ):
+                try:
+                    collected_data.update(decoder(snapshot))
+                except KeyError as e:
+                    logger.warning(f"[{object_id}] [{transaction_id}] {decoder.__name__}: register {e} was not read")
 
             if not collected_data:
                 logger.warning(f"[{object_id}] [{transaction_id}] No data collected. Skipping save.")
-                await asyncio.sleep(COLLECTION_INTERVAL_SECONDS)
+                await sleep_until_next_cycle(cycle_started_at)
                 continue
 
             collected_data["measured_at"] = datetime.now()
@@ -96,65 +169,103 @@ async def cerbo_collection_task_worker(object_id: str, object_name: str):
             missing_fields = [f for f in required_fields if f not in collected_data or collected_data[f] is None]
             if missing_fields:
                 logger.error(f"[{object_id}] Missing fields: {missing_fields}. Skipping save.", extra={"collected_data": collected_data})
-                await asyncio.sleep(COLLECTION_INTERVAL_SECONDS)
+                await sleep_until_next_cycle(cycle_started_at)
                 continue
 
             full_measurement = FullDeviceMeasurementCreate(**collected_data)
-            async with async_session_maker() as db:
-                await create_full_device_measurement(db=db, data=full_measurement)
+            await measurement_buffer.put(full_measurement)
+            # в Redis уходит собранный словарь как есть, схема нужна только буферу записи в БД
+            await publish_telemetry(object_id, collected_data)
 
         except Exception as e:
             logger.error(f"[{object_id}] Error in collection task: {e}", exc_info=True)
 
-        await asyncio.sleep(COLLECTION_INTERVAL_SECONDS)
+        await sleep_until_next_cycle(cycle_started_at)
 
 
-async def energetic_schedule_task_worker(object_id: str):
+async def energetic_schedule_task_worker(
+    object_id: str,
+    modbus_host: Optional[str] = None,
+    modbus_port: Optional[int] = None,
+):
+    """
+    Применяет расписания объекта. Расписания берутся из общего кэша, задача спит
+    до ближайшего начала или окончания расписания (или до изменения расписаний),
+    но не дольше schedule_resync_interval_seconds.
+    """
+    connection = modbus_pool.get_connection(modbus_host, modbus_port)
     current_active_schedule_id: str | None = None
+    written_setpoints: Dict[str, Tuple[int, float]] = {}
 
     while True:
+        wake_at = None
         try:
-            async with async_session_maker() as db:
-                all_schedules = await get_all_schedules(db)
-                # фильтруем только для этого объекта
-                object_schedules = [s for s in all_schedules if s.energetic_object_id == object_id]
-
-                operational_schedules = [s for s in object_schedules if not s.is_manual_mode]
-                now_time = datetime.now().time()
-
-                active_schedule = None
-                for schedule in operational_schedules:
-                    if schedule.start_time <= schedule.end_time:
-                        if schedule.start_time <= now_time < schedule.end_time:
-                            active_schedule = schedule
-                            break
-                    else:
-                        if now_time >= schedule.start_time or now_time < schedule.end_time:
-                            active_schedule = schedule
-                            break
-
-                if active_schedule:
-                    if active_schedule.id != current_active_schedule_id:
-                        # деактивация предыдущей
-                        if current_active_schedule_id:
-                            await update_schedule_is_active_status(db, current_active_schedule_id, False)
-                        current_active_schedule_id = active_schedule.id
-                        # установка параметров инвертора для объекта
-                        await set_inverter_parameters(
-                            object_id,
-                            active_schedule.grid_feed_w,
-                            active_schedule.battery_level_percent,
-                            active_schedule.charge_battery_value,
-                        )
-                        await update_schedule_is_active_status(db, active_schedule.id, True)
-                else:
-                    # сброс к дефолтным параметрам
+            schedules = await schedule_index.get(object_id)
+            now = datetime.now()
+            active_schedule = find_active_schedule(schedules, now.time())
+            wake_at = next_schedule_transition(schedules, now)
+
+            active_schedule_id = active_schedule.id if active_schedule else None
+            if active_schedule_id != current_active_schedule_id:
+                async with async_session_maker() as db:
+                    # деактивация предыдущей
                     if current_active_schedule_id:
                         await update_schedule_is_active_status(db, current_active_schedule_id, False)
-                        current_active_schedule_id = None
-                    await set_inverter_parameters(object_id, DEFAULT_grid_feed_kw, DEFAULT_battery_level_percent, DEFAULT_charge_battery_value)
+                    if active_schedule_id:
+                        await update_schedule_is_active_status(db, active_schedule_id, True)
+                logger.info(f"[{object_id}] Active schedule changed: {current_active_schedule_id} -> {active_schedule_id}")
+                current_active_schedule_id = active_schedule_id
+
+            if active_schedule:
+                # установка параметров инвертора для объекта
+                await set_inverter_parameters(
+                    connection,
+                    object_id,
+                    active_schedule.grid_feed_w,
+                    active_schedule.battery_level_percent,
+                    active_schedule.charge_battery_value,
+                    written_setpoints,
+                )
+            else:
+                # сброс к дефолтным параметрам
+                await set_inverter_parameters(
+                    connection,
+                    object_id,
+                    DEFAULT_grid_feed_kw,
+                    DEFAULT_battery_level_percent,
+                    DEFAULT_charge_battery_value,
+                    written_setpoints,
+                )
 
         except Exception as e:
             logger.error(f"[{object_id}] Error in schedule task: {e}", exc_info=True)
+            wake_at = datetime.now() + timedelta(seconds=SCHEDULE_CHECK_INTERVAL_SECONDS)
+
+        timeout = settings.schedule_resync_interval_seconds
+        if wake_at:
+            timeout = min(timeout, (wake_at - datetime.now()).total_seconds())
+        await schedule_index.wait_for_change(object_id, timeout)
+
+
+async def measurement_rollup_task_worker():
+    """Периодически досчитывает таблицы агрегатов cerbo_measurements."""
+    while True:
+        try:
+            async with async_session_maker() as db:
+                await refresh_measurement_rollups(db)
+        except Exception as e:
+            logger.error(f"Error in measurement rollup task: {e}", exc_info=True)
+
+        await asyncio.sleep(settings.measurement_rollup_interval_seconds)
+
+
+async def measurement_partition_task_worker():
+    """Создаёт месячные партиции cerbo_measurements наперёд и убирает устаревшие."""
+    while True:
+        try:
+            async with async_session_maker() as db:
+                await maintain_measurement_partitions(db)
+        except Exception as e:
+            logger.error(f"Error in measurement partition task: {e}", exc_info=True)
 
-        await asyncio.sleep(SCHEDULE_CHECK_INTERVAL_SECONDS)
\ No newline at end of file
+        await asyncio.sleep(settings.measurement_maintenance_interval_seconds)
@@ -1,27 +1,49 @@
 import asyncio
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from loguru import logger
 
+from worker.modbus_pool import modbus_pool
 from worker.tasks import cerbo_collection_task_worker, energetic_schedule_task_worker
 
 class WorkerManager:
     def __init__(self):
         # словарь: object_id -> {"collection_task": Task, "schedule_task": Task}
         self.tasks: Dict[str, Dict[str, asyncio.Task]] = {}
+        # словарь: object_id -> (modbus_host, modbus_port)
+        self.endpoints: Dict[str, Tuple[Optional[str], Optional[int]]] = {}
 
-    async def start_worker(self, object_id: str, object_name: str ):
+    async def start_worker(
+        self,
+        object_id: str,
+        object_name: str,
+        modbus_host: Optional[str] = None,
+        modbus_port: Optional[int] = None,
+    ):
         if object_id in self.tasks:
             logger.warning(f"Worker for object {object_id} is already running.")
             return
 
+        # объект держит подключение к своему шлюзу, пока работают его задачи
+        modbus_pool.acquire(modbus_host, modbus_port)
+
         # создаём асинхронные задачи
-        collection_task = asyncio.create_task(cerbo_collection_task_worker(object_id=object_id, object_name=object_name))
-        schedule_task = asyncio.create_task(energetic_schedule_task_worker(object_id))
+        collection_task = asyncio.create_task(
+            cerbo_collection_task_worker(
+                object_id=object_id,
+                object_name=object_name,
+                modbus_host=modbus_host,
+                modbus_port=modbus_port,
+            )
+        )
+        schedule_task = asyncio.create_task(
+            energetic_schedule_task_worker(object_id, modbus_host=modbus_host, modbus_port=modbus_port)
+        )
 
         self.tasks[object_id] = {
             "collection_task": collection_task,
             "schedule_task": schedule_task,
         }
+        self.endpoints[object_id] = (modbus_host, modbus_port)
         logger.info(f"Worker tasks started for object {object_id}")
 
     async def stop_worker(self, object_id: str):
@@ -37,4 +59,7 @@ class WorkerManager:
                 pass
 
         del self.tasks[object_id]
-        logger.info(f"Worker tasks stopped for object {object_id}")
\ No newline at end of file
+        endpoint = self.endpoints.pop(object_id, (None, None))
+        # пул закроет подключение, только если его не держит другой объект
+        await modbus_pool.release(*endpoint)
+        logger.info(f"Worker tasks stopped for object {object_id}")